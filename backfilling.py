@@ -0,0 +1,155 @@
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+
+from dateutil.relativedelta import relativedelta
+
+from nicehash import AlgorithmType
+from pipeline import ALGOS, TimeseriesCache, ts_dict_to_df, update_rig_registry
+from rollups import RollupStore
+from storage import STORAGES
+
+
+def to_timestamp(value: datetime):
+    return int(value.timestamp() * 1000)
+
+
+def backfill_windows(from_datetime: datetime, to_datetime: datetime, window: timedelta):
+    # (month, after, before) windows covering (from_datetime, to_datetime], none spanning two months so that each
+    # one is stored in a single monthly cache file
+    month = datetime(from_datetime.year, from_datetime.month, 1, tzinfo=timezone.utc)
+    while month < to_datetime:
+        next_month = month + relativedelta(months=1)
+        after, end = max(from_datetime, month), min(to_datetime, next_month)
+        while after < end:
+            before = min(after + window, end)
+            yield month, after, before
+            after = before
+        month = next_month
+
+
+class BackfillCheckpoint:
+    # completed windows, appended one line at a time, so that an interrupted backfill resumes after the last one
+    # stored; a line cut short by a crash matches no window, which is fetched again
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.completed = set()
+        if os.path.exists(filepath):
+            with open(filepath, 'r') as fp:
+                self.completed = {line.rstrip('\n') for line in fp}
+
+    @staticmethod
+    def key(rig_id, algorithm: AlgorithmType, after_timestamp, before_timestamp):
+        return f'{rig_id} {algorithm.name} {after_timestamp} {before_timestamp}'
+
+    def __contains__(self, key):
+        return key in self.completed
+
+    def add(self, key):
+        with open(self.filepath, 'a') as fp:
+            fp.write(f'{key}\n')
+        self.completed.add(key)
+
+
+def run_backfill(args, private_api):
+    # fetch the rig statistics of (args.from_datetime, args.to_datetime] in windows of args.window_hours per rig and
+    # algorithm, args.workers at once, into the monthly time series cache. The windows of a (month, rig, algorithm)
+    # are filled in memory and its file is written once all of them are fetched, then they are checkpointed; a
+    # failed window cuts the series at its start, so that neither the checkpoint nor the cache's high water mark
+    # pass it. Each month is rolled up once all its windows are stored. Returns the failed windows, which a new run
+    # with the same options fetches again, with the windows after them
+    org = private_api.organisation_id
+    storage = STORAGES[args.storage]()
+    checkpoint = BackfillCheckpoint(os.path.join('data', f'backfill_{org}.txt'))
+    rollups = None if args.no_rollups else RollupStore('data', storage)
+    registered_rigs = {rig['rigId']: rig['name'] for rig in private_api.iter_rigs()}
+
+    caches = {}
+    month_rig_ids = {}
+    # windows left to fetch and fetched per (month, rig_id, algo), and (month, rig_id, algo) left to write per month
+    pending = {}
+    fetched = {}
+    pending_series = {}
+    tasks = []
+    for month, after, before in backfill_windows(args.from_datetime, args.to_datetime,
+                                                 timedelta(hours=args.window_hours)):
+        if month not in caches:
+            caches[month] = TimeseriesCache('data', month, storage)
+            # the rigs of the month's registry, which keeps rigs since removed from the organization
+            month_rig_ids[month] = list(update_rig_registry(private_api, month, args.rigs, registered_rigs))
+            pending_series[month] = set()
+        after_timestamp, before_timestamp = to_timestamp(after), to_timestamp(before)
+        for rig_id in month_rig_ids[month]:
+            for algo in sorted(ALGOS):
+                if BackfillCheckpoint.key(rig_id, algo, after_timestamp, before_timestamp) not in checkpoint:
+                    tasks.append((month, rig_id, algo, after_timestamp, before_timestamp))
+                    pending[month, rig_id, algo] = pending.get((month, rig_id, algo), 0) + 1
+                    pending_series[month].add((month, rig_id, algo))
+    print(f'{len(tasks)} windows to fetch for {len(month_rig_ids)} months')
+
+    failures = {}
+    # start of the first failed window per (month, rig_id, algo)
+    holes = {}
+
+    def complete(month):
+        cache = caches.pop(month)
+        if rollups is not None:
+            for rig_id in month_rig_ids[month]:
+                for algo in ALGOS:
+                    cache.load(org, rig_id, algo)
+            start_timestamp = to_timestamp(max(args.from_datetime, month))
+            end_timestamp = to_timestamp(min(args.to_datetime, month + relativedelta(months=1)))
+            rig_frames = cache.rig_frames(org, month_rig_ids[month], end_timestamp)
+            rollups.update(org, rig_frames, start_timestamp, end_timestamp, True)
+        print(f'{month:%Y-%m} done')
+
+    def write(series):
+        # one rewrite of the series' file for all its windows, then their checkpoint
+        month, rig_id, algo = series
+        hole = holes.get(series)
+        caches[month].write(org, rig_id, algo, hole)
+        for after_timestamp, before_timestamp in sorted(fetched.pop(series, [])):
+            if hole is None or before_timestamp <= hole:
+                checkpoint.add(BackfillCheckpoint.key(rig_id, algo, after_timestamp, before_timestamp))
+        pending_series[month].discard(series)
+        if not pending_series[month] and not any(key[0] == month for key in holes):
+            complete(month)
+
+    def fetch(rig_id, algo, after_timestamp, before_timestamp):
+        return ts_dict_to_df(private_api.get_rig_stats(rig_id, after_timestamp, before_timestamp, algo))
+
+    for month in [month for month, series in pending_series.items() if not series]:
+        complete(month)
+    task_iterator = iter(tasks)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        # a bounded number of windows in flight, so that fetched frames are merged as they arrive
+        futures = {}
+        while True:
+            while len(futures) < 2 * args.workers:
+                task = next(task_iterator, None)
+                if task is None:
+                    break
+                futures[executor.submit(fetch, *task[1:])] = task
+            if not futures:
+                break
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                month, rig_id, algo, after_timestamp, before_timestamp = task = futures.pop(future)
+                series = (month, rig_id, algo)
+                try:
+                    df = future.result()
+                except Exception as err:
+                    failures[task] = err
+                    holes[series] = min(holes.get(series, after_timestamp), after_timestamp)
+                else:
+                    caches[month].fill(org, rig_id, algo, df, after_timestamp, before_timestamp)
+                    fetched.setdefault(series, []).append((after_timestamp, before_timestamp))
+                pending[series] -= 1
+                if pending[series] == 0:
+                    write(series)
+
+    for (month, rig_id, algo, after_timestamp, before_timestamp), err in failures.items():
+        print(f'Failed to fetch {rig_id} {algo.name} '
+              f'{datetime.fromtimestamp(after_timestamp / 1000, timezone.utc):%Y-%m-%d %H:%M}: {err}')
+    return failures
@@ -0,0 +1,133 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pipeline  # noqa: E402
+from benchmarks.mock_server import MockNicehash  # noqa: E402
+from metrics import compute_metrics, metrics_from_daily_totals  # noqa: E402
+from nicehash import TokenBucket, private_api  # noqa: E402
+from rollups import RollupStore  # noqa: E402
+from storage import STORAGES  # noqa: E402
+
+
+def measure(name, mock, memory, function, *args):
+    # wall time, requests served by the mock and, with memory, the tracemalloc peak of one stage
+    mock.reset_counters()
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = function(*args)
+    wall_time = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1] if memory else None
+    if memory:
+        tracemalloc.stop()
+    return result, {'stage': name, 'wall_time_s': wall_time, 'requests': mock.request_count,
+                    'errors': mock.error_count, 'bytes': mock.bytes_sent, 'peak_memory_bytes': peak_memory}
+
+
+def run_benchmark(options):
+    import matplotlib
+    matplotlib.use('Agg')
+
+    end_datetime = datetime.now(timezone.utc).replace(microsecond=0)
+    args = types.SimpleNamespace(end_datetime=end_datetime, monthly=False, days=options.days, rigs=[], label='bench',
+                                 org='bench-org', workers=options.workers, storage=options.storage,
+                                 stream=options.stream, export_csv=False, discord_id=None, discord_token=None,
+                                 publish_monthly=False, publish_daily=False, discord_webhooks=[], file_sink=None,
+                                 publish_retries=3, payout=False, no_rollups=False)
+    results = []
+    cwd = os.getcwd()
+    with MockNicehash(options.rigs, options.sample_interval, options.latency, options.error_rate) as mock, \
+            tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        os.makedirs('data')
+        rate_limiter = TokenBucket(options.rate_limit) if options.rate_limit else None
+        with private_api(mock.url, args.org, 'key', 'secret', pool_maxsize=options.workers,
+                         rate_limiter=rate_limiter, backoff_factor=0.01) as api:
+            start_datetime, end_datetime, nb_days, start_timestamp, end_timestamp = pipeline.report_window(
+                end_datetime, False, options.days)
+
+            rig_ids_names, result = measure('rigs', mock, options.memory, pipeline.update_rig_registry, api,
+                                            start_datetime, [])
+            results.append(result)
+
+            (_, rig_frames, _), result = measure('fetch', mock, options.memory, pipeline.fetch_stats, api,
+                                                 rig_ids_names, start_timestamp, end_timestamp, options.workers,
+                                                 None, options.stream)
+            results.append(result)
+
+            def merge(cache):
+                for rig_id, algo_frames in rig_frames.items():
+                    for algo, df in algo_frames.items():
+                        cache.merge(args.org, rig_id, algo, df)
+                return cache
+
+            for name in ('merge', 'merge_cached'):
+                cache = pipeline.TimeseriesCache('data', start_datetime, STORAGES[options.storage]())
+                _, result = measure(name, mock, options.memory, merge, cache)
+                results.append(result)
+
+            df_fleet, result = measure('fleet', mock, options.memory, pipeline.to_fleet, rig_frames)
+            results.append(result)
+
+            (df_daily_hours, df_results), result = measure('metrics', mock, options.memory, compute_metrics,
+                                                           df_fleet, rig_ids_names, nb_days)
+            results.append(result)
+
+            rollups = RollupStore('data', STORAGES[options.storage]())
+            _, result = measure('rollups', mock, options.memory, rollups.update, args.org, rig_frames, start_timestamp,
+                                end_timestamp)
+            results.append(result)
+
+            _, result = measure('rollup_metrics', mock, options.memory, lambda: metrics_from_daily_totals(
+                rollups.daily_totals(args.org, rig_frames, start_timestamp, end_timestamp), rig_ids_names, nb_days))
+            results.append(result)
+
+            _, result = measure('render', mock, options.memory, pipeline.render_report, df_daily_hours, df_results,
+                                args.label, args.org, start_datetime)
+            results.append(result)
+
+            args.monthly = True
+            _, result = measure('pipeline_monthly', mock, options.memory, pipeline.run, args, api)
+            results.append(result)
+            _, result = measure('pipeline_monthly_cached', mock, options.memory, pipeline.run, args, api)
+            results.append(result)
+        os.chdir(cwd)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pool_spy pipeline against a local mock API")
+    parser.add_argument('--rigs', type=int, default=40, help="Number of rigs")
+    parser.add_argument('--days', type=int, default=6, help="Lookback in days")
+    parser.add_argument('--sample_interval', type=int, default=300, help="Seconds between stats samples")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument('--error_rate', type=float, default=0.0, help="Share of requests answered 429 or 503")
+    parser.add_argument('--workers', type=int, default=8, help="Maximum concurrent API requests")
+    parser.add_argument('--rate_limit', type=float, help="Maximum API requests per second")
+    parser.add_argument('--storage', choices=STORAGES, default='mmap', help="Time series cache format")
+    parser.add_argument('--stream', action='store_true', help="Parse stats responses incrementally")
+    parser.add_argument('--memory', action='store_true', help="Trace peak memory (slows the stages down)")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    options = parser.parse_args()
+
+    results = run_benchmark(options)
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f'{"stage":<24}{"wall time (s)":>14}{"requests":>10}{"errors":>8}{"MB sent":>10}{"peak MB":>10}')
+        for result in results:
+            peak_memory = '' if result['peak_memory_bytes'] is None else f'{result["peak_memory_bytes"] / 1e6:.1f}'
+            print(f'{result["stage"]:<24}{result["wall_time_s"]:>14.3f}{result["requests"]:>10}'
+                  f'{result["errors"]:>8}{result["bytes"] / 1e6:>10.2f}{peak_memory:>10}')
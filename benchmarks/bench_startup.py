@@ -0,0 +1,90 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.mock_server import MockNicehash  # noqa: E402
+
+POOL_SPY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pool_spy.py')
+
+HEAVY_MODULES = ('requests', 'asyncio', 'aiohttp', 'numpy', 'pandas', 'matplotlib', 'discord')
+
+COMMANDS = {
+    'python': [],
+    'rigs': ['rigs'],
+    'balance': ['balance'],
+    'publish': ['publish'],
+    'stats': ['stats', '-d', '1'],
+    'report': ['report', '-d', '1'],
+}
+
+
+def command_line(name, url, import_time=False):
+    if name == 'python':
+        return [sys.executable] + (['-X', 'importtime'] if import_time else []) + ['-c', 'pass']
+    arguments = COMMANDS[name] + ['-o', 'bench-org']
+    if name != 'publish':
+        arguments += ['-b', url, '-k', 'key', '-s', 'secret']
+    return [sys.executable] + (['-X', 'importtime'] if import_time else []) + [POOL_SPY] + arguments
+
+
+def import_times(stderr):
+    # cumulative microseconds of the top-level imports, and which heavy modules were imported
+    total = 0
+    heavy = set()
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith('  '):
+            total += int(cumulative)
+        if name.strip() in HEAVY_MODULES:
+            heavy.add(name.strip())
+    return total, sorted(heavy, key=HEAVY_MODULES.index)
+
+
+def run_benchmark(options):
+    results = []
+    env = {**os.environ, 'MPLBACKEND': 'Agg'}
+    with MockNicehash(options.rigs) as mock, tempfile.TemporaryDirectory() as directory:
+        # publish needs a saved report
+        subprocess.run(command_line('report', mock.url), cwd=directory, env=env, check=True, capture_output=True)
+        for name in options.commands:
+            wall_times = []
+            for _ in range(options.repeat):
+                start = time.perf_counter()
+                subprocess.run(command_line(name, mock.url), cwd=directory, env=env, check=True,
+                               capture_output=True)
+                wall_times.append(time.perf_counter() - start)
+            process = subprocess.run(command_line(name, mock.url, True), cwd=directory, env=env, check=True,
+                                     capture_output=True, text=True)
+            import_time, heavy = import_times(process.stderr)
+            results.append({'command': name, 'min_wall_time_s': min(wall_times),
+                            'median_wall_time_s': statistics.median(wall_times), 'import_time_s': import_time / 1e6,
+                            'heavy_modules': heavy})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the start up of the pool_spy subcommands against a local "
+                                                 "mock API")
+    parser.add_argument('--rigs', type=int, default=10, help="Number of rigs")
+    parser.add_argument('--repeat', type=int, default=5, help="Runs per command")
+    parser.add_argument('--commands', nargs='+', choices=COMMANDS, default=list(COMMANDS), help="Commands to time")
+    parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+    options = parser.parse_args()
+
+    results = run_benchmark(options)
+    if options.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f'{"command":<10}{"min (s)":>10}{"median (s)":>12}{"imports (s)":>13}  heavy modules')
+        for result in results:
+            print(f'{result["command"]:<10}{result["min_wall_time_s"]:>10.3f}{result["median_wall_time_s"]:>12.3f}'
+                  f'{result["import_time_s"]:>13.3f}  {", ".join(result["heavy_modules"])}')
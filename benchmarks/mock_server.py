@@ -0,0 +1,232 @@
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATS_COLUMNS = ['time', 'speed_accepted', 'speed_rejected_r1_target', 'speed_rejected_r2_stale',
+                 'speed_rejected_r3_duplicate', 'speed_rejected_r4_ntime', 'speed_rejected_r5_other',
+                 'speed_rejected_total', 'profitability']
+
+MAX_CANDLESTICKS = 1000
+
+TRADE_INTERVAL_US = 200_000
+
+
+class MockNicehash:
+    # local stand-in for the NiceHash endpoints used by pool_spy.py, the order operations and the market data
+    # collector, serving deterministic exchange data and a deterministic fleet of rigs with one stats sample every
+    # sample_interval seconds, optional latency and a share of 429/503 errors
+
+    def __init__(self, nb_rigs=40, sample_interval=300, latency=0.0, error_rate=0.0, seed=0, host='127.0.0.1',
+                 port=0):
+        self.nb_rigs = nb_rigs
+        self.sample_interval = sample_interval
+        self.latency = latency
+        self.error_rate = error_rate
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+        self.bytes_sent = 0
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def reset_counters(self):
+        with self.lock:
+            self.request_count = 0
+            self.error_count = 0
+            self.bytes_sent = 0
+
+    def rig_ids(self):
+        return [f'0-mock-rig-{index:05d}' for index in range(self.nb_rigs)]
+
+    def rigs(self):
+        return {'miningRigs': [{'rigId': rig_id, 'name': f'rig{index % max(1, self.nb_rigs // 2)}',
+                                'minerStatus': 'MINING'}
+                               for index, rig_id in enumerate(self.rig_ids())],
+                'totalRigs': self.nb_rigs}
+
+    def stats(self, seed, algorithm, after_timestamp, before_timestamp):
+        # rigs mine a single algorithm, chosen from their seed
+        interval_ms = self.sample_interval * 1000
+        before_timestamp = int(time.time() * 1000) if before_timestamp is None else before_timestamp
+        data = []
+        if after_timestamp is not None and algorithm == (20, 60, 52, 57)[seed % 4]:
+            first = (after_timestamp // interval_ms + 1) * interval_ms
+            for timestamp in range(first, before_timestamp + 1, interval_ms):
+                sample = random.Random(hash((self.seed, seed, timestamp)))
+                speed = 0.0 if sample.random() < 0.2 else 30 + sample.random() * 30
+                data.append([timestamp, speed, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, speed * 2e-7])
+        return {'columns': STATS_COLUMNS, 'data': data}
+
+    def candlesticks(self, market, from_s, to_s, resolution):
+        # like the exchange, at most MAX_CANDLESTICKS candles per response whatever the range
+        step = resolution * 60
+        times = range((from_s + step - 1) // step * step, to_s + 1, step)[:MAX_CANDLESTICKS]
+        candles = []
+        for timestamp in times:
+            sample = random.Random(hash((self.seed, market, timestamp)))
+            open_price = 20000 + sample.random() * 1000
+            close_price = open_price * (0.99 + sample.random() * 0.02)
+            candles.append({'time': timestamp, 'open': open_price, 'close': close_price,
+                            'low': min(open_price, close_price) * 0.995, 'high': max(open_price, close_price) * 1.005,
+                            'volume': sample.random() * 10})
+        return candles
+
+    def trades(self, market, limit, before_us):
+        # one trade every TRADE_INTERVAL_US microseconds up to now, newest first
+        now_us = int(time.time() * 1e6)
+        before_us = now_us + 1 if before_us is None else min(before_us, now_us + 1)
+        last = (before_us - 1) // TRADE_INTERVAL_US * TRADE_INTERVAL_US
+        trades = []
+        for timestamp in range(last, last - limit * TRADE_INTERVAL_US, -TRADE_INTERVAL_US):
+            sample = random.Random(hash((self.seed, market, timestamp)))
+            trades.append({'id': f'{market}-{timestamp}', 'dir': 'BUY' if sample.random() < 0.5 else 'SELL',
+                           'price': 20000 + sample.random() * 1000, 'qty': sample.random(), 'time': timestamp})
+        return trades
+
+    def orderbook(self, market, limit):
+        sample = random.Random(hash((self.seed, market, int(time.time()))))
+        mid = 20000 + sample.random() * 1000
+        return {'buy': [[mid - level - sample.random(), sample.random()] for level in range(limit)],
+                'sell': [[mid + level + sample.random(), sample.random()] for level in range(limit)]}
+
+    def paginate(self, response, field, params):
+        # page numbered list endpoints, everything at once without a size
+        if 'size' not in params:
+            return response
+        size, page = int(params['size']), int(params.get('page', 0))
+        items = response[field]
+        return {**response, field: items[page * size:(page + 1) * size],
+                'pagination': {'size': size, 'page': page, 'totalPageCount': -(-len(items) // size)}}
+
+    def respond(self, method, path, params, body):
+        if path == '/main/api/v2/mining/rigs2':
+            return self.paginate(self.rigs(), 'miningRigs', params)
+        if path in ('/main/api/v2/mining/rig/stats/algo', '/main/api/v2/mining/rigs/stats/algo'):
+            rig_id = params.get('rigId')
+            seed = self.rig_ids().index(rig_id) if rig_id in self.rig_ids() else 0
+            after_timestamp = int(params['afterTimestamp']) if 'afterTimestamp' in params else None
+            before_timestamp = int(params['beforeTimestamp']) if 'beforeTimestamp' in params else None
+            return self.stats(seed, int(params.get('algorithm', 20)), after_timestamp, before_timestamp)
+        if path == '/exchange/api/v2/candlesticks':
+            return self.candlesticks(params['market'], int(params['from']), int(params['to']),
+                                     int(params['resolution']))
+        if path == '/exchange/api/v2/trades':
+            return self.trades(params['market'], int(params.get('limit', 25)),
+                               int(params['timestamp']) if 'timestamp' in params else None)
+        if path == '/exchange/api/v2/orderbook':
+            return self.orderbook(params['market'], int(params.get('limit', 25)))
+        if path == '/main/api/v2/accounting/accounts2/':
+            return {'total': {'currency': 'BTC', 'available': '0.01'}, 'currencies': []}
+        if path.startswith('/main/api/v2/accounting/account2/'):
+            return {'currency': path.rsplit('/', 1)[-1], 'available': '0.01', 'totalBalance': '0.01'}
+        if path == '/main/api/v2/accounting/withdrawalAddresses/':
+            addresses = [{'id': f'address-{index}', 'name': f'rig{index}', 'address': f'bc1mock{index}'}
+                         for index in range(self.nb_rigs)]
+            return self.paginate({'list': addresses}, 'list', params)
+        if path == '/main/api/v2/accounting/withdrawal/' and method == 'POST':
+            return {'id': f'withdrawal-{self.random.random()}'}
+        if path == '/main/api/v2/mining/algorithms/':
+            return {'miningAlgorithms': [{'algorithm': name, 'order': order, 'marketFactor': '1000000000000',
+                                          'displayMarketFactor': 'TH'}
+                                         for name, order in (('DAGGERHASHIMOTO', 20), ('ETCHASH', 60),
+                                                             ('KAWPOW', 52), ('AUTOLYKOS', 57))]}
+        if path.startswith('/main/api/v2/hashpower/order/'):
+            order_id = path[len('/main/api/v2/hashpower/order/'):].split('/')[0]
+            if method == 'DELETE':
+                return {'id': order_id, 'status': {'code': 'CANCELLED'}}
+            if method == 'POST' and order_id:
+                return {'id': order_id, **(body or {})}
+        return None
+
+    def handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle_request(self, method):
+                url = urllib.parse.urlsplit(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                with mock.lock:
+                    mock.request_count += 1
+                    error = mock.random.random() < mock.error_rate
+                    if error:
+                        mock.error_count += 1
+                if mock.latency:
+                    time.sleep(mock.latency)
+                if error:
+                    status, payload, headers = (429, {'error': 'rate limited'}, {'Retry-After': '0'}) \
+                        if mock.random.random() < 0.5 else (503, {'error': 'unavailable'}, {})
+                else:
+                    payload = mock.respond(method, url.path, params, body)
+                    status, headers = (200, {}) if payload is not None else (404, {})
+                    payload = {'error': 'not found'} if payload is None else payload
+                content = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(content)
+                with mock.lock:
+                    mock.bytes_sent += len(content)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def do_DELETE(self):
+                self.handle_request('DELETE')
+
+        return Handler
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rigs', type=int, default=40, help="Number of rigs")
+    parser.add_argument('--sample_interval', type=int, default=300, help="Seconds between stats samples")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument('--error_rate', type=float, default=0.0, help="Share of requests answered 429 or 503")
+    args = parser.parse_args()
+
+    mock = MockNicehash(args.rigs, args.sample_interval, args.latency, args.error_rate, port=args.port)
+    print(f'Serving a mock NiceHash API for {args.rigs} rigs on {mock.url}')
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,226 @@
+import os
+from time import monotonic, sleep, time
+
+import numpy as np
+import pandas as pd
+
+from nicehash import DEFAULT_PAGE_SIZE, DEFAULT_POOL_MAXSIZE, MAX_CANDLESTICKS
+from storage import ColumnSpill, MmapStorage, fill_timeseries
+
+# every time column is in epoch milliseconds, like the stats samples, so that prices can be joined to them
+TRADE_COLUMNS = {'time': np.int64, 'price': np.float64, 'qty': np.float64, 'side': np.int8}
+ORDERBOOK_COLUMNS = {'time': np.int64, 'side': np.int8, 'level': np.int16, 'price': np.float64, 'qty': np.float64}
+CANDLE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+SIDES = {'BUY': 1, 'SELL': -1}
+
+
+class RingBuffer:
+    # the last capacity rows of typed columns, appended in batches into preallocated arrays; the rows appended since
+    # the last take_pending are pending and may not be overwritten
+
+    def __init__(self, columns: dict, capacity):
+        self.columns = {name: np.empty(capacity, dtype) for name, dtype in columns.items()}
+        self.capacity = capacity
+        self.appended = 0
+        self.pending = 0
+
+    def __len__(self):
+        return min(self.appended, self.capacity)
+
+    def positions(self, count):
+        # positions of the last count rows, oldest first
+        return np.arange(self.appended - count, self.appended) % self.capacity
+
+    def append(self, df: pd.DataFrame):
+        if self.pending + len(df) > self.capacity:
+            raise ValueError(f'Appending {len(df)} rows would overwrite pending rows of a ring buffer of '
+                             f'{self.capacity} rows')
+        self.appended += len(df)
+        self.pending += len(df)
+        positions = self.positions(len(df))
+        for name, array in self.columns.items():
+            array[positions] = df[name].to_numpy()
+
+    def frame(self, count=None):
+        # the last count rows, all by default, oldest first
+        positions = self.positions(len(self) if count is None else min(count, len(self)))
+        return pd.DataFrame({name: array[positions] for name, array in self.columns.items()})
+
+    def take_pending(self):
+        df = self.frame(self.pending)
+        self.pending = 0
+        return df
+
+
+def trades_frame(trades):
+    return pd.DataFrame({'time': np.array([int(trade['time']) // 1000 for trade in trades], np.int64),
+                         'price': np.array([float(trade['price']) for trade in trades], np.float64),
+                         'qty': np.array([float(trade['qty']) for trade in trades], np.float64),
+                         'side': np.array([SIDES.get(trade.get('dir'), 0) for trade in trades], np.int8)},
+                        columns=list(TRADE_COLUMNS)).iloc[::-1].reset_index(drop=True)
+
+
+def orderbook_frame(response, timestamp):
+    # one row per price level of a snapshot, buy then sell side, best levels first
+    levels = [(SIDES[side.upper()], level, float(price), float(qty))
+              for side in ('buy', 'sell') for level, (price, qty) in enumerate(response.get(side) or [])]
+    sides, level_numbers, prices, quantities = zip(*levels) if levels else ((), (), (), ())
+    return pd.DataFrame({'time': np.full(len(levels), timestamp, np.int64), 'side': np.array(sides, np.int8),
+                         'level': np.array(level_numbers, np.int16), 'price': np.array(prices, np.float64),
+                         'qty': np.array(quantities, np.float64)}, columns=list(ORDERBOOK_COLUMNS))
+
+
+def candles_frame(candles):
+    # indexed by time in epoch ms, a candle returned by two chunks kept once
+    df = pd.DataFrame({'time': np.array([int(candle['time']) * 1000 for candle in candles], np.int64),
+                       **{column: np.array([float(candle.get(column, np.nan)) for candle in candles], np.float64)
+                          for column in CANDLE_COLUMNS}})
+    return df.drop_duplicates('time', keep='last').set_index('time').sort_index()
+
+
+def collect_candlesticks(public_api, market, from_s, to_s, resolution, directory, storage=None,
+                         workers=DEFAULT_POOL_MAXSIZE, size=MAX_CANDLESTICKS):
+    # fetch the candles of resolution minutes from from_s to to_s in concurrent chunks of at most size candles and
+    # store them in {directory}/candles_{market}_{resolution}m, replacing the stored candles of the chunks fetched;
+    # returns the candles fetched and the failed chunks
+    storage = MmapStorage() if storage is None else storage
+    filepath = os.path.join(directory, f'candles_{market}_{resolution}m{storage.extension}')
+    df_candles = storage.load(filepath)
+    frames = []
+    failed_chunks = {}
+    for result in public_api.get_candlestick_chunks(market, from_s, to_s, resolution, workers, size):
+        if not result.ok:
+            failed_chunks[result.key] = result.error
+            continue
+        start, end = result.key
+        df = candles_frame(result.response)
+        df_candles = fill_timeseries(df_candles, df, start * 1000, end * 1000 + 1)
+        frames.append(df)
+    if frames:
+        os.makedirs(directory, exist_ok=True)
+        storage.replace(filepath, df_candles)
+    df = pd.concat(frames) if frames else candles_frame([])
+    return df[~df.index.duplicated(keep='last')].sort_index(), failed_chunks
+
+
+class MarketDataCollector:
+    # polls the latest trades of markets every trades_interval seconds and their orderbook snapshots of
+    # orderbook_depth levels every orderbook_interval seconds, up to workers requests at once, into ring buffers of
+    # the last capacity rows per (kind, market). Pending rows are spilled to {directory}/{kind}_{market} once
+    # spill_rows of them accumulated and when the collector stops
+
+    def __init__(self, public_api, markets, directory, trades_interval=10, orderbook_interval=60, orderbook_depth=20,
+                 trades_limit=DEFAULT_PAGE_SIZE, capacity=100_000, spill_rows=10_000, workers=DEFAULT_POOL_MAXSIZE):
+        self.public_api = public_api
+        self.markets = list(markets)
+        self.trades_interval = trades_interval
+        self.orderbook_interval = orderbook_interval
+        self.orderbook_depth = orderbook_depth
+        self.trades_limit = trades_limit
+        self.spill_rows = min(spill_rows, capacity)
+        self.workers = workers
+        kinds = {'trades': TRADE_COLUMNS, 'orderbook': ORDERBOOK_COLUMNS}
+        self.buffers = {(kind, market): RingBuffer(columns, capacity) for kind, columns in kinds.items()
+                        for market in self.markets}
+        self.spills = {(kind, market): ColumnSpill(os.path.join(directory, f'{kind}_{market}')) for kind in kinds
+                       for market in self.markets}
+        # per market, the time in microseconds of the newest trade seen and the ids of the trades at that time, so
+        # that polls only keep newer trades. A restarted collector continues after the last spilled trade, whose
+        # time is in milliseconds: the trades of that millisecond are taken as seen
+        self.last_trades = {market: (self.last_spilled_time('trades', market), set()) for market in self.markets}
+        self.failures = {}
+
+    def last_spilled_time(self, kind, market):
+        df = self.spills[kind, market].load()
+        return None if df is None or len(df) == 0 else int(df['time'][len(df) - 1]) * 1000 + 999
+
+    def fetch_trades(self, market):
+        # the trades after the newest one seen, newest first, following older pages when a whole page is new
+        last_time, last_ids = self.last_trades[market]
+        if last_time is None:
+            return self.public_api.get_exchange_trades(market, self.trades_limit)
+        trades = []
+        for trade in self.public_api.iter_exchange_trades(market, self.trades_limit):
+            if int(trade['time']) < last_time:
+                break
+            if int(trade['time']) > last_time or trade.get('id') not in last_ids:
+                trades.append(trade)
+        return trades
+
+    def fetch_orderbook(self, market):
+        response = self.public_api.get_exchange_orderbook(market, self.orderbook_depth)
+        return orderbook_frame(response, int(time() * 1000))
+
+    def record(self, kind, market, df: pd.DataFrame):
+        buffer = self.buffers[kind, market]
+        if buffer.pending + len(df) > buffer.capacity:
+            self.spill(kind, market)
+        if len(df) > buffer.capacity:
+            # more rows than the buffer holds: only the last ones stay in memory
+            self.spills[kind, market].append(df.iloc[:-buffer.capacity])
+            df = df.iloc[-buffer.capacity:]
+        buffer.append(df)
+        if buffer.pending >= self.spill_rows:
+            self.spill(kind, market)
+
+    def record_trades(self, market, trades):
+        if not trades:
+            return
+        last_time, last_ids = self.last_trades[market]
+        newest_time = max(int(trade['time']) for trade in trades)
+        newest_ids = {trade.get('id') for trade in trades if int(trade['time']) == newest_time}
+        self.last_trades[market] = (newest_time, newest_ids | last_ids if newest_time == last_time else newest_ids)
+        self.record('trades', market, trades_frame(trades))
+
+    def poll(self, kinds):
+        # one concurrent round of requests for every market of kinds
+        fetches = {'trades': self.fetch_trades, 'orderbook': self.fetch_orderbook}
+        calls = [((kind, market), lambda kind=kind, market=market: fetches[kind](market))
+                 for kind in kinds for market in self.markets]
+        for result in self.public_api.run_bulk(calls, self.workers):
+            kind, market = result.key
+            if not result.ok:
+                self.failures[result.key] = self.failures.get(result.key, 0) + 1
+                print(f'Failed to poll {kind} of {market}: {result.error}')
+            elif kind == 'trades':
+                self.record_trades(market, result.response)
+            else:
+                self.record(kind, market, result.response)
+
+    def spill(self, kind, market):
+        self.spills[kind, market].append(self.buffers[kind, market].take_pending())
+
+    def spill_all(self):
+        for kind, market in self.buffers:
+            self.spill(kind, market)
+
+    def run(self, duration=None):
+        # poll until duration seconds passed or the collector is interrupted, then spill the pending rows
+        start = monotonic()
+        next_polls = {'trades': start, 'orderbook': start}
+        intervals = {'trades': self.trades_interval, 'orderbook': self.orderbook_interval}
+        try:
+            while duration is None or monotonic() - start < duration:
+                now = monotonic()
+                due = [kind for kind, next_poll in next_polls.items() if next_poll <= now]
+                if due:
+                    self.poll(due)
+                    for kind in due:
+                        # a late poll is not made up for, the next one is an interval after it
+                        next_polls[kind] = max(next_polls[kind] + intervals[kind], now)
+                wake_up = min(next_polls.values())
+                if duration is not None:
+                    wake_up = min(wake_up, start + duration)
+                sleep(max(0.0, wake_up - monotonic()))
+        finally:
+            self.spill_all()
+
+    def summary(self):
+        # rows in memory and spilled per (kind, market)
+        rows = []
+        for (kind, market), buffer in self.buffers.items():
+            df_spilled = self.spills[kind, market].load()
+            rows.append({'kind': kind, 'market': market, 'in memory': len(buffer),
+                         'spilled': 0 if df_spilled is None else len(df_spilled),
+                         'failed polls': self.failures.get((kind, market), 0)})
+        return pd.DataFrame(rows).set_index(['kind', 'market'])
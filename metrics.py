@@ -0,0 +1,156 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+MAX_SAMPLE_GAP_MS = 5 * 60 * 1000
+
+HOUR_MS = 60 * 60 * 1000
+
+FLEET_COLUMNS = ['rig', 'algo', 'time', 'speed_accepted', 'profitability']
+
+# values of the fleet frame the metrics are computed from: profitabilities are BTC/day around 1e-7 to 1e-5 per
+# sample, summed over a month of samples, which float32 would round away from the per-rig results
+FLEET_VALUE_DTYPE = np.float64
+
+# values of the compact fleet frame, only for views that do not sum them, e.g. the stats sample counts
+COMPACT_FLEET_VALUE_DTYPE = np.float32
+
+# bytes per sample of the fleet frame with default dtypes: int64 time, float64 values, object rig and algo
+DEFAULT_FLEET_SAMPLE_BYTES = 5 * 8
+
+RESULT_COLUMNS = ['hours/day', 'MH/s', '\u03BCBTC/day']
+
+TOTAL_COLUMNS = ['mining_ms', 'speed_ms', 'profitability_ms']
+
+
+def concatenate(arrays, dtype):
+    return np.concatenate(arrays, dtype=dtype) if arrays else np.empty(0, dtype)
+
+
+def to_fleet(rig_frames, since=None, value_dtype=FLEET_VALUE_DTYPE):
+    # one (rig, algo, time, speed_accepted, profitability) row per sample of {rig_id: {algo: df}}, df being time
+    # series indexed by time, limited to the samples from since on. Only these columns are kept: int64 epoch ms
+    # times, value_dtype values and categorical rig ids and algorithm names, each column filled with one copy from
+    # views of the time series
+    rig_ids = list(rig_frames)
+    algo_names = sorted({algo.name for algo_frames in rig_frames.values() for algo in algo_frames})
+    times, speeds, profitabilities, rig_codes, algo_codes, lengths = [], [], [], [], [], []
+    for rig_code, algo_frames in enumerate(rig_frames.values()):
+        for algo, df in algo_frames.items():
+            position = 0 if since is None else df.index.searchsorted(since)
+            if position == len(df):
+                continue
+            times.append(df.index.to_numpy()[position:])
+            speeds.append(df['speed_accepted'].to_numpy()[position:])
+            profitabilities.append(df['profitability'].to_numpy()[position:])
+            rig_codes.append(rig_code)
+            algo_codes.append(algo_names.index(algo.name))
+            lengths.append(len(times[-1]))
+    return pd.DataFrame({
+        'rig': pd.Categorical.from_codes(np.repeat(np.array(rig_codes, dtype=np.int32), lengths), rig_ids),
+        'algo': pd.Categorical.from_codes(np.repeat(np.array(algo_codes, dtype=np.int8), lengths), algo_names),
+        'time': concatenate(times, np.int64),
+        'speed_accepted': concatenate(speeds, value_dtype),
+        'profitability': concatenate(profitabilities, value_dtype),
+    }, columns=FLEET_COLUMNS, copy=False)
+
+
+def fleet_memory_report(df_fleet: pd.DataFrame, budget_mb=None):
+    # memory taken by each column of the fleet frame, against the same samples with default dtypes and the budget
+    usage = df_fleet.memory_usage(index=False, deep=True)
+    nb_samples = len(df_fleet)
+    total_mb = usage.sum() / 2 ** 20
+    default_mb = nb_samples * DEFAULT_FLEET_SAMPLE_BYTES / 2 ** 20
+    lines = [f'Fleet frame: {nb_samples} samples, {total_mb:.2f} MB ({usage.sum() / max(1, nb_samples):.1f} bytes per '
+             f'sample, {default_mb:.2f} MB or more with default dtypes)']
+    lines += [f'  {column:<16}{str(df_fleet[column].dtype):<10}{usage[column] / 2 ** 20:>10.2f} MB'
+              for column in df_fleet.columns]
+    if budget_mb is not None:
+        lines.append(f'  {"over" if total_mb > budget_mb else "within"} the {budget_mb:.2f} MB budget')
+    return os.linesep.join(lines)
+
+
+def by_rig_id(df_totals: pd.DataFrame):
+    # totals grouped by the categorical rig column, indexed by plain rig ids in order like the ones of other frames
+    df_totals.index = df_totals.index.set_levels(df_totals.index.levels[0].astype(object), level='rig')
+    return df_totals.sort_index()
+
+
+def active_intervals(df_fleet: pd.DataFrame):
+    # algorithms are summed per rig and sample, then each sample is kept with the time to the next sample of its
+    # rig when the accepted speed changed in between and the samples are at most 5 minutes apart
+    df = df_fleet.groupby(['rig', 'time'], sort=True, observed=True)[['speed_accepted', 'profitability']].sum()
+    df = df.reset_index()
+    df_next = df.groupby('rig', sort=False, observed=True)[['time', 'speed_accepted']].shift(-1)
+    speed_diff = df_next['speed_accepted'] - df['speed_accepted']
+    time_delta = df_next['time'] - df['time']
+    mask = speed_diff.notna() & (speed_diff != 0) & (time_delta <= MAX_SAMPLE_GAP_MS)
+    df = df[mask].copy()
+    df['time_delta'] = time_delta[mask].astype('int64')
+    return df
+
+
+def interval_totals(df: pd.DataFrame):
+    # mining milliseconds and speed and profitability weighted by mining milliseconds of active intervals
+    return pd.DataFrame({'mining_ms': df['time_delta'],
+                         'speed_ms': df['speed_accepted'] * df['time_delta'],
+                         'profitability_ms': df['profitability'] * df['time_delta']}, columns=TOTAL_COLUMNS)
+
+
+def daily_totals(df_fleet: pd.DataFrame):
+    # mining milliseconds and speed and profitability weighted by mining milliseconds per (rig, date); these add up
+    # across days, so days already totalled need not be recomputed when new samples arrive
+    df = active_intervals(df_fleet)
+    date = pd.to_datetime(df['time'], unit='ms', utc=True).dt.date.rename('date')
+    return by_rig_id(interval_totals(df).groupby([df['rig'], date], sort=True, observed=True).sum())
+
+
+def hourly_totals(df_fleet: pd.DataFrame):
+    # the same totals per (rig, hour), the hour being the timestamp of its start; an interval counts in the hour it
+    # starts in, like in daily_totals, so hourly totals add up to the daily ones
+    df = active_intervals(df_fleet)
+    hour = (df['time'] // HOUR_MS * HOUR_MS).astype('int64').rename('time')
+    return by_rig_id(interval_totals(df).groupby([df['rig'], hour], sort=True, observed=True).sum())
+
+
+def daily_totals_from_hourly(df_hourly_totals: pd.DataFrame):
+    # daily_totals from hourly_totals, leaving out the days without mining that daily_totals has no row for
+    date = pd.to_datetime(df_hourly_totals.index.get_level_values('time'), unit='ms', utc=True).date
+    df = df_hourly_totals.groupby([df_hourly_totals.index.get_level_values('rig'), pd.Index(date, name='date')],
+                                  sort=True).sum()
+    return df[df['mining_ms'] > 0]
+
+
+def update_daily_totals(df_daily_totals: pd.DataFrame, df_fleet: pd.DataFrame, since_date):
+    # replace the totals from since_date on with the ones of df_fleet, which must hold every sample from since_date on
+    df_kept = df_daily_totals[df_daily_totals.index.get_level_values('date') < since_date]
+    return pd.concat([df_kept, daily_totals(df_fleet)]).sort_index()
+
+
+def metrics_from_daily_totals(df_daily_totals: pd.DataFrame, rig_names: dict, nb_days: float):
+    # daily mining hours per rig name and hours/day, MH/s and uBTC/day averages over nb_days per rig name, for all
+    # rigs of rig_names (rig id -> name)
+    rig_ids = list(rig_names)
+
+    daily_hours = df_daily_totals['mining_ms'] / 1000 / 60 / 60
+    df_daily_hours = daily_hours.unstack('rig') if len(daily_hours) > 0 else pd.DataFrame()
+    df_daily_hours = df_daily_hours.reindex(columns=rig_ids).fillna(0).rename(columns=rig_names)
+    df_daily_hours = df_daily_hours.T.groupby(level=0, sort=True).sum().T
+    df_daily_hours.index.name = None
+    df_daily_hours.columns.name = None
+
+    df_totals = df_daily_totals.groupby(level='rig').sum().reindex(rig_ids, fill_value=0)
+    df_results = pd.DataFrame({
+        'hours/day': df_totals['mining_ms'] / 1000 / 60 / 60 / nb_days,
+        'MH/s': df_totals['speed_ms'] / 1000 / 60 / 60 / 24 / nb_days,
+        '\u03BCBTC/day': df_totals['profitability_ms'] / 1000 / 60 / 60 / 24 / nb_days * 10 ** 6
+    }, columns=RESULT_COLUMNS)
+    df_results.index = pd.Index([rig_names[rig_id] for rig_id in df_results.index], name='rig')
+    df_results = df_results.groupby('rig', sort=True).sum()
+    return df_daily_hours, df_results
+
+
+def compute_metrics(df_fleet: pd.DataFrame, rig_names: dict, nb_days: float):
+    # all rigs' daily hours and averages in one pass over the long-format fleet frame
+    return metrics_from_daily_totals(daily_totals(df_fleet), rig_names, nb_days)
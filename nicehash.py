@@ -1,14 +1,24 @@
+import bisect
+import collections
+import copy
+import functools
 import hmac
+import io
+import itertools
 import json
-import optparse
+import os
+import random
+import re
+import threading
 import urllib.parse
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from enum import IntEnum
 from hashlib import sha256
-from time import mktime
+from time import mktime, monotonic, perf_counter, sleep, time
 
 import requests
+import requests.adapters
 
 
 class AlgorithmType(IntEnum):
@@ -18,33 +28,760 @@ class AlgorithmType(IntEnum):
     AUTOLYKOS = 57  # ERGO
 
 
-class public_api:
-
-    def __init__(self, host, verbose=False):
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_FACTOR = 0.5
+# seconds to connect, and to wait for each read of the response, before a request attempt fails and may be retried
+DEFAULT_TIMEOUT = 30
+# server errors and dropped connections are only retried when replaying the request cannot duplicate its effect
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'DELETE'}
+# seconds the responses of slow-changing endpoints are kept by a ResponseCache
+DEFAULT_CACHE_TTLS = {
+    '/main/api/v2/public/buy/info/': 60 * 60,
+    '/main/api/v2/mining/algorithms/': 24 * 60 * 60,
+    '/main/api/v2/mining/markets/': 24 * 60 * 60,
+    '/main/api/v2/public/currencies/': 24 * 60 * 60,
+    '/main/api/v2/public/simplemultialgo/info/': 60,
+    '/main/api/v2/accounting/withdrawalAddresses/types/': 24 * 60 * 60,
+    '/main/api/v2/accounting/withdrawalAddresses/': 60 * 60,
+    '/main/api/v2/mining/rigs2': 5 * 60,
+}
+DEFAULT_PAGE_SIZE = 100
+# candles per candlesticks request, longer ranges are split into chunks of this size
+MAX_CANDLESTICKS = 1000
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ID_PATTERN = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}|\d+')
+
+
+class NicehashError(Exception):
+
+    def __init__(self, status_code, reason, content=None, retry_after=None):
+        message = str(status_code) + ": " + reason
+        if content:
+            message += ": " + str(content)
+        super().__init__(message)
+        self.status_code = status_code
+        self.reason = reason
+        self.content = content
+        self.retry_after = retry_after
+
+
+class ClientError(NicehashError):
+    pass
+
+
+class AuthError(ClientError):
+    pass
+
+
+class RateLimitError(ClientError):
+    pass
+
+
+class ServerError(NicehashError):
+    pass
+
+
+def response_error(status_code, reason, content, retry_after=None):
+    if status_code == 429:
+        error_type = RateLimitError
+    elif status_code in (401, 403):
+        error_type = AuthError
+    elif status_code >= 500:
+        error_type = ServerError
+    elif status_code >= 400:
+        error_type = ClientError
+    else:
+        error_type = NicehashError
+    return error_type(status_code, reason, content, parse_retry_after(retry_after))
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    from email.utils import parsedate_to_datetime
+    try:
+        retry_datetime = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_datetime - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket:
+
+    def __init__(self, rate, capacity=None):
+        # rate is in requests per second, capacity is the burst size
+        self.rate = rate
+        self.capacity = rate if capacity is None else capacity
+        self.tokens = self.capacity
+        self.timestamp = monotonic()
+        # end of the current pause, on the monotonic clock
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+
+    def reserve(self):
+        # take a token, borrowing from the future if the bucket is empty, and return the seconds to wait before
+        # the request may go out; callers queue up in reservation order
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+            return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds):
+        # hold back every caller sharing the bucket for seconds from now, e.g. for a Retry-After: reservations
+        # start after the pause, and callers that reserved earlier wait for it in paused_for. Pauses overlapping
+        # each other, e.g. of concurrent 429 responses, end at the latest deadline instead of adding up
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+            self.paused_until = max(self.paused_until, monotonic() + seconds)
+
+    def paused_for(self):
+        # seconds left of the current pause
+        with self.lock:
+            return max(0.0, self.paused_until - monotonic())
+
+
+class ResponseCache:
+    # LRU cache of the json responses of slow-changing GET endpoints, each kept for the TTL in seconds of its path;
+    # with a filepath the entries are saved after every store and loaded back by the next process
+
+    def __init__(self, ttls=None, maxsize=256, filepath=None):
+        self.ttls = dict(DEFAULT_CACHE_TTLS if ttls is None else ttls)
+        self.maxsize = maxsize
+        self.filepath = filepath
+        self.lock = threading.Lock()
+        # key -> (path, expiry timestamp, response), least recently used first
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if filepath is not None and os.path.exists(filepath):
+            with open(filepath, 'r') as fp:
+                entries = json.load(fp)
+            now = time()
+            self.entries.update((key, tuple(entry)) for key, entry in entries.items() if entry[1] > now)
+
+    def ttl(self, method, path):
+        return self.ttls.get(path) if method == 'GET' else None
+
+    def get(self, key):
+        # (True, response) or (False, None) when the key is missing or expired
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[1] <= time():
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            # callers may modify what they get
+            return True, copy.deepcopy(entry[2])
+
+    def put(self, key, path, response, ttl):
+        with self.lock:
+            self.entries[key] = (path, time() + ttl, copy.deepcopy(response))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            self.save()
+
+    def invalidate(self, path=None, scope=None):
+        # drop the entries of path, or of every path, whose key starts with scope, or of every client
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if (path is None or entry[0] == path) and (scope is None or key.startswith(scope)):
+                    del self.entries[key]
+            self.save()
+
+    def save(self):
+        if self.filepath is None:
+            return
+        tmp_filepath = self.filepath + '.tmp'
+        with open(tmp_filepath, 'w') as fp:
+            json.dump(self.entries, fp)
+        os.replace(tmp_filepath, self.filepath)
+
+
+class AlgorithmSettings:
+    # get_algorithms() response indexed by algorithm, to be built once and passed as algo_response to the order
+    # methods instead of the raw response they would scan on every call
+
+    def __init__(self, algo_response):
+        self.response = algo_response
+        self.settings = {item['algorithm']: item for item in algo_response['miningAlgorithms']}
+
+    def __getitem__(self, algorithm):
+        # algorithm is a name like 'SCRYPT' or an AlgorithmType
+        if isinstance(algorithm, AlgorithmType):
+            algorithm = algorithm.name
+        try:
+            return self.settings[algorithm]
+        except KeyError:
+            raise Exception('Settings for algorithm not found in algo_response parameter') from None
+
+    def __contains__(self, algorithm):
+        return (algorithm.name if isinstance(algorithm, AlgorithmType) else algorithm) in self.settings
+
+
+class BulkResult:
+    # outcome of one item of a bulk operation: its response, or the error it raised
+
+    def __init__(self, key, response=None, error=None):
+        self.key = key
+        self.response = response
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return f'BulkResult({self.key!r}, error={self.error!r})' if self.error else f'BulkResult({self.key!r})'
+
+
+class RequestEvent:
+    # timings in seconds of one request attempt, passed to the client hooks
+
+    def __init__(self, method, path, attempt):
+        self.method = method
+        self.path = path
+        self.endpoint = endpoint_label(path)
+        self.attempt = attempt
+        self.timestamp = time()
+        self.wait_time = 0.0
+        self.sign_time = 0.0
+        self.http_time = None
+        self.decode_time = None
+        self.status_code = None
+        self.response_bytes = 0
+        self.error = None
+        self.retried = False
+
+    def failed(self, error, retried):
+        self.error = error
+        self.retried = retried
+        return self
+
+
+def endpoint_label(path):
+    # ids in paths, e.g. order ids, would make a label per request
+    return '/'.join('{id}' if ID_PATTERN.fullmatch(segment) else segment for segment in path.split('/'))
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        return list(itertools.accumulate(self.counts))
+
+
+class ClientMetrics:
+    # client hook aggregating RequestEvents per (method, endpoint) into latency histograms and request, status,
+    # byte, retry and error counters, exported as Prometheus text or JSON
+
+    histograms = {
+        'wait': 'Seconds waited for the rate limiter',
+        'sign': 'Seconds spent signing the request',
+        'http': 'Seconds from sending the request to receiving the response headers, or the body when not streamed',
+        'decode': 'Seconds spent reading and decoding the response body',
+    }
+
+    def __init__(self, buckets=LATENCY_BUCKETS, prefix='nicehash_client'):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def __call__(self, event: RequestEvent):
+        with self.lock:
+            key = (event.method, event.endpoint)
+            if key not in self.series:
+                self.series[key] = {'histograms': {name: Histogram(self.buckets) for name in self.histograms},
+                                    'statuses': {}, 'errors': {}, 'requests': 0, 'retries': 0, 'bytes': 0}
+            series = self.series[key]
+            series['requests'] += 1
+            series['bytes'] += event.response_bytes
+            status = 'error' if event.status_code is None else str(event.status_code)
+            series['statuses'][status] = series['statuses'].get(status, 0) + 1
+            if event.error is not None:
+                error = type(event.error).__name__
+                series['errors'][error] = series['errors'].get(error, 0) + 1
+            if event.retried:
+                series['retries'] += 1
+            for name, value in (('wait', event.wait_time), ('sign', event.sign_time), ('http', event.http_time),
+                                ('decode', event.decode_time)):
+                if value is not None:
+                    series['histograms'][name].observe(value)
+
+    def to_json(self):
+        with self.lock:
+            return [{'method': method, 'endpoint': endpoint, 'requests': series['requests'],
+                     'retries': series['retries'], 'response_bytes': series['bytes'],
+                     'statuses': dict(series['statuses']), 'errors': dict(series['errors']),
+                     'latency': {name: {'buckets': dict(zip(self.buckets, histogram.cumulative_counts())),
+                                        'count': histogram.count, 'sum': histogram.sum}
+                                 for name, histogram in series['histograms'].items()}}
+                    for (method, endpoint), series in sorted(self.series.items())]
+
+    def to_prometheus(self):
+        lines = []
+
+        def counter(name, help, samples):
+            lines.append(f'# HELP {self.prefix}_{name} {help}')
+            lines.append(f'# TYPE {self.prefix}_{name} counter')
+            lines.extend(f'{self.prefix}_{name}{{{labels}}} {value}' for labels, value in samples)
+
+        with self.lock:
+            items = sorted(self.series.items())
+            labels = {key: f'method="{key[0]}",endpoint="{key[1]}"' for key, _ in items}
+            counter('requests_total', 'Request attempts', [(labels[key], series['requests']) for key, series in items])
+            counter('responses_total', 'Request attempts per status code, error when no response was received',
+                    [(f'{labels[key]},status="{status}"', count) for key, series in items
+                     for status, count in sorted(series['statuses'].items())])
+            counter('errors_total', 'Failed request attempts per error type',
+                    [(f'{labels[key]},error="{error}"', count) for key, series in items
+                     for error, count in sorted(series['errors'].items())])
+            counter('retries_total', 'Request attempts that were retried',
+                    [(labels[key], series['retries']) for key, series in items])
+            counter('response_bytes_total', 'Response body bytes', [(labels[key], series['bytes'])
+                                                                     for key, series in items])
+            for name, help in self.histograms.items():
+                metric = f'{self.prefix}_{name}_duration_seconds'
+                lines.append(f'# HELP {metric} {help}')
+                lines.append(f'# TYPE {metric} histogram')
+                for key, series in items:
+                    histogram = series['histograms'][name]
+                    for bucket, count in zip(self.buckets, histogram.cumulative_counts()):
+                        lines.append(f'{metric}_bucket{{{labels[key]},le="{bucket}"}} {count}')
+                    lines.append(f'{metric}_bucket{{{labels[key]},le="+Inf"}} {histogram.count}')
+                    lines.append(f'{metric}_sum{{{labels[key]}}} {histogram.sum}')
+                    lines.append(f'{metric}_count{{{labels[key]}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filepath):
+        with open(filepath, 'w') as fp:
+            if filepath.endswith('.json'):
+                json.dump(self.to_json(), fp, indent=2)
+            else:
+                fp.write(self.to_prometheus())
+
+
+def next_page(response, page):
+    # page numbered endpoints report their number of pages
+    pagination = response.get('pagination') or {}
+    return page + 1 if page + 1 < pagination.get('totalPageCount', 0) else None
+
+
+class TimestampPages:
+    # cursor of the timestamp cursored endpoints, which return the limit items older than the cursor, newest first
+    # and have no page numbers. A full page continues from one unit after its last item's timestamp, so that items
+    # sharing it across the page boundary are requested again, and those already yielded are dropped by id
+
+    def __init__(self, limit, field, to_timestamp):
+        self.limit = limit
+        self.field = field
+        self.to_timestamp = to_timestamp
+        self.boundary_timestamp = None
+        self.boundary_ids = set()
+
+    @staticmethod
+    def page_items(response):
+        return response['list'] if isinstance(response, dict) else response
+
+    def next_cursor(self, response, cursor):
+        items = self.page_items(response)
+        if len(items) < self.limit:
+            return None
+        last_timestamp = self.to_timestamp(items[-1][self.field])
+        if cursor is not None and last_timestamp + 1 >= cursor:
+            # a whole page shares one timestamp: the items of that timestamp beyond the page cannot be requested,
+            # continue strictly before it rather than request the same page forever
+            return last_timestamp
+        return last_timestamp + 1
+
+    def items(self, response):
+        items = []
+        for item in self.page_items(response):
+            timestamp = self.to_timestamp(item[self.field])
+            if timestamp == self.boundary_timestamp and item.get('id') in self.boundary_ids:
+                continue
+            if timestamp != self.boundary_timestamp:
+                self.boundary_timestamp, self.boundary_ids = timestamp, set()
+            self.boundary_ids.add(item.get('id'))
+            items.append(item)
+        return items
+
+
+def candlestick_chunks(from_s, to_s, resolution, size=MAX_CANDLESTICKS):
+    # (from_s, to_s) ranges of at most size candles of resolution minutes covering from_s to to_s; a candle on the
+    # boundary of two chunks may be returned by both
+    step = size * resolution * 60
+    return [(start, min(start + step, to_s)) for start in range(from_s, to_s, step)] or [(from_s, to_s)]
+
+
+def epoch_ms(value):
+    # timestamps come as epoch milliseconds or ISO 8601 strings
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp() * 1000)
+    return int(value)
+
+
+def create_session(pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False,
+                   keep_alive=True):
+    # pool_connections is the number of hosts to keep pools for, pool_maxsize the connections kept per host,
+    # pool_block turns pool_maxsize into a hard per-host limit instead of opening throwaway connections
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                            pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+    return session
+
+
+class base_api:
+
+    def __init__(self, host, verbose=False, session=None, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, pool_block=False, keep_alive=True, rate_limiter=None,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR, hooks=None, cache=None,
+                 timeout=DEFAULT_TIMEOUT):
         self.host = host
         self.verbose = verbose
+        # a session passed in is shared with other clients and stays open when this client is closed
+        self.owns_session = session is None
+        self.session = create_session(pool_connections, pool_maxsize, pool_block, keep_alive) \
+            if session is None else session
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        # None waits forever, so a hung connection would block its caller, e.g. every later tick of --watch
+        self.timeout = timeout
+        # callables receiving a RequestEvent after every attempt, e.g. a ClientMetrics or a tracer adapter
+        self.hooks = [] if hooks is None else list(hooks)
+        # ResponseCache of the slow-changing endpoints, which may be shared with other clients
+        self.cache = cache
+
+    def close(self):
+        if self.owns_session:
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def headers(self, method, path, query, body_json):
+        return None
+
+    def retry_delay(self, method, attempt, err):
+        # seconds to wait before retrying after err, or None to give up
+        if attempt >= self.max_retries:
+            return None
+        if not isinstance(err, RateLimitError) and (method not in IDEMPOTENT_METHODS or isinstance(err, ClientError)):
+            return None
+        delay = self.backoff_factor * 2 ** attempt * random.uniform(0.5, 1)
+        if isinstance(err, RateLimitError):
+            if err.retry_after is not None:
+                delay = err.retry_after
+            if self.rate_limiter is not None:
+                # the retry waits for the paused bucket when it reserves its token, like every other caller
+                self.rate_limiter.pause(delay)
+                return 0.0
+        return delay
+
+    def cache_scope(self):
+        # responses are only shared between clients of the same scope
+        return self.host
+
+    def cache_key(self, method, path, query):
+        return f'{self.cache_scope()}|{method} {path}?{query}'
+
+    def invalidate_cache(self, path=None):
+        # drop the cached responses of this client's scope, of path only if given
+        if self.cache is not None:
+            self.cache.invalidate(path, self.cache_scope() + '|')
+
+    def cached_response(self, method, path, query, parse):
+        # (key to cache the response under, None if not cacheable, whether it was cached, cached response)
+        if self.cache is None or parse is not None or self.cache.ttl(method, path) is None:
+            return None, False, None
+        key = self.cache_key(method, path, query)
+        return (key,) + self.cache.get(key)
+
+    def cache_response(self, key, path, response):
+        if key is not None:
+            self.cache.put(key, path, response, self.cache.ttl('GET', path))
+
+    def iterate_pages(self, fetch_page, cursor, next_cursor, items):
+        # yield the items of the fetch_page(cursor) responses from the given cursor on, requesting the next page in
+        # the background while the caller consumes the current one; next_cursor(response, cursor) is None after the
+        # last page, so at most two pages are held at once
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fetch_page, cursor)
+            while future is not None:
+                response = future.result()
+                cursor = next_cursor(response, cursor)
+                future = None if cursor is None else executor.submit(fetch_page, cursor)
+                yield from items(response)
+
+    def run_bulk(self, calls, workers):
+        # run (key, function) calls, workers at a time, into BulkResults in call order; one failing call does not
+        # stop the others
+        from concurrent.futures import ThreadPoolExecutor
+
+        def run(call):
+            key, function = call
+            try:
+                return BulkResult(key, function())
+            except Exception as err:
+                return BulkResult(key, error=err)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(run, calls))
+
+    def emit(self, event):
+        for hook in self.hooks:
+            hook(event)
+
+    def request(self, method, path, query, body, parse=None):
+        # parse, if given, reads the body of a successful response from a binary file object instead of json
+        cache_key, cached, result = self.cached_response(method, path, query, parse)
+        if cached:
+            return result
 
-    def request(self, method, path, query, body):
         url = self.host + path
         if query:
             url += '?' + query
 
-        if self.verbose:
-            print(method, url)
+        body_json = json.dumps(body) if body else None
+
+        for attempt in itertools.count():
+            event = RequestEvent(method, path, attempt)
+            if self.rate_limiter is not None:
+                event.wait_time = self.rate_limiter.reserve()
+                sleep(event.wait_time)
+                # a pause started meanwhile, e.g. for another caller's 429, holds back this request too
+                pause = self.rate_limiter.paused_for()
+                while pause > 0:
+                    event.wait_time += pause
+                    sleep(pause)
+                    pause = self.rate_limiter.paused_for()
+
+            if self.verbose:
+                print(method, url)
+
+            # headers are rebuilt on every attempt so a retry gets a fresh signature and nonce
+            start = perf_counter()
+            headers = self.headers(method, path, query, body_json)
+            event.sign_time = perf_counter() - start
+            try:
+                start = perf_counter()
+                response = self.session.request(method, url, headers=headers, data=body_json,
+                                                stream=parse is not None, timeout=self.timeout)
+                event.http_time = perf_counter() - start
+            except (requests.ConnectionError, requests.Timeout) as err:
+                delay = self.retry_delay(method, attempt, err)
+                self.emit(event.failed(err, delay is not None))
+                if delay is None:
+                    raise
+            else:
+                event.status_code = response.status_code
+                if response.status_code == 200:
+                    start = perf_counter()
+                    try:
+                        if parse is not None:
+                            response.raw.decode_content = True
+                            with response:
+                                result = parse(response.raw)
+                            event.response_bytes = response.raw.tell()
+                        else:
+                            result = response.json()
+                            event.response_bytes = len(response.content)
+                    except Exception as err:
+                        self.emit(event.failed(err, False))
+                        raise
+                    event.decode_time = perf_counter() - start
+                    self.emit(event)
+                    self.cache_response(cache_key, path, result)
+                    return result
+                event.response_bytes = len(response.content)
+                err = response_error(response.status_code, response.reason, response.content,
+                                     response.headers.get('Retry-After'))
+                delay = self.retry_delay(method, attempt, err)
+                self.emit(event.failed(err, delay is not None))
+                if delay is None:
+                    raise err
+            sleep(delay)
+
+
+class async_base_api(base_api):
+    # asyncio transport for the endpoint methods of public_api and private_api: subclasses list the endpoint class
+    # first so its methods return awaitables built on the coroutine request below
+
+    def __init__(self, host, verbose=False, session=None, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, keep_alive=True, rate_limiter=None,
+                 max_retries=DEFAULT_MAX_RETRIES, backoff_factor=DEFAULT_BACKOFF_FACTOR, hooks=None, cache=None,
+                 timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.verbose = verbose
+        self.owns_session = session is None
+        self.session = session
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        # callables receiving a RequestEvent after every attempt, e.g. a ClientMetrics or a tracer adapter
+        self.hooks = [] if hooks is None else list(hooks)
+        # ResponseCache of the slow-changing endpoints, which may be shared with other clients
+        self.cache = cache
+
+    def get_session(self):
+        # aiohttp sessions must be created inside the running event loop
+        if self.session is None:
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=self.pool_connections * self.pool_maxsize,
+                                             limit_per_host=self.pool_maxsize, force_close=not self.keep_alive)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def close(self):
+        if self.owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def __enter__(self):
+        raise TypeError('use "async with" with ' + type(self).__name__)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def iterate_pages(self, fetch_page, cursor, next_cursor, items):
+        import asyncio
+
+        task = asyncio.ensure_future(fetch_page(cursor))
+        try:
+            while task is not None:
+                response = await task
+                cursor = next_cursor(response, cursor)
+                task = None if cursor is None else asyncio.ensure_future(fetch_page(cursor))
+                for item in items(response):
+                    yield item
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def run_bulk(self, calls, workers):
+        import asyncio
+
+        semaphore = asyncio.Semaphore(workers)
+
+        async def run(key, function):
+            async with semaphore:
+                try:
+                    return BulkResult(key, await function())
+                except Exception as err:
+                    return BulkResult(key, error=err)
+
+        return list(await asyncio.gather(*(run(key, function) for key, function in calls)))
+
+    async def request(self, method, path, query, body, parse=None):
+        import asyncio
+        import aiohttp
+
+        cache_key, cached, result = self.cached_response(method, path, query, parse)
+        if cached:
+            return result
 
-        s = requests.Session()
-        if body:
-            body_json = json.dumps(body)
-            response = s.request(method, url, data=body_json)
-        else:
-            response = s.request(method, url)
+        url = self.host + path
+        if query:
+            url += '?' + query
 
-        if response.status_code == 200:
-            return response.json()
-        elif response.content:
-            raise Exception(str(response.status_code) + ": " + response.reason + ": " + str(response.content))
-        else:
-            raise Exception(str(response.status_code) + ": " + response.reason)
+        body_json = json.dumps(body) if body else None
+
+        for attempt in itertools.count():
+            event = RequestEvent(method, path, attempt)
+            if self.rate_limiter is not None:
+                event.wait_time = self.rate_limiter.reserve()
+                await asyncio.sleep(event.wait_time)
+                pause = self.rate_limiter.paused_for()
+                while pause > 0:
+                    event.wait_time += pause
+                    await asyncio.sleep(pause)
+                    pause = self.rate_limiter.paused_for()
+
+            if self.verbose:
+                print(method, url)
+
+            start = perf_counter()
+            headers = self.headers(method, path, query, body_json)
+            event.sign_time = perf_counter() - start
+            try:
+                start = perf_counter()
+                timeout = aiohttp.ClientTimeout(sock_connect=self.timeout, sock_read=self.timeout)
+                async with self.get_session().request(method, url, headers=headers, data=body_json,
+                                                      timeout=timeout) as response:
+                    content = await response.read()
+                event.http_time = perf_counter() - start
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as err:
+                delay = self.retry_delay(method, attempt, err)
+                self.emit(event.failed(err, delay is not None))
+                if delay is None:
+                    raise
+            else:
+                event.status_code = response.status
+                event.response_bytes = len(content)
+                if response.status == 200:
+                    start = perf_counter()
+                    try:
+                        result = parse(io.BytesIO(content)) if parse is not None else json.loads(content)
+                    except Exception as err:
+                        self.emit(event.failed(err, False))
+                        raise
+                    event.decode_time = perf_counter() - start
+                    self.emit(event)
+                    self.cache_response(cache_key, path, result)
+                    return result
+                err = response_error(response.status, response.reason, content, response.headers.get('Retry-After'))
+                delay = self.retry_delay(method, attempt, err)
+                self.emit(event.failed(err, delay is not None))
+                if delay is None:
+                    raise err
+            await asyncio.sleep(delay)
+
+
+class public_api(base_api):
 
     def get_current_global_stats(self):
         return self.request('GET', '/main/api/v2/public/stats/global/current/', '', None)
@@ -76,27 +813,47 @@ class public_api:
     def get_exchange_markets_info(self):
         return self.request('GET', '/exchange/api/v2/info/status', '', None)
 
-    def get_exchange_trades(self, market):
-        return self.request('GET', '/exchange/api/v2/trades', 'market=' + market, None)
+    def get_exchange_trades(self, market, limit=None, timestamp=None):
+        # the limit trades before timestamp, in microseconds, newest first
+        query = 'market=' + market
+        if limit is not None:
+            query += f'&direction=DESC&limit={limit}'
+        if timestamp is not None:
+            query += f'&timestamp={timestamp}'
+        return self.request('GET', '/exchange/api/v2/trades', query, None)
+
+    def iter_exchange_trades(self, market, limit=DEFAULT_PAGE_SIZE):
+        # every trade of market, newest first
+        pages = TimestampPages(limit, 'time', int)
+        return self.iterate_pages(lambda timestamp: self.get_exchange_trades(market, limit, timestamp), None,
+                                  pages.next_cursor, pages.items)
 
     def get_candlesticks(self, market, from_s, to_s, resolution):
         return self.request('GET', '/exchange/api/v2/candlesticks',
                             "market={}&from={}&to={}&resolution={}".format(market, from_s, to_s, resolution), None)
 
+    def get_candlestick_chunks(self, market, from_s, to_s, resolution, workers=DEFAULT_POOL_MAXSIZE,
+                               size=MAX_CANDLESTICKS):
+        # the candles of a long range as BulkResults of candlestick_chunks requests, keyed by chunk, in order
+        return self.run_bulk([((start, end), functools.partial(self.get_candlesticks, market, start, end, resolution))
+                              for start, end in candlestick_chunks(from_s, to_s, resolution, size)], workers)
+
     def get_exchange_orderbook(self, market, limit):
         return self.request('GET', '/exchange/api/v2/orderbook', "market={}&limit={}".format(market, limit), None)
 
 
-class private_api:
+class private_api(base_api):
 
-    def __init__(self, host, organisation_id, key, secret, verbose=False):
+    def __init__(self, host, organisation_id, key, secret, verbose=False, **kwargs):
+        super().__init__(host, verbose, **kwargs)
         self.key = key
         self.secret = secret
         self.organisation_id = organisation_id
-        self.host = host
-        self.verbose = verbose
 
-    def request(self, method, path, query, body):
+    def cache_scope(self):
+        return f'{self.host} {self.organisation_id}'
+
+    def headers(self, method, path, query, body_json):
 
         xtime = self.get_epoch_ms()
         xnonce = str(uuid.uuid4())
@@ -117,15 +874,14 @@ class private_api:
         message += bytearray('\x00', 'utf-8')
         message += bytearray(query, 'utf-8')
 
-        if body:
-            body_json = json.dumps(body)
+        if body_json:
             message += bytearray('\x00', 'utf-8')
             message += bytearray(body_json, 'utf-8')
 
         digest = hmac.new(bytearray(self.secret, 'utf-8'), message, sha256).hexdigest()
         xauth = self.key + ":" + digest
 
-        headers = {
+        return {
             'X-Time': str(xtime),
             'X-Nonce': xnonce,
             'X-Auth': xauth,
@@ -134,42 +890,20 @@ class private_api:
             'X-Request-Id': str(uuid.uuid4())
         }
 
-        s = requests.Session()
-        s.headers = headers
-
-        url = self.host + path
-        if query:
-            url += '?' + query
-
-        if self.verbose:
-            print(method, url)
-
-        if body:
-            response = s.request(method, url, data=body_json)
-        else:
-            response = s.request(method, url)
-
-        if response.status_code == 200:
-            return response.json()
-        elif response.content:
-            raise Exception(str(response.status_code) + ": " + response.reason + ": " + str(response.content))
-        else:
-            raise Exception(str(response.status_code) + ": " + response.reason)
-
-    def get_epoch_ms(self, time=datetime.now()):
+    def get_epoch_ms(self, time=None):
+        if time is None:
+            time = datetime.now()
         time_ec_since_epoch = mktime(time.timetuple()) + time.microsecond / 1000000.0
         return int(time_ec_since_epoch * 1000)
 
     def algo_settings_from_response(self, algorithm, algo_response):
-        algo_setting = None
-        for item in algo_response['miningAlgorithms']:
-            if item['algorithm'] == algorithm:
-                algo_setting = item
-
-        if algo_setting is None:
-            raise Exception('Settings for algorithm not found in algo_response parameter')
+        # algo_response is an AlgorithmSettings or a get_algorithms() response, which is indexed on every call
+        if not isinstance(algo_response, AlgorithmSettings):
+            algo_response = AlgorithmSettings(algo_response)
+        return algo_response[algorithm]
 
-        return algo_setting
+    def get_algorithms(self):
+        return self.request('GET', '/main/api/v2/mining/algorithms/', '', None)
 
     def get_accounts(self):
         return self.request('GET', '/main/api/v2/accounting/accounts2/', '', None)
@@ -183,6 +917,10 @@ class private_api:
 
         return self.request('GET', '/main/api/v2/accounting/withdrawalAddresses/', params, None)
 
+    def iter_withdrawal_addresses(self, currency, size=DEFAULT_PAGE_SIZE):
+        return self.iterate_pages(lambda page: self.get_withdrawal_addresses(currency, size, page), 0, next_page,
+                                  lambda response: response['list'])
+
     def get_withdrawal_types(self):
         return self.request('GET', '/main/api/v2/accounting/withdrawalAddresses/types/', '', None)
 
@@ -197,13 +935,18 @@ class private_api:
     def cancel_withdraw_request(self, withdrawal_id, currency):
         return self.request('DELETE', f'main/api/v2/accounting/withdrawal/{currency}/{withdrawal_id}', '', None)
 
-    def get_my_active_orders(self, algorithm, market, limit):
-
-        ts = self.get_epoch_ms()
+    def get_my_active_orders(self, algorithm, market, limit, ts=None):
+        # the limit orders last updated before ts, in milliseconds, or now
+        ts = self.get_epoch_ms() if ts is None else ts
         params = "algorithm={}&market={}&ts={}&limit={}&op=LT".format(algorithm, market, ts, limit)
 
         return self.request('GET', '/main/api/v2/hashpower/myOrders', params, None)
 
+    def iter_my_active_orders(self, algorithm, market, limit=DEFAULT_PAGE_SIZE):
+        pages = TimestampPages(limit, 'updatedTs', epoch_ms)
+        return self.iterate_pages(lambda ts: self.get_my_active_orders(algorithm, market, limit, ts), None,
+                                  pages.next_cursor, pages.items)
+
     def create_pool(self, name, algorithm, pool_host, pool_port, username, password):
         pool_data = {
             "name": name,
@@ -284,11 +1027,49 @@ class private_api:
         return self.request('POST', '/main/api/v2/hashpower/order/' + order_id + '/updatePriceAndLimit/', '',
                             price_data)
 
+    def update_hashpower_order(self, order_id, algorithm, algo_response, price=None, limit=None):
+        if price is not None and limit is not None:
+            return self.set_price_and_limit_hashpower_order(order_id, price, limit, algorithm, algo_response)
+        if price is not None:
+            return self.set_price_hashpower_order(order_id, price, algorithm, algo_response)
+        if limit is not None:
+            return self.set_limit_hashpower_order(order_id, limit, algorithm, algo_response)
+        raise ValueError('price or limit must be given')
+
+    # bulk operations run workers requests at a time and return a BulkResult per order, keyed by order id, in input
+    # order; pass an AlgorithmSettings as algo_response and size the connection pool for workers
+
+    def update_hashpower_orders(self, updates, algo_response, workers=DEFAULT_POOL_MAXSIZE):
+        # updates are (order_id, algorithm, price, limit) with price or limit None to leave it unchanged
+        return self.run_bulk([(order_id, functools.partial(self.update_hashpower_order, order_id, algorithm,
+                                                           algo_response, price, limit))
+                              for order_id, algorithm, price, limit in updates], workers)
+
+    def refill_hashpower_orders(self, refills, workers=DEFAULT_POOL_MAXSIZE):
+        # refills are (order_id, amount)
+        return self.run_bulk([(order_id, functools.partial(self.refill_hashpower_order, order_id, amount))
+                              for order_id, amount in refills], workers)
+
+    def cancel_hashpower_orders(self, order_ids, workers=DEFAULT_POOL_MAXSIZE):
+        return self.run_bulk([(order_id, functools.partial(self.cancel_hashpower_order, order_id))
+                              for order_id in order_ids], workers)
+
     def get_my_exchange_orders(self, market):
         return self.request('GET', '/exchange/api/v2/myOrders', 'market=' + market, None)
 
-    def get_my_exchange_trades(self, market):
-        return self.request('GET', '/exchange/api/v2/myTrades', 'market=' + market, None)
+    def get_my_exchange_trades(self, market, limit=None, timestamp=None):
+        # the limit trades before timestamp, in microseconds, newest first
+        query = 'market=' + market
+        if limit is not None:
+            query += f'&direction=DESC&limit={limit}'
+        if timestamp is not None:
+            query += f'&timestamp={timestamp}'
+        return self.request('GET', '/exchange/api/v2/myTrades', query, None)
+
+    def iter_my_exchange_trades(self, market, limit=DEFAULT_PAGE_SIZE):
+        pages = TimestampPages(limit, 'time', int)
+        return self.iterate_pages(lambda timestamp: self.get_my_exchange_trades(market, limit, timestamp), None,
+                                  pages.next_cursor, pages.items)
 
     def create_exchange_limit_order(self, market, side, quantity, price):
         query = "market={}&side={}&type=limit&quantity={}&price={}".format(market, side, quantity, price)
@@ -306,28 +1087,47 @@ class private_api:
         query = "market={}&orderId={}".format(market, order_id)
         return self.request('DELETE', '/exchange/api/v2/order', query, None)
 
-    def get_rigs(self):
+    def get_rigs(self, size=None, page=None):
         query = ""
+        if size is not None:
+            query = f'size={size}&page={page or 0}'
         return self.request("GET", "/main/api/v2/mining/rigs2", query, None)
 
-    def get_rig_stats(self, rig_id, start_time=None, end_time=None, algorithm: AlgorithmType = AlgorithmType.DAGGERHASHIMOTO):
+    def iter_rigs(self, size=DEFAULT_PAGE_SIZE):
+        # every rig of the organisation, get_rigs() alone only returns the first page
+        return self.iterate_pages(lambda page: self.get_rigs(size, page), 0, next_page,
+                                  lambda response: response['miningRigs'])
+
+    def get_rig_stats(self, rig_id, start_time=None, end_time=None, algorithm: AlgorithmType = AlgorithmType.DAGGERHASHIMOTO,
+                      parse=None):
         query = f'algorithm={algorithm}&rigId={urllib.parse.quote(rig_id)}'
         if start_time is not None:
             query += f'&afterTimestamp={start_time}'
         if end_time is not None:
             query += f'&beforeTimestamp={end_time}'
-        return self.request("GET", f'/main/api/v2/mining/rig/stats/algo', query, None)
+        return self.request("GET", f'/main/api/v2/mining/rig/stats/algo', query, None, parse)
 
-    def get_pool_stats(self, start_time=None, end_time=None, algorithm: AlgorithmType = AlgorithmType.DAGGERHASHIMOTO):
+    def get_pool_stats(self, start_time=None, end_time=None, algorithm: AlgorithmType = AlgorithmType.DAGGERHASHIMOTO,
+                       parse=None):
         query = f'algorithm={algorithm}'
         if start_time is not None:
             query += f'&afterTimestamp={start_time}'
         if end_time is not None:
             query += f'&beforeTimestamp={end_time}'
-        return self.request("GET", f'/main/api/v2/mining/rigs/stats/algo', query, None)
+        return self.request("GET", f'/main/api/v2/mining/rigs/stats/algo', query, None, parse)
+
+
+class async_public_api(public_api, async_base_api):
+    pass
+
+
+class async_private_api(private_api, async_base_api):
+    pass
 
 
 if __name__ == "__main__":
+    import optparse
+
     parser = optparse.OptionParser()
 
     parser.add_option('-b', '--base_url', dest="base", help="Api base url", default="https://api2.nicehash.com")
@@ -341,17 +1141,16 @@ if __name__ == "__main__":
 
     options, args = parser.parse_args()
 
-    private_api = private_api(options.base, options.org, options.key, options.secret)
-
     params = ''
     if options.params is not None:
         params = options.params
 
-    try:
-        response = private_api.request(options.method, options.path, params, options.body)
-    except Exception as ex:
-        print("Unexpected error:", ex)
-        exit(1)
+    with private_api(options.base, options.org, options.key, options.secret) as private_api:
+        try:
+            response = private_api.request(options.method, options.path, params, options.body)
+        except Exception as ex:
+            print("Unexpected error:", ex)
+            exit(1)
 
     print(response)
     exit(0)
@@ -0,0 +1,645 @@
+import argparse
+import contextlib
+import io
+import json
+import math
+import os.path
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone, time
+from functools import partial
+from time import monotonic, sleep
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from nicehash import AlgorithmType
+from metrics import COMPACT_FLEET_VALUE_DTYPE, MAX_SAMPLE_GAP_MS, RESULT_COLUMNS, compute_metrics, daily_totals, \
+    daily_totals_from_hourly, fleet_memory_report, metrics_from_daily_totals, to_fleet, update_daily_totals
+from profiling import StageProfiler, profile_stage
+from publishing import Publisher, daily_hours_filepath, publish, publishes, save_last_report
+from rollups import RollupStore
+from storage import CsvStorage, STORAGES, concat_timeseries, fill_timeseries, splice_timeseries, \
+    timeseries_until
+from streaming import estimate_capacity, parse_stats
+
+MINING_HOURS_THRESHOLD = 8
+
+ALGOS = {algo for algo in AlgorithmType}
+
+RIGS_REFRESH_INTERVAL = timedelta(hours=1)
+
+# trend --metric choices, in the order of metrics.RESULT_COLUMNS
+TREND_METRICS = ('hours', 'speed', 'profitability')
+
+
+def ts_dict_to_df(dico):
+    return pd.DataFrame.from_records(dico['data'], columns=dico['columns'], index='time').sort_index()
+
+
+def sum_algos(dfs):
+    df_ts = concat_timeseries(dfs)
+    return df_ts.groupby(df_ts.index).agg('sum').sort_index()
+
+
+def merge_and_cache_timeseries(df: pd.DataFrame, filepath: str, monthly: bool = False, df_cache: pd.DataFrame = None,
+                               storage=None):
+    if monthly:
+        storage = CsvStorage() if storage is None else storage
+        if df_cache is None:
+            df_cache = storage.load(filepath)
+        df_merged = splice_timeseries(df_cache, df)
+        storage.store(filepath, df, df_merged)
+        df = df_merged
+    return df
+
+
+class TimeseriesCache:
+    # monthly time series cached per (org, rig_id, algorithm), rig_id None being the pool, so that only samples
+    # past the last cached one are requested; without a directory the series are only kept in memory
+
+    def __init__(self, directory, month: datetime, storage=None):
+        self.directory = directory
+        self.month = month
+        self.storage = CsvStorage() if storage is None else storage
+        self.frames = {}
+        # first new timestamp merged per key since the last call to pop_updated_since
+        self.updated = {}
+        # keys filled in memory since their last write
+        self.filled = set()
+
+    def filepath(self, org, rig_id, algorithm: AlgorithmType, extension=None):
+        name = f'{org}_pool' if rig_id is None else f'{org}_{rig_id}'
+        extension = self.storage.extension if extension is None else extension
+        return os.path.join(self.directory, f'{name}_{algorithm.name.lower()}_{self.month:%Y_%m}{extension}')
+
+    def load(self, org, rig_id, algorithm: AlgorithmType):
+        key = (org, rig_id, algorithm)
+        if key not in self.frames:
+            self.frames[key] = None if self.directory is None else self.storage.load(
+                self.filepath(org, rig_id, algorithm))
+        return self.frames[key]
+
+    def high_water_mark(self, org, rig_id, algorithm: AlgorithmType):
+        df = self.load(org, rig_id, algorithm)
+        return None if df is None or len(df) == 0 else int(df.index[-1])
+
+    def start_timestamp(self, org, rig_id, algorithm: AlgorithmType, start_timestamp, end_timestamp):
+        # the cache may already hold samples past end_timestamp, e.g. of a month reported again with an earlier end,
+        # then the window is cached and the request is left empty rather than inverted
+        high_water_mark = self.high_water_mark(org, rig_id, algorithm)
+        return start_timestamp if high_water_mark is None else min(max(start_timestamp, high_water_mark),
+                                                                   end_timestamp)
+
+    def merge(self, org, rig_id, algorithm: AlgorithmType, df: pd.DataFrame):
+        if len(df) > 0:
+            self.updated[org, rig_id, algorithm] = int(df.index[0])
+        if self.directory is None:
+            df = splice_timeseries(self.load(org, rig_id, algorithm), df)
+        else:
+            df = merge_and_cache_timeseries(df, self.filepath(org, rig_id, algorithm), True,
+                                            self.load(org, rig_id, algorithm), self.storage)
+        self.frames[org, rig_id, algorithm] = df
+        return df
+
+    def fill(self, org, rig_id, algorithm: AlgorithmType, df: pd.DataFrame, after_timestamp, before_timestamp):
+        # replace the cached samples in (after_timestamp, before_timestamp], the range of a stats request, with
+        # those of df and keep the others, for backfills filling their windows in any order; only in memory until
+        # write is called, so that a month of windows rewrites each file once
+        df = df[(df.index > after_timestamp) & (df.index <= before_timestamp)]
+        df_cache = self.load(org, rig_id, algorithm)
+        if len(df) == 0 and (df_cache is None or not any((df_cache.index > after_timestamp) &
+                                                         (df_cache.index <= before_timestamp))):
+            return df_cache
+        df = fill_timeseries(df_cache, df, after_timestamp + 1, before_timestamp + 1)
+        self.frames[org, rig_id, algorithm] = df
+        self.filled.add((org, rig_id, algorithm))
+        return df
+
+    def write(self, org, rig_id, algorithm: AlgorithmType, until_timestamp=None):
+        # store the filled series, only its samples up to until_timestamp when given, e.g. the start of a window
+        # that failed, so that the high water mark stays before the hole and the next run requests it again
+        key = (org, rig_id, algorithm)
+        df = self.load(org, rig_id, algorithm)
+        if df is None:
+            return
+        cut = until_timestamp is not None and len(df) > 0 and df.index[-1] > until_timestamp
+        if key not in self.filled and not cut:
+            return
+        if until_timestamp is not None:
+            df = df[df.index <= until_timestamp]
+        if self.directory is not None:
+            self.storage.replace(self.filepath(org, rig_id, algorithm), df)
+        self.frames[key] = df
+        self.filled.discard(key)
+
+    def pop_updated_since(self):
+        updated_since = min(self.updated.values(), default=None)
+        self.updated = {}
+        return updated_since
+
+    def trim(self, start_timestamp):
+        for key, df in self.frames.items():
+            if df is not None:
+                self.frames[key] = df[df.index >= start_timestamp]
+
+    def rig_frames(self, org, rig_ids, end_timestamp):
+        return {rig_id: {algo: timeseries_until(self.frames[org, rig_id, algo], end_timestamp) for algo in ALGOS
+                         if self.frames.get((org, rig_id, algo)) is not None} for rig_id in rig_ids}
+
+    def export_csv(self):
+        csv_storage = CsvStorage()
+        for (org, rig_id, algorithm), df in self.frames.items():
+            if df is not None:
+                csv_storage.store(self.filepath(org, rig_id, algorithm, csv_storage.extension), df, df)
+
+
+def fetch_stats(private_api, rig_ids, start_timestamp, end_timestamp, workers, cache: TimeseriesCache = None,
+                stream: bool = False, profiler: StageProfiler = None):
+    # issue the pool request and every rig x algo request at once, then gather them in a fixed order so results
+    # do not depend on completion order; a failed request only drops its own rig, or the pool statistics (None)
+    org = private_api.organisation_id
+
+    def fetch(rig_id, algo):
+        after_timestamp = start_timestamp if cache is None else cache.start_timestamp(org, rig_id, algo,
+                                                                                      start_timestamp, end_timestamp)
+        parse = partial(parse_stats, capacity=estimate_capacity(after_timestamp, end_timestamp)) if stream else None
+        with profile_stage(profiler, 'pool_stats' if rig_id is None else 'rig_stats'):
+            if rig_id is None:
+                response = private_api.get_pool_stats(after_timestamp, end_timestamp, algo, parse)
+            else:
+                response = private_api.get_rig_stats(rig_id, after_timestamp, end_timestamp, algo, parse)
+            df = response if stream else ts_dict_to_df(response)
+        if cache is None:
+            return df
+        with profile_stage(profiler, 'merge_and_cache_timeseries'):
+            return timeseries_until(cache.merge(org, rig_id, algo, df), end_timestamp)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pool_futures = [executor.submit(fetch, None, algo) for algo in ALGOS]
+        rig_futures = {rig_id: [executor.submit(fetch, rig_id, algo) for algo in ALGOS] for rig_id in rig_ids}
+        try:
+            pool_stats = sum_algos([future.result() for future in pool_futures])
+        except Exception as err:
+            # the reports do not use the pool statistics, only their cache misses this run's samples
+            print(f'Failed to fetch pool stats: {err}')
+            pool_stats = None
+        rig_frames = {}
+        failed_rig_ids = {}
+        for rig_id, futures in rig_futures.items():
+            try:
+                rig_frames[rig_id] = {algo: future.result() for algo, future in zip(ALGOS, futures)}
+            except Exception as err:
+                failed_rig_ids[rig_id] = err
+    return pool_stats, rig_frames, failed_rig_ids
+
+
+def save_fig(df: pd.DataFrame, title, filepath):
+    from matplotlib import dates as md, pyplot as plt
+    plt.gca().xaxis.set_major_formatter(md.DateFormatter('%H:%M'))
+    fig = df.expanding().mean().plot(title=f'{title} cumulative average hours',
+                                     yticks=range(0, 25, 2)).get_figure()
+    plt.axhline(y=MINING_HOURS_THRESHOLD, color='r', linestyle='--')
+    plt.gca().xaxis.set_major_formatter(md.DateFormatter('%d'))
+    fig.savefig(filepath)
+    plt.close(fig)
+
+
+def get_btcusd():
+    import requests
+    response = requests.get('https://api.coindesk.com/v1/bpi/currentprice.json')
+    data = response.json()
+    return float(data["bpi"]["USD"]["rate"].replace(',', ''))
+
+
+def try_load_json(filepath: str):
+    if os.path.exists(filepath):
+        with open(filepath, 'r') as fp:
+            dico = json.load(fp)
+    else:
+        dico = {}
+    return dico
+
+
+def report_window(end_datetime: datetime, monthly: bool, days: int):
+    end_datetime = end_datetime.astimezone(timezone.utc)
+    if monthly:
+        start_datetime = datetime(end_datetime.year, end_datetime.month, 1, tzinfo=end_datetime.tzinfo)
+        if end_datetime.day == 1 and end_datetime.time() == time(0, 0):
+            start_datetime = start_datetime - relativedelta(months=1)
+        nb_days = (end_datetime - start_datetime) / timedelta(microseconds=1) / 10 ** 6 / 60 / 60 / 24
+    else:
+        nb_days = days
+        start_datetime = end_datetime - timedelta(days=nb_days)
+    start_timestamp = int(math.floor(start_datetime.astimezone().timestamp()) * 1000)
+    end_timestamp = int(math.ceil(end_datetime.astimezone().timestamp()) * 1000)
+    return start_datetime, end_datetime, nb_days, start_timestamp, end_timestamp
+
+
+def update_rig_registry(private_api, start_datetime: datetime, rigs, registered_rigs=None):
+    rigs_filepath = os.path.join('data', f'rigs_{private_api.organisation_id}_{start_datetime:%Y_%m}.json')
+    rig_ids_names = try_load_json(rigs_filepath)
+    if registered_rigs is None:
+        registered_rigs = {rig['rigId']: rig['name'] for rig in private_api.iter_rigs()}
+    # rig_ids_names |= registered_rigs | {rig: rig for rig in rigs} # for 3.9
+    rig_ids_names = {**rig_ids_names, **registered_rigs, **{rig: rig for rig in rigs}}
+    with open(rigs_filepath, 'w') as rigs_file:
+        json.dump(rig_ids_names, rigs_file)
+    return rig_ids_names
+
+
+def render_report(df_daily_hours: pd.DataFrame, df_results: pd.DataFrame, title, org, start_datetime: datetime,
+                  profiler: StageProfiler = None, publisher: Publisher = None):
+    # with a publisher the chart is rendered in its worker process, published messages attaching it wait for it
+    df_daily_hours.to_csv(daily_hours_filepath(org, start_datetime, '.csv'))
+    df_daily_hours.index = pd.to_datetime(df_daily_hours.index, format='%Y-%m-%d').strftime('%d')
+    print('Daily mining hours')
+    print(df_daily_hours.to_markdown(floatfmt='.2f', tablefmt='github'))
+    fig_filepath = daily_hours_filepath(org, start_datetime, '.png')
+    with profile_stage(profiler, 'save_fig'):
+        if publisher is None:
+            save_fig(df_daily_hours, title, fig_filepath)
+        else:
+            publisher.render(fig_filepath, save_fig, df_daily_hours, title, fig_filepath)
+
+    df_results.loc["Total"] = df_results.sum()
+    lines = df_results.to_markdown(floatfmt='.2f', tablefmt='github').splitlines()
+    lines.insert(-1, lines[1])
+    lines[1] = lines[1].replace('-', '=')
+    results_str = os.linesep.join(lines)
+    print('\nMonthly mining stats')
+    print(results_str)
+    return results_str
+
+
+def send_payouts(private_api, label, df_results: pd.DataFrame):
+    print('\nPayout')
+    df_results = df_results.drop(index='Total', errors='ignore')
+    threshold_rig_names = df_results[df_results['hours/day'] >= MINING_HOURS_THRESHOLD].index.tolist()
+    if not any(threshold_rig_names):
+        print(f'No miner mined for at least {MINING_HOURS_THRESHOLD} hours per day.')
+        return
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        # the BTC price is fetched while the addresses and the balance are requested
+        btcusd_future = executor.submit(get_btcusd)
+        addresses_filepath = os.path.join('data', f'addresses_{label}.json')
+        dict_addresses = try_load_json(addresses_filepath)
+        dict_addresses = {**dict_addresses, **{address['name']: {'id': address['id'], 'address': address['address']}
+                                               for address in private_api.iter_withdrawal_addresses('BTC')}}
+        available_btc = float(private_api.get_accounts_for_currency('BTC')['available'])
+        btcusd = btcusd_future.result()
+    str_rig_names = threshold_rig_names[0] if len(threshold_rig_names) == 1 else ', '.join(
+        threshold_rig_names[:-1]) + f' and {threshold_rig_names[-1]}'
+    print(f'{str_rig_names} mined for at least {MINING_HOURS_THRESHOLD} hours per day.')
+    # use floor division to ensure payout is rounded down
+    payout = available_btc * 1e8 // len(threshold_rig_names) * 1e-8
+    print(f'{available_btc / 1e-6:.2f} \u03BCBTC (${btcusd * available_btc:.2f}) available in {label} wallet.')
+    print(f'Sending {payout / 1e-6:.2f} \u03BCBTC (${btcusd * payout:.2f}) '
+          f'less 5 \u03BCBTC (${btcusd * 5 * 1e-6:.2f}) NH withdrawal fee to:')
+    for rig_name in threshold_rig_names:
+        dict_address = dict_addresses[rig_name]
+        try:
+            id = private_api.withdraw_request(dict_address['id'], payout, 'BTC')
+            print(f'\t{rig_name}: {dict_address["address"]}, id: {id}')
+            # private_api.cancel_withdraw_request(id, 'BTC')
+        except BaseException as err:
+            print(err)
+
+
+def report_title(label, monthly: bool, start_datetime: datetime):
+    return f'{label} {start_datetime:%B %Y}' if monthly else label
+
+
+def print_failures(rig_ids_names, failed_rig_ids):
+    for rig_id, err in failed_rig_ids.items():
+        print(f'Failed to fetch stats for {rig_ids_names[rig_id]}: {err}')
+
+
+def fetch_report_stats(args, private_api, start_datetime: datetime, start_timestamp, end_timestamp,
+                       profiler: StageProfiler = None):
+    # rig registry and time series of the report window, cached per month with --monthly
+    with profile_stage(profiler, 'rigs'):
+        rig_ids_names = update_rig_registry(private_api, start_datetime, args.rigs)
+    cache = TimeseriesCache('data', start_datetime, STORAGES[args.storage]()) if args.monthly else None
+    with profile_stage(profiler, 'fetch'):
+        _, rig_frames, failed_rig_ids = fetch_stats(private_api, rig_ids_names, start_timestamp, end_timestamp,
+                                                    args.workers, cache, args.stream, profiler)
+    if cache is not None and args.export_csv and args.storage != 'csv':
+        with profile_stage(profiler, 'export_csv'):
+            cache.export_csv()
+    return rig_ids_names, rig_frames, failed_rig_ids
+
+
+def rollup_store(args):
+    # hourly rollups are kept for monthly reports only, as only then rig_frames holds every sample of the month
+    return RollupStore('data', STORAGES[args.storage]()) if args.monthly and not args.no_rollups else None
+
+
+def report_metrics(org, rig_ids_names, rig_frames, nb_days, start_timestamp, end_timestamp,
+                   rollups: RollupStore = None, profiler: StageProfiler = None):
+    fetched_rig_ids_names = {rig_id: rig_name for rig_id, rig_name in rig_ids_names.items() if rig_id in rig_frames}
+    if rollups is None:
+        with profile_stage(profiler, 'metrics'):
+            return compute_metrics(to_fleet(rig_frames), fetched_rig_ids_names, nb_days)
+    with profile_stage(profiler, 'rollups'):
+        rollups.update(org, rig_frames, start_timestamp, end_timestamp)
+    with profile_stage(profiler, 'metrics'):
+        return metrics_from_daily_totals(rollups.daily_totals(org, rig_frames, start_timestamp, end_timestamp),
+                                         fetched_rig_ids_names, nb_days)
+
+
+def print_window(label, monthly: bool, start_datetime: datetime, end_datetime: datetime):
+    title = report_title(label, monthly, start_datetime)
+    if label is not None:
+        print(title)
+    print(f'{start_datetime:%b %d %Y %H:%M:%S %Z} to {end_datetime:%b %d %Y %H:%M:%S %Z}')
+    return title
+
+
+def run(args, private_api, profiler: StageProfiler = None):
+    start_datetime, end_datetime, nb_days, start_timestamp, end_timestamp = report_window(args.end_datetime,
+                                                                                          args.monthly, args.days)
+    title = print_window(args.label, args.monthly, start_datetime, end_datetime)
+    rig_ids_names, rig_frames, failed_rig_ids = fetch_report_stats(args, private_api, start_datetime,
+                                                                   start_timestamp, end_timestamp, profiler)
+    print_failures(rig_ids_names, failed_rig_ids)
+    df_daily_hours, df_results = report_metrics(args.org, rig_ids_names, rig_frames, nb_days, start_timestamp,
+                                                end_timestamp, rollup_store(args), profiler)
+    publisher = Publisher(retries=args.publish_retries)
+    # the chart is rendered in the publisher's worker process when there are messages or a payout to overlap with
+    chart_publisher = publisher if publishes(args) or args.payout else None
+    try:
+        with profile_stage(profiler, 'render'):
+            results_str = render_report(df_daily_hours, df_results, title, args.org, start_datetime, profiler,
+                                        chart_publisher)
+        save_last_report(args.org, title, start_datetime, end_datetime, results_str)
+        publish(args, title, start_datetime, end_datetime, results_str, publisher)
+
+        if args.payout:
+            pay(args, private_api, df_results, failed_rig_ids, profiler)
+    finally:
+        # the chart and the messages went on during the payout, only what is left is waited for
+        with profile_stage(profiler, 'publish'):
+            publisher.close()
+
+
+def pay(args, private_api, df_results: pd.DataFrame, failed_rig_ids, profiler: StageProfiler = None):
+    if any(failed_rig_ids):
+        print('\nSkipping payout: stats are incomplete')
+        return
+    with profile_stage(profiler, 'payout'):
+        send_payouts(private_api, args.label, df_results)
+
+
+def run_payout(args, private_api):
+    # payout from freshly fetched stats without rendering the report
+    start_datetime, end_datetime, nb_days, start_timestamp, end_timestamp = report_window(args.end_datetime,
+                                                                                          args.monthly, args.days)
+    print_window(args.label, args.monthly, start_datetime, end_datetime)
+    rig_ids_names, rig_frames, failed_rig_ids = fetch_report_stats(args, private_api, start_datetime,
+                                                                   start_timestamp, end_timestamp)
+    print_failures(rig_ids_names, failed_rig_ids)
+    _, df_results = report_metrics(args.org, rig_ids_names, rig_frames, nb_days, start_timestamp, end_timestamp,
+                                   rollup_store(args))
+    pay(args, private_api, df_results, failed_rig_ids)
+
+
+def run_stats(args, private_api):
+    # fetch the time series of the report window, into the monthly cache with --monthly, and print their extent
+    start_datetime, end_datetime, nb_days, start_timestamp, end_timestamp = report_window(args.end_datetime,
+                                                                                          args.monthly, args.days)
+    print_window(args.label, args.monthly, start_datetime, end_datetime)
+    rig_ids_names, rig_frames, failed_rig_ids = fetch_report_stats(args, private_api, start_datetime,
+                                                                   start_timestamp, end_timestamp)
+    print_failures(rig_ids_names, failed_rig_ids)
+    rollups = rollup_store(args)
+    if rollups is not None:
+        rollups.update(args.org, rig_frames, start_timestamp, end_timestamp)
+    df_fleet = to_fleet(rig_frames, value_dtype=COMPACT_FLEET_VALUE_DTYPE)
+    print(fleet_memory_report(df_fleet, args.memory_budget))
+    df_fleet['mining'] = df_fleet['speed_accepted'] > 0
+    df_summary = df_fleet.groupby('rig', observed=True).agg(samples=('time', 'size'), mining_samples=('mining', 'sum'),
+                                                            first=('time', 'min'), last=('time', 'max'))
+    for column in ('first', 'last'):
+        df_summary[column] = pd.to_datetime(df_summary[column], unit='ms', utc=True).dt.strftime('%Y-%m-%d %H:%M')
+    df_summary.insert(0, 'name', [rig_ids_names[rig_id] for rig_id in df_summary.index])
+    print(df_summary.sort_values('name').to_markdown(tablefmt='github'))
+
+
+def rig_registry_names(org):
+    # rig names of all the monthly rig registries of org, the latest name of a renamed rig winning
+    import glob
+    rig_ids_names = {}
+    for filepath in sorted(glob.glob(os.path.join('data', f'rigs_{org}_*.json'))):
+        rig_ids_names.update(try_load_json(filepath))
+    return rig_ids_names
+
+
+def run_trend(args):
+    # monthly averages of one metric per rig over the rolled up months, read from the hourly rollups only
+    rollups = RollupStore('data', STORAGES[args.storage]())
+    rig_ids = rollups.rig_ids(args.org)
+    df_hourly = rollups.hourly_totals(args.org, rig_ids)
+    if len(df_hourly) == 0:
+        print(f'No rollups for organization {args.org}: run a monthly report or stats first')
+        return
+    registry_names = rig_registry_names(args.org)
+    rig_ids_names = {rig_id: registry_names.get(rig_id, rig_id) for rig_id in rig_ids}
+    months = pd.to_datetime(df_hourly.index.get_level_values('time'), unit='ms', utc=True).strftime('%Y-%m')
+    column = RESULT_COLUMNS[TREND_METRICS.index(args.metric)]
+    df_trend = {}
+    for month, df_month in df_hourly.groupby(months, sort=True):
+        # the rolled up hours of the month, i.e. all of them but for the current month
+        nb_days = df_month.index.get_level_values('time').nunique() / 24
+        _, df_results = metrics_from_daily_totals(daily_totals_from_hourly(df_month), rig_ids_names, nb_days)
+        df_trend[month] = df_results[column]
+    df_trend = pd.DataFrame(df_trend).T.tail(args.months)
+    df_trend['Total'] = df_trend.sum(axis=1)
+    print(f'{column} per month')
+    print(df_trend.to_markdown(floatfmt='.2f', tablefmt='github'))
+
+
+def org_args(args, entry: dict):
+    # the batch command line options, overridden by those of one organization entry of the batch config
+    unknown = set(entry) - set(vars(args))
+    if unknown:
+        raise ValueError(f'Unknown options for organization {entry.get("org")}: {", ".join(sorted(unknown))}')
+    missing = {'org', 'key', 'secret'} - set(entry)
+    if missing:
+        raise ValueError(f'Missing options for organization {entry.get("org")}: {", ".join(sorted(missing))}')
+    return argparse.Namespace(**{**vars(args), **entry})
+
+
+def compute_report(org, title, start_datetime: datetime, rig_ids_names, rig_frames, nb_days, start_timestamp,
+                   end_timestamp, rollups: RollupStore = None):
+    # process pool worker: metrics and rendered report of one organization, with what rendering printed
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        df_daily_hours, df_results = report_metrics(org, rig_ids_names, rig_frames, nb_days, start_timestamp,
+                                                    end_timestamp, rollups)
+        results_str = render_report(df_daily_hours, df_results, title, org, start_datetime)
+    return results_str, df_results, output.getvalue()
+
+
+def run_batch(args, entries, rate_limiter=None, hooks=None, cache=None):
+    # reports of many organizations: org_workers organizations are fetched at once over one connection pool of
+    # args.workers connections, each report is computed in a process pool as soon as its stats arrive, then
+    # reports are printed, published and paid in config order; a failing organization is reported and skipped
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from nicehash import create_session, private_api
+
+    session = create_session(pool_maxsize=args.workers, pool_block=True)
+    failed_orgs = {}
+    batch_args, clients, windows = {}, {}, {}
+    for index, entry in enumerate(entries):
+        # an invalid entry only fails its own organization
+        try:
+            options = org_args(args, entry)
+            windows[index] = report_window(options.end_datetime, options.monthly, options.days)
+            clients[index] = private_api(options.base, options.org, options.key, options.secret, session=session,
+                                         rate_limiter=rate_limiter, hooks=hooks, cache=cache,
+                                         timeout=options.timeout or None)
+            batch_args[index] = options
+        except Exception as err:
+            failed_orgs[entry.get('org', f'#{index + 1}') if isinstance(entry, dict) else f'#{index + 1}'] = err
+
+    def fetch(index):
+        start_datetime, _, _, start_timestamp, end_timestamp = windows[index]
+        return fetch_report_stats(batch_args[index], clients[index], start_datetime, start_timestamp, end_timestamp)
+
+    fetched = {}
+    publish_futures = {}
+    # workers are spawned rather than forked from a process running fetch threads
+    mp_context = multiprocessing.get_context('spawn')
+    with ThreadPoolExecutor(max_workers=args.org_workers) as executor, \
+            ProcessPoolExecutor(max_workers=args.processes, mp_context=mp_context) as processes, \
+            Publisher(retries=args.publish_retries) as publisher:
+        fetch_futures = {executor.submit(fetch, index): index for index in batch_args}
+        for future in as_completed(fetch_futures):
+            index = fetch_futures[future]
+            options = batch_args[index]
+            try:
+                rig_ids_names, rig_frames, failed_rig_ids = future.result()
+            except Exception as err:
+                failed_orgs[options.org] = err
+                continue
+            start_datetime, _, nb_days, start_timestamp, end_timestamp = windows[index]
+            title = report_title(options.label, options.monthly, start_datetime)
+            fetched[index] = (rig_ids_names, failed_rig_ids, processes.submit(
+                compute_report, options.org, title, start_datetime, rig_ids_names, rig_frames, nb_days,
+                start_timestamp, end_timestamp, rollup_store(options)))
+
+        for index, options in batch_args.items():
+            if index not in fetched:
+                continue
+            rig_ids_names, failed_rig_ids, future = fetched[index]
+            start_datetime, end_datetime = windows[index][:2]
+            print(f'\nOrganization {options.org}')
+            try:
+                title = print_window(options.label, options.monthly, start_datetime, end_datetime)
+                print_failures(rig_ids_names, failed_rig_ids)
+                results_str, df_results, output = future.result()
+                print(output, end='')
+                save_last_report(options.org, title, start_datetime, end_datetime, results_str)
+                publish_futures[options.org] = publish(options, title, start_datetime, end_datetime, results_str,
+                                                       publisher)
+                if options.payout:
+                    pay(options, clients[index], df_results, failed_rig_ids)
+            except Exception as err:
+                failed_orgs[options.org] = err
+
+    session.close()
+    # messages are sent while the next organizations are reported, their failures are known once all are sent
+    for org, futures in publish_futures.items():
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors and org not in failed_orgs:
+            failed_orgs[org] = errors[0]
+    for org, err in failed_orgs.items():
+        print(f'Failed to report organization {org}: {err!r}')
+    return failed_orgs
+
+
+class Watcher:
+    # state kept in memory between the ticks of --watch: the rig registry, the time series of the current window
+    # and the daily totals, which are only recomputed from the day of the first new sample on
+
+    def __init__(self, args, private_api):
+        self.args = args
+        self.private_api = private_api
+        self.start_datetime = None
+        self.cache = None
+        self.rig_ids_names = None
+        self.rigs_refreshed = None
+        self.df_daily_totals = None
+        self.published_daily_totals = None
+        self.rollups = rollup_store(args)
+        self.publisher = Publisher(retries=args.publish_retries)
+
+    def reset(self, start_datetime: datetime):
+        self.start_datetime = start_datetime
+        self.cache = TimeseriesCache('data', start_datetime, STORAGES[self.args.storage]()) if self.args.monthly \
+            else TimeseriesCache(None, None)
+        self.rig_ids_names = None
+        self.df_daily_totals = None
+        self.published_daily_totals = None
+
+    def tick(self):
+        args = self.args
+        # the previous tick's chart and messages, usually long sent, are not piled up behind slow sinks; when one of
+        # them failed, the report is published again
+        if self.publisher.wait():
+            self.published_daily_totals = None
+        now = datetime.now(timezone.utc)
+        start_datetime, end_datetime, nb_days, start_timestamp, end_timestamp = report_window(now, args.monthly,
+                                                                                              args.days)
+        if self.cache is None or (args.monthly and start_datetime != self.start_datetime):
+            self.reset(start_datetime)
+        if self.rig_ids_names is None or now - self.rigs_refreshed >= RIGS_REFRESH_INTERVAL:
+            self.rig_ids_names = update_rig_registry(self.private_api, start_datetime, args.rigs)
+            self.rigs_refreshed = now
+        if not args.monthly:
+            self.cache.trim(start_timestamp)
+
+        _, _, failed_rig_ids = fetch_stats(self.private_api, self.rig_ids_names, start_timestamp, end_timestamp,
+                                           args.workers, self.cache, args.stream)
+        print_failures(self.rig_ids_names, failed_rig_ids)
+        updated_since = self.cache.pop_updated_since()
+        rig_frames = self.cache.rig_frames(args.org, self.rig_ids_names, end_timestamp)
+        if self.df_daily_totals is None or not args.monthly:
+            self.df_daily_totals = daily_totals(to_fleet(rig_frames))
+        elif updated_since is not None:
+            # intervals starting up to 5 minutes before the first new sample may have changed
+            since_date = datetime.fromtimestamp((updated_since - MAX_SAMPLE_GAP_MS) / 1000, timezone.utc).date()
+            since_timestamp = int(datetime(since_date.year, since_date.month, since_date.day,
+                                           tzinfo=timezone.utc).timestamp() * 1000)
+            self.df_daily_totals = update_daily_totals(self.df_daily_totals, to_fleet(rig_frames, since_timestamp),
+                                                       since_date)
+
+        if self.rollups is not None and updated_since is not None:
+            self.rollups.update(args.org, rig_frames, start_timestamp, end_timestamp)
+
+        if self.published_daily_totals is not None and self.df_daily_totals.equals(self.published_daily_totals):
+            print(f'{end_datetime:%b %d %Y %H:%M:%S %Z}: no new mining')
+            return
+        title = print_window(args.label, args.monthly, start_datetime, end_datetime)
+        df_daily_hours, df_results = metrics_from_daily_totals(
+            self.df_daily_totals, {rig_id: self.rig_ids_names[rig_id] for rig_id in rig_frames}, nb_days)
+        results_str = render_report(df_daily_hours, df_results, title, args.org, start_datetime,
+                                    publisher=self.publisher if publishes(args) else None)
+        save_last_report(args.org, title, start_datetime, end_datetime, results_str)
+        publish(args, title, start_datetime, end_datetime, results_str, self.publisher)
+        self.published_daily_totals = self.df_daily_totals
+
+    def run(self, interval, after_tick=None):
+        while True:
+            tick_start = monotonic()
+            try:
+                self.tick()
+            except Exception as err:
+                print(f'Watch tick failed: {err}')
+            if after_tick is not None:
+                after_tick()
+            sleep(max(0.0, interval - (monotonic() - tick_start)))
+
+    def close(self):
+        self.publisher.close()
@@ -1,17 +1,13 @@
 import argparse
-import json
-import math
-import os.path
-from datetime import datetime, timedelta, timezone, time
+import os
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timezone
 
-import pandas as pd
-from dateutil.relativedelta import relativedelta
+# heavy modules (pandas, matplotlib, discord, the pipeline) are imported by the subcommands that need them, so that
+# cheap subcommands like rigs or balance start quickly
 
-from nicehash import private_api, AlgorithmType
-
-MINING_HOURS_THRESHOLD = 8
-
-ALGOS = {algo for algo in AlgorithmType}
+COMMANDS = ('rigs', 'balance', 'stats', 'report', 'payout', 'publish', 'batch', 'trend', 'backfill', 'market')
 
 
 def try_parsing_datetime(s):
@@ -22,196 +18,325 @@ def try_parsing_datetime(s):
         return datetime.now(timezone.utc).replace(hour=t.hour, minute=t.minute, second=t.second, microsecond=0)
 
 
-def ts_dict_to_df(dico):
-    return pd.DataFrame.from_records(dico['data'], columns=dico['columns'], index='time').sort_index()
+@contextmanager
+def open_client(args, public=False):
+    from nicehash import private_api, public_api, ClientMetrics, ResponseCache, TokenBucket
 
+    rate_limiter = TokenBucket(args.rate_limit) if args.rate_limit else None
+    client_metrics = ClientMetrics() if args.metrics_file else None
+    cache = ResponseCache(filepath=args.response_cache) if args.response_cache else None
+    options = dict(pool_maxsize=args.workers, rate_limiter=rate_limiter,
+                   hooks=[client_metrics] if client_metrics else None, cache=cache, timeout=args.timeout or None)
+    client = public_api(args.base, **options) if public else \
+        private_api(args.base, args.org, args.key, args.secret, **options)
+    with client as api:
+        try:
+            yield api, client_metrics
+        finally:
+            if client_metrics is not None:
+                client_metrics.dump(args.metrics_file)
 
-def merge_and_cache_timeseries(df: pd.DataFrame, filepath: str, monthly: bool = False):
-    if monthly:
-        if os.path.exists(filepath):
-            df_cache = pd.read_csv(filepath, index_col='time')
-            if len(df) > 0:
-                df_cache = df_cache[df_cache.index < df.index[0]]
-            df = pd.concat([df_cache, df], sort=True)
-            assert not any(df.index.duplicated())
-        df.reindex(sorted(df.columns), axis=1).to_csv(filepath)
-    return df
 
+def rigs(args):
+    with open_client(args) as (api, _):
+        mining_rigs = list(api.iter_rigs())
+    for rig in sorted(mining_rigs, key=lambda rig: rig['name']):
+        print(f'{rig["name"]:<24}{rig["rigId"]:<40}{rig.get("minerStatus", "")}')
 
-def save_fig(df: pd.DataFrame):
-    from matplotlib import dates as md, pyplot as plt
-    plt.gca().xaxis.set_major_formatter(md.DateFormatter('%H:%M'))
-    fig = df.expanding().mean().plot(title=f'{title} cumulative average hours',
-                                     yticks=range(0, 25, 2)).get_figure()
-    plt.axhline(y=MINING_HOURS_THRESHOLD, color='r', linestyle='--')
-    plt.gca().xaxis.set_major_formatter(md.DateFormatter('%d'))
-    fig.savefig(os.path.join('data', f'daily_hours_{args.org}_{start_datetime:%Y_%m}.png'))
 
+def balance(args):
+    with open_client(args) as (api, _):
+        account = api.get_accounts_for_currency(args.currency)
+    print(f'{account["available"]} {args.currency} available, {account.get("totalBalance", "?")} {args.currency} total')
 
-def get_btcusd():
-    import requests
-    response = requests.get('https://api.coindesk.com/v1/bpi/currentprice.json')
-    data = response.json()
-    return float(data["bpi"]["USD"]["rate"].replace(',', ''))
 
+def stats(args):
+    import pipeline
 
-def try_load_json(filepath: str):
-    if os.path.exists(filepath):
-        with open(filepath, 'r') as fp:
-            dico = json.load(fp)
-    else:
-        dico = {}
-    return dico
+    os.makedirs('data', exist_ok=True)
+    with open_client(args) as (api, _):
+        pipeline.run_stats(args, api)
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-b', '--base_url', dest="base", help="Api base url", default="https://api2.nicehash.com")
-    parser.add_argument('-l', '--label', dest="label", help="label")
-    parser.add_argument('-o', '--organization_id', dest="org", help="Organization id", required=True)
-    parser.add_argument('-k', '--key', dest="key", help="Api key", required=True)
-    parser.add_argument('-s', '--secret', dest="secret", help="Secret for api key", required=True)
-    parser.add_argument('-r', '--rigs', dest='rigs', help="Additional rigs", nargs='+', default=[])
-    parser.add_argument('-d', '--days', dest='days', help="Lookback in days", type=int, choices=range(1, 7), default=7)
-    parser.add_argument('-e', '--end_datetime', dest='end_datetime',
-                        help='End datetime or time in UTC: yyyy-mm-dd-HH:MM:SS or HH:MM:SS',
-                        type=lambda s: try_parsing_datetime(s), default=datetime.now(timezone.utc))
-    parser.add_argument('-m', '--monthly', dest='monthly', help="Monthly report", action='store_true')
-    parser.add_argument('-di', '--discord-id', dest='discord_id', help='Discord ID')
-    parser.add_argument('-dt', '--discord-token', dest='discord_token', help='Discord Token')
-    parser.add_argument('-pm', '--publish_monthly', dest='publish_monthly', help="Publish monthly report",
-                        action='store_true')
-    parser.add_argument('-pd', '--publish_daily', dest='publish_daily', help="Publish daily report",
-                        action='store_true')
-    parser.add_argument('-p', '--payout', dest='payout', help="Payout", action='store_true')
-    args = parser.parse_args()
-
-    if not os.path.exists('data'):
-        os.makedirs('data')
-
-    end_datetime = args.end_datetime.astimezone(timezone.utc)
-    if args.monthly:
-        start_datetime = datetime(end_datetime.year, end_datetime.month, 1, tzinfo=end_datetime.tzinfo)
-        if end_datetime.day == 1 and end_datetime.time() == time(0, 0):
-            start_datetime = start_datetime - relativedelta(months=1)
-        nb_days = (end_datetime - start_datetime) / timedelta(microseconds=1) / 10 ** 6 / 60 / 60 / 24
-    else:
-        nb_days = args.days
-        start_datetime = end_datetime - timedelta(days=nb_days)
-
-    rigs_filepath = os.path.join('data', f'rigs_{args.org}_{start_datetime:%Y_%m}.json')
-    rig_ids_names = try_load_json(rigs_filepath)
-    private_api = private_api(args.base, args.org, args.key, args.secret)
-    registered_rigs = {rig['rigId']: rig['name'] for rig in private_api.get_rigs()['miningRigs']}
-    # rig_ids_names |= registered_rigs | {rig: rig for rig in args.rigs} # for 3.9
-    rig_ids_names = {**rig_ids_names, **registered_rigs, **{rig: rig for rig in args.rigs}}
-    with open(rigs_filepath, 'w') as rigs_file:
-        json.dump(rig_ids_names, rigs_file)
-
-    start_timestamp = int(math.floor(start_datetime.astimezone().timestamp()) * 1000)
-    end_timestamp = int(math.ceil(end_datetime.astimezone().timestamp()) * 1000)
-    df_results = pd.DataFrame(columns=['hours/day', 'MH/s', '\u03BCBTC/day'])
-    title = f'{args.label} {start_datetime:%B %Y}' if args.monthly else args.label
-    if args.label is not None:
-        print(title)
-    list_daily_hours = []
-
-    print(f'{start_datetime:%b %d %Y %H:%M:%S %Z} to {end_datetime:%b %d %Y %H:%M:%S %Z}')
-    df_ts = pd.concat([ts_dict_to_df(private_api.get_pool_stats(start_timestamp, end_timestamp, algo))
-                       for algo in ALGOS], axis=0)
-    df_ts = df_ts.groupby(df_ts.index).agg('sum').sort_index()
-    filename = os.path.join('data', f'{args.org}.csv')
-    df_ts = merge_and_cache_timeseries(df_ts, filename, args.monthly)
-    for rig_id, rig_name in rig_ids_names.items():
-        df_ts = pd.concat([ts_dict_to_df(private_api.get_rig_stats(rig_id, start_timestamp, end_timestamp, algo))
-                           for algo in ALGOS], axis=0)
-        df_ts = df_ts.groupby(df_ts.index).agg('sum').sort_index()
-        filename = os.path.join('data', f'{args.org}_{rig_id}_{start_datetime:%Y_%m}.csv')
-        df_ts = merge_and_cache_timeseries(df_ts, filename, args.monthly)
-        df_ts = df_ts[['speed_accepted', 'profitability']]
-        speed_diff = df_ts.loc[:, 'speed_accepted'].diff().shift(-1)
-        start_times = df_ts.index.values[:-1]
-        end_times = df_ts.index.values[1:]
-        df_ts = df_ts.iloc[:-1]
-        df_ts['speed_diff'] = speed_diff
-        df_ts['speed_diff'] = df_ts['speed_diff'].fillna(0)
-        df_ts['time_delta'] = end_times - start_times if any(end_times) else 0
-        df_ts.loc[df_ts['time_delta'] > 5 * 60 * 1000, 'speed_diff'] = 0
-        df_ts.index = pd.to_datetime(df_ts.index, unit='ms', utc=True)
-        df_ts = df_ts[df_ts['speed_diff'] != 0]
-        df_daily_hours = df_ts.groupby(df_ts.index.date).sum()['time_delta'] / 1000 / 60 / 60
-        df_daily_hours.name = rig_name
-        list_daily_hours.append(df_daily_hours)
-        total_mining_ms = df_ts['time_delta'].sum()
-        avg_hr_per_day = total_mining_ms / 1000 / 60 / 60 / nb_days
-        mh_per_sec = df_ts[['speed_accepted', 'time_delta']].prod(axis=1).sum() / 1000 / 60 / 60 / 24 / nb_days
-        profitability = df_ts[['profitability', 'time_delta']].prod(axis=1).sum() / 1000 / 60 / 60 / 24 / nb_days
-        df_results = pd.concat([df_results, pd.DataFrame([{'hours/day': avg_hr_per_day, 'MH/s': mh_per_sec,
-                                                           '\u03BCBTC/day': profitability * 10 ** 6}],
-                                                         columns=df_results.columns, index=[rig_name])])
-    df_daily_hours = pd.concat(list_daily_hours, axis=1, sort=True).fillna(0).groupby(level=0, axis=1, sort=True).sum()
-    df_daily_hours.to_csv(os.path.join('data', f'daily_hours_{args.org}_{start_datetime:%Y_%m}.csv'))
-    df_daily_hours.index = pd.to_datetime(df_daily_hours.index, format='%Y-%m-%d').strftime('%d')
-    print('Daily mining hours')
-    print(df_daily_hours.to_markdown(floatfmt='.2f', tablefmt='github'))
-    save_fig(df_daily_hours)
-
-    df_results.index.name = 'rig'
-    df_results = df_results.reset_index().groupby('rig', sort=True).sum()
-    df_results.loc["Total"] = df_results.sum()
-    lines = df_results.to_markdown(floatfmt='.2f', tablefmt='github').splitlines()
-    lines.insert(-1, lines[1])
-    lines[1] = lines[1].replace('-', '=')
-    results_str = os.linesep.join(lines)
-    print('\nMonthly mining stats')
-    print(results_str)
-
-    if args.discord_id is not None and args.discord_token is not None:
-        from discord import Webhook, RequestsWebhookAdapter, Embed, File
-
-        webhook = Webhook.partial(args.discord_id, args.discord_token, adapter=RequestsWebhookAdapter())
-        embed = Embed()
-        embed.title = title
-        embed.colour = 15258703
-        embed.description = f'```{start_datetime:%b %d %Y %H:%M:%S %Z} to {end_datetime:%b %d %Y %H:%M:%S %Z}\n' \
-                            f'{results_str}```'
-        if args.publish_monthly:
-            print('\nPublish monthly report')
-            webhook.send(username='Earn Your Hours', embed=embed)
-        if args.publish_daily:
-            print('\nPublish daily report')
-            with open(file=os.path.join('data', f'daily_hours_{args.org}_{start_datetime:%Y_%m}.csv'), mode='rb') as f:
-                daily_hours_file = File(f)
-            with open(file=os.path.join('data', f'daily_hours_{args.org}_{start_datetime:%Y_%m}.png'), mode='rb') as f:
-                daily_hours_fig = File(f)
-            webhook.send(username='Earn Your Hours', content=embed.title, files=[daily_hours_file, daily_hours_fig])
-
-    if args.payout:
-        print('\nPayout')
-        addresses_filepath = os.path.join('data', f'addresses_{args.label}.json')
-        dict_addresses = try_load_json(addresses_filepath)
-        dict_addresses = {**dict_addresses, **{address['name']: {'id': address['id'], 'address': address['address']}
-                                               for address in private_api.get_withdrawal_addresses('BTC')['list']}}
-        threshold_rig_names = df_results[:-1][df_results[:-1]['hours/day'] >= MINING_HOURS_THRESHOLD].index.tolist()
-        if not any(threshold_rig_names):
-            print(f'No miner mined for at least {MINING_HOURS_THRESHOLD} hours per day.')
-            exit(0)
-        available_btc = float(private_api.get_accounts_for_currency('BTC')['available'])
-        str_rig_names = threshold_rig_names[0] if len(threshold_rig_names) == 1 else ', '.join(
-            threshold_rig_names[:-1]) + f' and {threshold_rig_names[-1]}'
-        print(f'{str_rig_names} mined for at least {MINING_HOURS_THRESHOLD} hours per day.')
-        # use floor division to ensure payout is rounded down
-        payout = available_btc * 1e8 // len(threshold_rig_names) * 1e-8
-        btcusd = get_btcusd()
-        print(f'{available_btc / 1e-6:.2f} \u03BCBTC (${btcusd * available_btc:.2f}) available in {args.label} wallet.')
-        print(f'Sending {payout / 1e-6:.2f} \u03BCBTC (${btcusd * payout:.2f}) '
-              f'less 5 \u03BCBTC (${btcusd * 5 * 1e-6:.2f}) NH withdrawal fee to:')
-        for rig_name in threshold_rig_names:
-            dict_address = dict_addresses[rig_name]
+def report(args):
+    import pipeline
+    from profiling import StageProfiler
+
+    os.makedirs('data', exist_ok=True)
+    with open_client(args) as (api, client_metrics):
+        if args.watch is not None:
+            watcher = pipeline.Watcher(args, api)
             try:
-                id = private_api.withdraw_request(dict_address['id'], payout, 'BTC')
-                print(f'\t{rig_name}: {dict_address["address"]}, id: {id}')
-                # private_api.cancel_withdraw_request(id, 'BTC')
-            except BaseException as err:
-                print(err)
+                # metrics are rewritten after every tick so a scraper or textfile collector sees fresh values
+                watcher.run(args.watch, after_tick=None if client_metrics is None else
+                            lambda: client_metrics.dump(args.metrics_file))
+            except KeyboardInterrupt:
+                pass
+            finally:
+                watcher.close()
+            return
+        profiler = StageProfiler(args.profile_dumps) if args.profile else None
+        try:
+            pipeline.run(args, api, profiler)
+        finally:
+            if profiler is not None:
+                profiler.write(args.profile)
+
+
+def payout(args):
+    import pipeline
+
+    os.makedirs('data', exist_ok=True)
+    with open_client(args) as (api, _):
+        pipeline.run_payout(args, api)
+
+
+def publish(args):
+    import publishing
+
+    with publishing.Publisher(retries=args.publish_retries) as publisher:
+        futures = publishing.publish(args, *publishing.load_last_report(args.org), publisher)
+    if any(future.exception() is not None for future in futures):
+        exit(1)
+
+
+def trend(args):
+    import pipeline
+
+    pipeline.run_trend(args)
+
+
+def batch(args):
+    import json
+    import pipeline
+    from nicehash import ClientMetrics, ResponseCache, TokenBucket
+
+    with open(args.config, 'r') as fp:
+        entries = json.load(fp)
+    os.makedirs('data', exist_ok=True)
+    # one rate limiter, metrics hook and response cache for all organizations, as they share the connection pool
+    rate_limiter = TokenBucket(args.rate_limit) if args.rate_limit else None
+    client_metrics = ClientMetrics() if args.metrics_file else None
+    cache = ResponseCache(filepath=args.response_cache) if args.response_cache else None
+    try:
+        failed_orgs = pipeline.run_batch(args, entries, rate_limiter, [client_metrics] if client_metrics else None,
+                                         cache)
+    finally:
+        if client_metrics is not None:
+            client_metrics.dump(args.metrics_file)
+    if failed_orgs:
+        exit(1)
+
+
+def backfill(args):
+    import backfilling
+
+    os.makedirs('data', exist_ok=True)
+    with open_client(args) as (api, _):
+        failures = backfilling.run_backfill(args, api)
+    if failures:
+        exit(1)
+
+
+def market(args):
+    import market_data
+    from storage import STORAGES
+
+    directory = os.path.join('data', 'market')
+    with open_client(args, public=True) as (api, _):
+        if args.candles_from is not None:
+            from_s, to_s = int(args.candles_from.timestamp()), int(datetime.now(timezone.utc).timestamp())
+            for market_name in args.markets:
+                df, failed_chunks = market_data.collect_candlesticks(api, market_name, from_s, to_s,
+                                                                     args.candles_resolution, directory,
+                                                                     STORAGES[args.storage](), args.workers)
+                print(f'{market_name}: {len(df)} candles, {len(failed_chunks)} failed chunks')
+        if args.duration == 0:
+            return
+        collector = market_data.MarketDataCollector(api, args.markets, directory, args.trades_interval,
+                                                    args.orderbook_interval, args.orderbook_depth,
+                                                    workers=args.workers)
+        try:
+            collector.run(args.duration)
+        except KeyboardInterrupt:
+            pass
+    print(collector.summary().to_markdown(tablefmt='github'))
+
+
+def build_parser():
+    org_parser = argparse.ArgumentParser(add_help=False)
+    org_parser.add_argument('-o', '--organization_id', dest="org", help="Organization id", required=True)
+
+    connection_parser = argparse.ArgumentParser(add_help=False)
+    connection_parser.add_argument('-b', '--base_url', dest="base", help="Api base url",
+                                   default="https://api2.nicehash.com")
+    connection_parser.add_argument('-w', '--workers', dest='workers', help="Maximum concurrent API requests",
+                                   type=int, default=8)
+    connection_parser.add_argument('-rl', '--rate_limit', dest='rate_limit', help="Maximum API requests per second",
+                                   type=float)
+    # nicehash.DEFAULT_TIMEOUT, which is not imported here as it needs requests
+    connection_parser.add_argument('-to', '--timeout', dest='timeout', type=float, default=30,
+                                   help="Seconds to connect and to wait for each read of a response before the "
+                                        "request is retried, 0 to wait forever")
+    connection_parser.add_argument('-mx', '--metrics_file', dest='metrics_file',
+                                   help="Write API client metrics to this file, as JSON if it ends with .json else "
+                                        "as Prometheus text")
+    connection_parser.add_argument('-rc', '--response_cache', dest='response_cache',
+                                   help="Cache the responses of slow-changing endpoints like the rig list in this "
+                                        "file for later runs")
+
+    client_parser = argparse.ArgumentParser(add_help=False, parents=[connection_parser])
+    client_parser.add_argument('-k', '--key', dest="key", help="Api key", required=True)
+    client_parser.add_argument('-s', '--secret', dest="secret", help="Secret for api key", required=True)
+
+    window_parser = argparse.ArgumentParser(add_help=False)
+    window_parser.add_argument('-l', '--label', dest="label", help="label")
+    window_parser.add_argument('-r', '--rigs', dest='rigs', help="Additional rigs", nargs='+', default=[])
+    window_parser.add_argument('-d', '--days', dest='days', help="Lookback in days", type=int, choices=range(1, 7),
+                               default=7)
+    window_parser.add_argument('-e', '--end_datetime', dest='end_datetime',
+                               help='End datetime or time in UTC: yyyy-mm-dd-HH:MM:SS or HH:MM:SS',
+                               type=lambda s: try_parsing_datetime(s), default=datetime.now(timezone.utc))
+    window_parser.add_argument('-m', '--monthly', dest='monthly', help="Monthly report", action='store_true')
+    # the keys of storage.STORAGES, which is not imported here as it needs pandas
+    window_parser.add_argument('-st', '--storage', dest='storage', help="Time series cache format",
+                               choices=('csv', 'parquet', 'mmap'), default='mmap')
+    window_parser.add_argument('-nr', '--no_rollups', dest='no_rollups',
+                               help="With --monthly, compute the report from the time series instead of the hourly "
+                                    "rollups kept under data/", action='store_true')
+    window_parser.add_argument('-ec', '--export_csv', dest='export_csv', help="Export the cached time series as CSV",
+                               action='store_true')
+    window_parser.add_argument('-sp', '--stream', dest='stream',
+                               help="Parse stats responses incrementally (needs ijson)", action='store_true')
+
+    discord_parser = argparse.ArgumentParser(add_help=False)
+    discord_parser.add_argument('-di', '--discord-id', dest='discord_id', help='Discord ID')
+    discord_parser.add_argument('-dt', '--discord-token', dest='discord_token', help='Discord Token')
+    discord_parser.add_argument('-pm', '--publish_monthly', dest='publish_monthly', help="Publish monthly report",
+                                action='store_true')
+    discord_parser.add_argument('-pd', '--publish_daily', dest='publish_daily', help="Publish daily report",
+                                action='store_true')
+    discord_parser.add_argument('-dw', '--discord_webhooks', dest='discord_webhooks', nargs='+', default=[],
+                                help="URLs of more Discord webhooks to publish to")
+    discord_parser.add_argument('-fs', '--file_sink', dest='file_sink',
+                                help="Also publish to this directory, appending to its messages.jsonl")
+    discord_parser.add_argument('-pt', '--publish_retries', dest='publish_retries', type=int, default=3,
+                                help="Retries of a failed message per sink")
+
+    parser = argparse.ArgumentParser(description="Without a command, runs report")
+    subparsers = parser.add_subparsers(dest='command', metavar='command', required=True)
+
+    subparser = subparsers.add_parser('rigs', parents=[org_parser, client_parser], help="List the rigs")
+    subparser.set_defaults(function=rigs)
+
+    subparser = subparsers.add_parser('balance', parents=[org_parser, client_parser], help="Print a wallet balance")
+    subparser.add_argument('-c', '--currency', dest='currency', help="Currency", default='BTC')
+    subparser.set_defaults(function=balance)
+
+    subparser = subparsers.add_parser('stats', parents=[org_parser, client_parser, window_parser],
+                                      help="Fetch the rig statistics of the report window, cached with --monthly")
+    subparser.add_argument('-mb', '--memory_budget', dest='memory_budget', type=float,
+                           help="Memory budget in MB of the fleet frame, checked in its memory report")
+    subparser.set_defaults(function=stats)
+
+    subparser = subparsers.add_parser('report', parents=[org_parser, client_parser, window_parser, discord_parser],
+                                      help="Fetch the statistics, then print, save and optionally publish the report")
+    subparser.add_argument('-p', '--payout', dest='payout', help="Payout", action='store_true')
+    subparser.add_argument('-wa', '--watch', dest='watch', help="Keep running and refresh every WATCH seconds",
+                           type=float)
+    subparser.add_argument('-pr', '--profile', dest='profile',
+                           help="Write the time and memory used by each stage to this JSON file")
+    subparser.add_argument('-prd', '--profile_dumps', dest='profile_dumps',
+                           help="With --profile, write cProfile and tracemalloc dumps of each stage to this directory")
+    subparser.set_defaults(function=report)
+
+    subparser = subparsers.add_parser('payout', parents=[org_parser, client_parser, window_parser],
+                                      help="Fetch the statistics and pay the rigs that mined enough, without "
+                                           "rendering the report")
+    subparser.set_defaults(function=payout)
+
+    subparser = subparsers.add_parser('publish', parents=[org_parser, discord_parser],
+                                      help="Publish the last saved report")
+    subparser.set_defaults(function=publish)
+
+    subparser = subparsers.add_parser('batch', parents=[connection_parser, window_parser, discord_parser],
+                                      help="Run the reports of the organizations of a config file in one process")
+    subparser.add_argument('-c', '--config', dest='config', required=True,
+                           help="JSON list of organizations, each with org, key and secret and optionally any other "
+                                "report option, e.g. label, rigs, monthly, payout or discord_id")
+    subparser.add_argument('-p', '--payout', dest='payout', help="Payout", action='store_true')
+    subparser.add_argument('-ow', '--org_workers', dest='org_workers', help="Organizations fetched at once",
+                           type=int, default=4)
+    subparser.add_argument('-pp', '--processes', dest='processes', type=int,
+                           help="Processes computing the reports, the number of CPUs by default")
+    subparser.set_defaults(function=batch, org=None, key=None, secret=None)
+
+    subparser = subparsers.add_parser('trend', parents=[org_parser],
+                                      help="Print a metric per rig and month from the hourly rollups of the monthly "
+                                           "reports, without API requests")
+    subparser.add_argument('-st', '--storage', dest='storage', help="Rollup format",
+                           choices=('csv', 'parquet', 'mmap'), default='mmap')
+    # the values of pipeline.TREND_METRICS
+    subparser.add_argument('-mt', '--metric', dest='metric', help="Metric: hours/day, MH/s or \u03BCBTC/day",
+                           choices=('hours', 'speed', 'profitability'), default='hours')
+    subparser.add_argument('-mo', '--months', dest='months', help="Number of latest months", type=int, default=12)
+    subparser.set_defaults(function=trend)
+
+    subparser = subparsers.add_parser('backfill', parents=[org_parser, client_parser],
+                                      help="Fetch the rig statistics of many months into the monthly cache, resuming "
+                                           "an interrupted run; pool statistics are not backfilled")
+    subparser.add_argument('-f', '--from_datetime', dest='from_datetime', required=True,
+                           help='Start datetime in UTC: yyyy-mm-dd-HH:MM:SS', type=lambda s: try_parsing_datetime(s))
+    subparser.add_argument('-t', '--to_datetime', dest='to_datetime',
+                           help='End datetime or time in UTC: yyyy-mm-dd-HH:MM:SS or HH:MM:SS',
+                           type=lambda s: try_parsing_datetime(s), default=datetime.now(timezone.utc))
+    subparser.add_argument('-wh', '--window_hours', dest='window_hours', type=int, default=24,
+                           help="Hours of statistics per request")
+    subparser.add_argument('-r', '--rigs', dest='rigs', help="Additional rigs", nargs='+', default=[])
+    subparser.add_argument('-st', '--storage', dest='storage', help="Time series cache format",
+                           choices=('csv', 'parquet', 'mmap'), default='mmap')
+    subparser.add_argument('-nr', '--no_rollups', dest='no_rollups', help="Do not roll up the backfilled months",
+                           action='store_true')
+    subparser.set_defaults(function=backfill)
+
+    subparser = subparsers.add_parser('market', parents=[connection_parser],
+                                      help="Collect exchange candlesticks, trades and orderbooks under data/market")
+    subparser.add_argument('-mk', '--markets', dest='markets', nargs='+', required=True, help="Markets, e.g. BTCUSDT")
+    subparser.add_argument('-cf', '--candles_from', dest='candles_from', type=lambda s: try_parsing_datetime(s),
+                           help="First fetch the candlesticks from this datetime in UTC: yyyy-mm-dd-HH:MM:SS")
+    subparser.add_argument('-cr', '--candles_resolution', dest='candles_resolution', type=int, choices=(1, 60, 1440),
+                           default=60, help="Candlestick resolution in minutes")
+    subparser.add_argument('-st', '--storage', dest='storage', help="Candlestick file format",
+                           choices=('csv', 'parquet', 'mmap'), default='mmap')
+    subparser.add_argument('-ti', '--trades_interval', dest='trades_interval', type=float, default=10,
+                           help="Seconds between trade polls")
+    subparser.add_argument('-oi', '--orderbook_interval', dest='orderbook_interval', type=float, default=60,
+                           help="Seconds between orderbook snapshots")
+    subparser.add_argument('-od', '--orderbook_depth', dest='orderbook_depth', type=int, default=20,
+                           help="Price levels per orderbook side")
+    subparser.add_argument('-du', '--duration', dest='duration', type=float,
+                           help="Seconds to poll for, until interrupted by default, 0 to only fetch the candlesticks")
+    subparser.set_defaults(function=market)
+    return parser
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] not in COMMANDS and argv[0] not in ('-h', '--help'):
+        # command lines from before the subcommands run the report
+        argv.insert(0, 'report')
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == 'report':
+        if args.watch is not None and args.payout:
+            parser.error('--payout cannot be used with --watch')
+        if args.watch is not None and args.profile:
+            parser.error('--profile cannot be used with --watch')
+        if args.profile_dumps and not args.profile:
+            parser.error('--profile_dumps needs --profile')
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
     exit(0)
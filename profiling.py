@@ -0,0 +1,114 @@
+import json
+import os
+import threading
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+from time import perf_counter, process_time, thread_time
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+TRACEMALLOC_TOP_LINES = 25
+
+
+def max_rss_mb():
+    if resource is None:
+        return None
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageProfiler:
+    # wall time, CPU time and peak RSS per named pipeline stage, accumulated over calls. Stages opened in the main
+    # thread outside any other stage are top-level: their CPU time is the whole process' and, with a dump
+    # directory, they are run under cProfile and tracemalloc, dumped as {stage}.prof and {stage}.tracemalloc.txt.
+    # Stages opened inside another one or in worker threads, e.g. per-request stages of the fetch, only get their
+    # thread's CPU time, and their wall times add up across threads
+
+    def __init__(self, dump_directory=None):
+        self.dump_directory = dump_directory
+        self.started = datetime.now(timezone.utc)
+        self.start = perf_counter()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stages = {}
+        if dump_directory is not None:
+            os.makedirs(dump_directory, exist_ok=True)
+
+    def record(self, name, top_level, **values):
+        # times and RSS growth add up over calls, peaks are the highest one
+        with self.lock:
+            stage = self.stages.setdefault(name, {'top_level': top_level, 'calls': 0, 'wall_time': 0.0,
+                                                  'cpu_time': 0.0})
+            stage['calls'] += 1
+            for key, value in values.items():
+                if value is None:
+                    continue
+                if key in ('max_rss_mb', 'traced_peak_mb'):
+                    stage[key] = max(stage.get(key, value), value)
+                else:
+                    stage[key] = stage.get(key, 0.0) + value
+
+    @contextmanager
+    def stage(self, name):
+        top_level = threading.current_thread() is threading.main_thread() and not getattr(self.local, 'active', False)
+        if not top_level:
+            wall_start, cpu_start = perf_counter(), thread_time()
+            try:
+                yield
+            finally:
+                self.record(name, False, wall_time=perf_counter() - wall_start, cpu_time=thread_time() - cpu_start)
+            return
+
+        self.local.active = True
+        profile = None
+        if self.dump_directory is not None:
+            import cProfile
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            profile = cProfile.Profile()
+        rss_start = max_rss_mb()
+        wall_start, cpu_start = perf_counter(), process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall_time, cpu_time = perf_counter() - wall_start, process_time() - cpu_start
+            self.local.active = False
+            rss_end = max_rss_mb()
+            traced_peak_mb = None
+            if profile is not None:
+                traced_peak_mb = self.dump(name, profile)
+            self.record(name, True, wall_time=wall_time, cpu_time=cpu_time, max_rss_mb=rss_end,
+                        max_rss_growth_mb=None if rss_end is None else rss_end - rss_start,
+                        traced_peak_mb=traced_peak_mb)
+
+    def dump(self, name, profile):
+        import tracemalloc
+        _, traced_peak = tracemalloc.get_traced_memory()
+        profile.dump_stats(os.path.join(self.dump_directory, f'{name}.prof'))
+        top_stats = tracemalloc.take_snapshot().statistics('lineno')[:TRACEMALLOC_TOP_LINES]
+        with open(os.path.join(self.dump_directory, f'{name}.tracemalloc.txt'), 'w') as fp:
+            fp.write(f'peak traced memory: {traced_peak / 2 ** 20:.2f} MB\n')
+            fp.writelines(f'{stat}\n' for stat in top_stats)
+        return traced_peak / 2 ** 20
+
+    def report(self):
+        with self.lock:
+            return {'started': self.started.isoformat(), 'wall_time': perf_counter() - self.start,
+                    'max_rss_mb': max_rss_mb(), 'stages': {name: dict(stage) for name, stage in self.stages.items()}}
+
+    def write(self, filepath):
+        with open(filepath, 'w') as fp:
+            json.dump(self.report(), fp, indent=2)
+
+
+def profile_stage(profiler: StageProfiler, name):
+    return nullcontext() if profiler is None else profiler.stage(name)
@@ -0,0 +1,219 @@
+import json
+import os
+import random
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import sleep
+
+PUBLISH_USERNAME = 'Earn Your Hours'
+PUBLISH_COLOUR = 15258703
+DEFAULT_PUBLISH_RETRIES = 3
+DEFAULT_PUBLISH_BACKOFF_FACTOR = 1.0
+
+
+def daily_hours_filepath(org, start_datetime: datetime, extension):
+    return os.path.join('data', f'daily_hours_{org}_{start_datetime:%Y_%m}{extension}')
+
+
+def last_report_filepath(org):
+    return os.path.join('data', f'last_report_{org}.json')
+
+
+def save_last_report(org, title, start_datetime: datetime, end_datetime: datetime, results_str):
+    # what publish needs, so the last report can be published again without refetching or recomputing it
+    with open(last_report_filepath(org), 'w') as fp:
+        json.dump({'title': title, 'start_datetime': start_datetime.isoformat(),
+                   'end_datetime': end_datetime.isoformat(), 'results': results_str}, fp)
+
+
+def load_last_report(org):
+    with open(last_report_filepath(org), 'r') as fp:
+        report = json.load(fp)
+    return (report['title'], datetime.fromisoformat(report['start_datetime']),
+            datetime.fromisoformat(report['end_datetime']), report['results'])
+
+
+class Message:
+    # what a sink publishes: a text content, an optional embed and files attached by path
+
+    def __init__(self, content=None, embed_title=None, embed_description=None, filepaths=()):
+        self.content = content
+        self.embed_title = embed_title
+        self.embed_description = embed_description
+        self.filepaths = list(filepaths)
+
+    def to_json(self):
+        return {'content': self.content, 'embed_title': self.embed_title,
+                'embed_description': self.embed_description,
+                'files': [os.path.basename(filepath) for filepath in self.filepaths]}
+
+
+class DiscordSink:
+    # a Discord channel webhook, given as its URL or its id and token
+
+    def __init__(self, url=None, webhook_id=None, token=None):
+        self.url = url
+        self.webhook_id = webhook_id
+        self.token = token
+        self.name = f'Discord webhook {webhook_id if url is None else url.rstrip("/").rsplit("/", 2)[-2]}'
+
+    def send(self, message: Message):
+        from discord import Webhook, RequestsWebhookAdapter, Embed, File
+
+        webhook = Webhook.from_url(self.url, adapter=RequestsWebhookAdapter()) if self.url is not None else \
+            Webhook.partial(self.webhook_id, self.token, adapter=RequestsWebhookAdapter())
+        embed = None
+        if message.embed_title is not None:
+            embed = Embed()
+            embed.title = message.embed_title
+            embed.colour = PUBLISH_COLOUR
+            embed.description = message.embed_description
+        # files are opened on every attempt, as a failed attempt may have read them
+        files = [File(filepath) for filepath in message.filepaths]
+        try:
+            webhook.send(username=PUBLISH_USERNAME, content=message.content, embed=embed, files=files or None)
+        finally:
+            for file in files:
+                file.close()
+
+    def retryable(self, err):
+        # connection errors, rate limits and server errors; rejected messages, e.g. a wrong token or a too long
+        # embed, fail the same way again, like a missing discord module
+        status = getattr(err, 'status', None)
+        return not isinstance(err, ImportError) and (status is None or status == 429 or status >= 500)
+
+
+class FileSink:
+    # appends messages to {directory}/messages.jsonl and copies their files next to it, e.g. to test publishing
+    # without a Discord channel
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.name = f'file sink {directory}'
+        self.lock = threading.Lock()
+
+    def send(self, message: Message):
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for filepath in message.filepaths:
+                shutil.copyfile(filepath, os.path.join(self.directory, os.path.basename(filepath)))
+            with open(os.path.join(self.directory, 'messages.jsonl'), 'a') as fp:
+                fp.write(json.dumps({'time': datetime.now(timezone.utc).isoformat(), **message.to_json()}) + '\n')
+
+    def retryable(self, err):
+        return False
+
+
+def publish_sinks(args):
+    # the sinks of the Discord and file sink options
+    sinks = []
+    if args.discord_id is not None and args.discord_token is not None:
+        sinks.append(DiscordSink(webhook_id=args.discord_id, token=args.discord_token))
+    sinks += [DiscordSink(url) for url in args.discord_webhooks]
+    if args.file_sink is not None:
+        sinks.append(FileSink(args.file_sink))
+    return sinks
+
+
+def publishes(args):
+    return bool(publish_sinks(args)) and (args.publish_monthly or args.publish_daily)
+
+
+class Publisher:
+    # publishing stage running beside the report: charts are rendered in a worker process and messages are sent to
+    # their sinks in threads, workers at a time, each retried up to retries times with exponential backoff.
+    # A message waits for the charts rendered to its files, so the report goes on while they are rendered and sent
+
+    def __init__(self, workers=4, retries=DEFAULT_PUBLISH_RETRIES, backoff_factor=DEFAULT_PUBLISH_BACKOFF_FACTOR):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.processes = None
+        self.charts = {}
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def render(self, filepath, function, *args):
+        # function(*args) writes the chart at filepath in the worker process; the returned future raises its error
+        if self.processes is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # forked to reuse the modules already imported, unless other threads run, whose locks could be copied
+            # held into the worker; it is then spawned
+            method = 'fork' if threading.active_count() == 1 and 'fork' in multiprocessing.get_all_start_methods() \
+                else 'spawn'
+            self.processes = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context(method))
+        future = self.processes.submit(function, *args)
+        with self.lock:
+            self.charts[filepath] = future
+            self.futures.append(future)
+        return future
+
+    def send(self, sinks, message: Message):
+        # one future per sink, raising the error of its last attempt
+        futures = [self.executor.submit(self.deliver, sink, message) for sink in sinks]
+        with self.lock:
+            self.futures += futures
+        return futures
+
+    def deliver(self, sink, message: Message):
+        with self.lock:
+            charts = [self.charts[filepath] for filepath in message.filepaths if filepath in self.charts]
+        try:
+            for chart in charts:
+                chart.result()
+        except Exception as err:
+            print(f'Failed to render a chart for {sink.name}: {err!r}')
+            raise
+        for attempt in range(self.retries + 1):
+            try:
+                return sink.send(message)
+            except Exception as err:
+                if attempt >= self.retries or not sink.retryable(err):
+                    print(f'Failed to publish to {sink.name}: {err!r}')
+                    raise
+                sleep(self.backoff_factor * 2 ** attempt * random.uniform(0.5, 1))
+
+    def wait(self):
+        # wait for every chart and message so far, returning the errors
+        with self.lock:
+            futures, self.futures = self.futures, []
+        return [future.exception() for future in futures if future.exception() is not None]
+
+    def close(self):
+        self.wait()
+        self.executor.shutdown()
+        if self.processes is not None:
+            self.processes.shutdown()
+
+
+def publish(args, title, start_datetime: datetime, end_datetime: datetime, results_str, publisher: Publisher = None):
+    # send the monthly embed and/or the daily hours files to the sinks of args through publisher, returning a future
+    # per message and sink; without a publisher, they are sent before returning
+    if not publishes(args):
+        return []
+    sinks = publish_sinks(args)
+    if publisher is None:
+        with Publisher() as publisher:
+            return publish(args, title, start_datetime, end_datetime, results_str, publisher)
+    futures = []
+    if args.publish_monthly:
+        print('\nPublish monthly report')
+        futures += publisher.send(sinks, Message(
+            embed_title=title, embed_description=f'```{start_datetime:%b %d %Y %H:%M:%S %Z} to '
+                                                 f'{end_datetime:%b %d %Y %H:%M:%S %Z}\n{results_str}```'))
+    if args.publish_daily:
+        print('\nPublish daily report')
+        futures += publisher.send(sinks, Message(content=title, filepaths=[
+            daily_hours_filepath(args.org, start_datetime, '.csv'),
+            daily_hours_filepath(args.org, start_datetime, '.png')]))
+    return futures
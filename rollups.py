@@ -0,0 +1,98 @@
+import json
+import os
+
+import pandas as pd
+
+from metrics import HOUR_MS, TOTAL_COLUMNS, daily_totals_from_hourly, hourly_totals, to_fleet
+from storage import CsvStorage, fill_timeseries, splice_timeseries
+
+
+def empty_rollup():
+    return pd.DataFrame(columns=TOTAL_COLUMNS, dtype='float64',
+                        index=pd.MultiIndex.from_arrays([[], []], names=['rig', 'time']))
+
+
+class RollupStore:
+    # hourly totals (see metrics.hourly_totals) materialized per (org, rig) as one time series per rig spanning all
+    # months, with a row for every hour from the first one rolled up, so that long windows read hours instead of
+    # raw samples. A watermarks file per org keeps the last sample rolled up per rig: the interval starting at it
+    # is the only one a new sample can change, so an update only recomputes the hours from the watermark's on
+
+    def __init__(self, directory, storage=None):
+        self.directory = directory
+        self.storage = CsvStorage() if storage is None else storage
+        self.frames = {}
+
+    def filepath(self, org, rig_id):
+        return os.path.join(self.directory, f'rollup_{org}_{rig_id}_hourly{self.storage.extension}')
+
+    def watermarks_filepath(self, org):
+        return os.path.join(self.directory, f'rollup_{org}.json')
+
+    def watermarks(self, org):
+        filepath = self.watermarks_filepath(org)
+        if not os.path.exists(filepath):
+            return {}
+        with open(filepath, 'r') as fp:
+            return json.load(fp)
+
+    def write_watermarks(self, org, watermarks):
+        # written once the rollups are stored, so a crash in between only recomputes more hours next time
+        tmp_filepath = self.watermarks_filepath(org) + '.tmp'
+        with open(tmp_filepath, 'w') as fp:
+            json.dump(watermarks, fp)
+        os.replace(tmp_filepath, self.watermarks_filepath(org))
+
+    def load(self, org, rig_id):
+        key = (org, rig_id)
+        if key not in self.frames:
+            self.frames[key] = self.storage.load(self.filepath(org, rig_id))
+        return self.frames[key]
+
+    def update(self, org, rig_frames, start_timestamp, end_timestamp, rebuild=False):
+        # roll up the hours before end_timestamp of rig_frames ({rig_id: {algo: df}}), which must hold every sample
+        # from start_timestamp on, e.g. the monthly time series cache; like the stats requests, samples at
+        # end_timestamp count as the end of the last interval. With rebuild, every hour of the window is
+        # recomputed whatever the watermarks and later hours are kept, e.g. for months backfilled after later ones
+        watermarks = self.watermarks(org)
+        since = {rig_id: (start_timestamp if rebuild else max(start_timestamp, watermarks.get(rig_id, start_timestamp)))
+                 // HOUR_MS * HOUR_MS for rig_id in rig_frames}
+        recent_frames = {rig_id: {algo: df[(df.index >= since[rig_id]) & (df.index <= end_timestamp)]
+                                  for algo, df in algo_frames.items()} for rig_id, algo_frames in rig_frames.items()}
+        df_hourly = hourly_totals(to_fleet(recent_frames))
+        rolled_up_rig_ids = set(df_hourly.index.get_level_values('rig'))
+        for rig_id, algo_frames in recent_frames.items():
+            hours = pd.Index(range(since[rig_id], end_timestamp, HOUR_MS), dtype='int64', name='time')
+            df = df_hourly.xs(rig_id, level='rig') if rig_id in rolled_up_rig_ids else empty_rollup().droplevel('rig')
+            df = df.reindex(hours, fill_value=0).astype('float64')
+            if rebuild:
+                df_merged = fill_timeseries(self.load(org, rig_id), df, since[rig_id], end_timestamp)
+                self.storage.replace(self.filepath(org, rig_id), df_merged)
+            else:
+                df_merged = splice_timeseries(self.load(org, rig_id), df)
+                self.storage.store(self.filepath(org, rig_id), df, df_merged)
+            self.frames[org, rig_id] = df_merged
+            last_samples = [int(df.index[-1]) for df in algo_frames.values() if len(df) > 0]
+            if last_samples:
+                watermarks[rig_id] = max(watermarks.get(rig_id, 0), max(last_samples))
+        self.write_watermarks(org, watermarks)
+
+    def hourly_totals(self, org, rig_ids, start_timestamp=None, end_timestamp=None):
+        # rolled up hours of rig_ids from start_timestamp and before end_timestamp, indexed by (rig, time)
+        frames = {}
+        for rig_id in rig_ids:
+            df = self.load(org, rig_id)
+            if df is None:
+                continue
+            if start_timestamp is not None:
+                df = df[df.index >= start_timestamp]
+            if end_timestamp is not None:
+                df = df[df.index < end_timestamp]
+            frames[rig_id] = df[TOTAL_COLUMNS]
+        return pd.concat(frames, names=['rig', 'time']) if frames else empty_rollup()
+
+    def daily_totals(self, org, rig_ids, start_timestamp=None, end_timestamp=None):
+        return daily_totals_from_hourly(self.hourly_totals(org, rig_ids, start_timestamp, end_timestamp))
+
+    def rig_ids(self, org):
+        return list(self.watermarks(org))
@@ -0,0 +1,217 @@
+import contextlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+def concat_timeseries(frames):
+    # empty frames are left out, pandas no longer using them to determine the result dtypes; all empty, the last one
+    # is returned
+    non_empty_frames = [df for df in frames if len(df) > 0]
+    return pd.concat(non_empty_frames, sort=True) if non_empty_frames else frames[-1]
+
+
+def splice_timeseries(df_cache: pd.DataFrame, df: pd.DataFrame):
+    # new samples replace cached ones from the first new timestamp on
+    if df_cache is None:
+        return df
+    if len(df) > 0:
+        df_cache = df_cache[df_cache.index < df.index[0]]
+    df = concat_timeseries([df_cache, df])
+    assert not any(df.index.duplicated())
+    return df
+
+
+def timeseries_until(df: pd.DataFrame, end_timestamp):
+    # samples up to end_timestamp included, sliced from the sorted time index without a copy
+    return df.iloc[:df.index.searchsorted(end_timestamp, side='right')]
+
+
+def fill_timeseries(df_cache: pd.DataFrame, df: pd.DataFrame, start_timestamp, end_timestamp):
+    # new samples replace the cached ones from start_timestamp and before end_timestamp, the others are kept, so
+    # ranges can be filled in any order
+    if df_cache is None:
+        return df
+    df_cache = df_cache[(df_cache.index < start_timestamp) | (df_cache.index >= end_timestamp)]
+    df = concat_timeseries([df_cache, df]).sort_index()
+    assert not any(df.index.duplicated())
+    return df
+
+
+class CsvStorage:
+    # human readable, rewritten on every store
+    extension = '.csv'
+
+    def load(self, path):
+        return pd.read_csv(path, index_col='time') if os.path.exists(path) else None
+
+    def store(self, path, df: pd.DataFrame, df_merged: pd.DataFrame):
+        df_merged.reindex(sorted(df_merged.columns), axis=1).to_csv(path)
+
+    def replace(self, path, df: pd.DataFrame):
+        self.store(path, df, df)
+
+
+class ParquetStorage:
+    # typed columnar file, rewritten on every store but loaded without text parsing; needs pyarrow
+    extension = '.parquet'
+
+    def load(self, path):
+        return pd.read_parquet(path) if os.path.exists(path) else None
+
+    def store(self, path, df: pd.DataFrame, df_merged: pd.DataFrame):
+        tmp_path = path + '.tmp'
+        df_merged.reindex(sorted(df_merged.columns), axis=1).to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+
+    def replace(self, path, df: pd.DataFrame):
+        self.store(path, df, df)
+
+
+class MmapStorage:
+    # directory holding the int64 time index and a row-major float64 values matrix as raw little-endian files, plus
+    # a meta file with the column names, the number of committed rows and the generation of the data files. New rows
+    # are written after the committed ones and committed by rewriting the meta file; a merge changing committed rows
+    # writes every row to the files of the next generation instead, committed the same way. Committed rows are thus
+    # never overwritten, a crash at any point leaves the last committed rows readable, and loads are read-only
+    # memory maps
+    extension = '.mmap'
+    index_dtype = np.dtype('<i8')
+    values_dtype = np.dtype('<f8')
+
+    def read_meta(self, path):
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as fp:
+            return json.load(fp)
+
+    def write_meta(self, path, columns, length, generation):
+        tmp_path = os.path.join(path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump({'columns': columns, 'length': length, 'generation': generation}, fp)
+        os.replace(tmp_path, os.path.join(path, 'meta.json'))
+
+    @staticmethod
+    def filepaths(path, generation):
+        # generation 0, also that of the caches written before generations, has no suffix
+        suffix = f'.{generation}' if generation else ''
+        return os.path.join(path, f'time{suffix}.i8'), os.path.join(path, f'values{suffix}.f8')
+
+    def load_arrays(self, path, meta):
+        length, nb_columns = meta['length'], len(meta['columns'])
+        if length == 0:
+            return np.empty(0, self.index_dtype), np.empty((0, nb_columns), self.values_dtype)
+        index_filepath, values_filepath = self.filepaths(path, meta.get('generation', 0))
+        index = np.memmap(index_filepath, dtype=self.index_dtype, mode='r', shape=(length,))
+        values = np.memmap(values_filepath, dtype=self.values_dtype, mode='r', shape=(length, nb_columns))
+        return index, values
+
+    def load(self, path):
+        meta = self.read_meta(path)
+        if meta is None:
+            return None
+        index, values = self.load_arrays(path, meta)
+        return pd.DataFrame(values, index=pd.Index(index, name='time', copy=False), columns=meta['columns'],
+                            copy=False)
+
+    def write_rows(self, path, generation, start, df: pd.DataFrame):
+        arrays = (np.ascontiguousarray(df.index.to_numpy(), dtype=self.index_dtype),
+                  np.ascontiguousarray(df.to_numpy(), dtype=self.values_dtype))
+        for filepath, array in zip(self.filepaths(path, generation), arrays):
+            with open(filepath, 'r+b' if start > 0 and os.path.exists(filepath) else 'wb') as fp:
+                fp.seek(start * array.nbytes // len(array))
+                fp.write(array.tobytes())
+
+    def store(self, path, df: pd.DataFrame, df_merged: pd.DataFrame):
+        columns = sorted(df_merged.columns)
+        meta = self.read_meta(path)
+        if meta is None or meta['columns'] != columns:
+            # first store or a new column layout
+            self.replace(path, df_merged)
+            return
+        if len(df) == 0:
+            return
+        df = df.reindex(columns, axis=1)
+        index, values = self.load_arrays(path, meta)
+        start = int(np.searchsorted(index, df.index[0]))
+        # the rows of df over committed ones usually are the same samples fetched again, which are skipped
+        overlap = min(meta['length'] - start, len(df))
+        committed_values, new_values = values[start:start + overlap], df.to_numpy()[:overlap]
+        same = (index[start:start + overlap] == df.index.to_numpy()[:overlap]) & \
+            ((committed_values == new_values) | (np.isnan(committed_values) & np.isnan(new_values))).all(axis=1)
+        if not same.all():
+            self.replace(path, df_merged)
+            return
+        if overlap < len(df):
+            self.write_rows(path, meta.get('generation', 0), meta['length'], df.iloc[overlap:])
+        self.write_meta(path, columns, start + len(df), meta.get('generation', 0))
+
+    def replace(self, path, df: pd.DataFrame):
+        # rewrite every row into the files of the next generation, for merges that change committed rows; the
+        # files of the previous one are removed once the new ones are committed
+        os.makedirs(path, exist_ok=True)
+        columns = sorted(df.columns)
+        meta = self.read_meta(path)
+        generation = 0 if meta is None else meta.get('generation', 0) + 1
+        if len(df) > 0:
+            self.write_rows(path, generation, 0, df.reindex(columns, axis=1))
+        self.write_meta(path, columns, len(df), generation)
+        if meta is not None:
+            for filepath in self.filepaths(path, meta.get('generation', 0)):
+                # still mapped by frames loaded from them on Windows, where they are left behind
+                with contextlib.suppress(OSError):
+                    os.remove(filepath)
+
+
+STORAGES = {'csv': CsvStorage, 'parquet': ParquetStorage, 'mmap': MmapStorage}
+
+
+class ColumnSpill:
+    # append-only columnar rows without an index, e.g. trades that can share a timestamp: a directory with one raw
+    # little-endian file per column and a meta file with the column dtypes and the number of committed rows. Rows are
+    # written after the committed ones, then committed by rewriting the meta file, and loaded as read-only memory maps
+
+    def __init__(self, path):
+        self.path = path
+
+    def read_meta(self):
+        meta_path = os.path.join(self.path, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as fp:
+            return json.load(fp)
+
+    def write_meta(self, meta):
+        tmp_path = os.path.join(self.path, 'meta.json.tmp')
+        with open(tmp_path, 'w') as fp:
+            json.dump(meta, fp)
+        os.replace(tmp_path, os.path.join(self.path, 'meta.json'))
+
+    def append(self, df: pd.DataFrame):
+        if len(df) == 0:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        meta = self.read_meta()
+        if meta is None:
+            meta = {'dtypes': {column: df[column].dtype.newbyteorder('<').str for column in df.columns}, 'length': 0}
+        elif list(meta['dtypes']) != list(df.columns):
+            raise ValueError(f'Columns {list(df.columns)} do not match the spilled ones {list(meta["dtypes"])}')
+        for column, dtype in meta['dtypes'].items():
+            array = np.ascontiguousarray(df[column].to_numpy(), dtype=dtype)
+            filepath = os.path.join(self.path, f'{column}.bin')
+            with open(filepath, 'r+b' if os.path.exists(filepath) else 'wb') as fp:
+                fp.seek(meta['length'] * array.itemsize)
+                fp.write(array.tobytes())
+        self.write_meta({**meta, 'length': meta['length'] + len(df)})
+
+    def load(self):
+        meta = self.read_meta()
+        if meta is None:
+            return None
+        return pd.DataFrame({column: np.memmap(os.path.join(self.path, f'{column}.bin'), dtype=dtype, mode='r',
+                                               shape=(meta['length'],)) if meta['length'] else np.empty(0, dtype)
+                             for column, dtype in meta['dtypes'].items()}, copy=False)
+
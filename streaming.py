@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+SAMPLE_INTERVAL_MS = 5 * 60 * 1000
+
+
+def estimate_capacity(start_timestamp, end_timestamp):
+    # stats are sampled every 5 minutes
+    if start_timestamp is None or end_timestamp is None:
+        return 1024
+    return max(1, (end_timestamp - start_timestamp) // SAMPLE_INTERVAL_MS + 1)
+
+
+def parse_stats(fp, capacity=1024):
+    # read a {"columns": [...], "data": [[...], ...]} stats payload event by event, writing each row straight into
+    # a preallocated float64 buffer that doubles when full, so no per-row Python lists outlive their row
+    import ijson
+
+    columns = []
+    buffer = None
+    nb_rows = 0
+    row = []
+    for prefix, event, value in ijson.parse(fp, use_float=True):
+        if prefix == 'columns.item':
+            columns.append(value)
+        elif prefix == 'data.item.item':
+            row.append(np.nan if value is None else value)
+        elif prefix == 'data.item' and event == 'end_array':
+            if buffer is None:
+                buffer = np.empty((capacity, len(row)), dtype=np.float64)
+            elif nb_rows == len(buffer):
+                buffer = np.resize(buffer, (2 * len(buffer), buffer.shape[1]))
+            buffer[nb_rows] = row
+            nb_rows += 1
+            row.clear()
+
+    return stats_array_to_df(columns, np.empty((0, len(columns))) if buffer is None else buffer[:nb_rows])
+
+
+def stats_array_to_df(columns, values):
+    time_column = columns.index('time')
+    index = pd.Index(values[:, time_column].astype(np.int64), name='time')
+    values = np.delete(values, time_column, axis=1)
+    return pd.DataFrame(values, index=index, columns=columns[:time_column] + columns[time_column + 1:],
+                        copy=False).sort_index()
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the modules are flat at the root of the repository, next to the benchmarks' mock server
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
@@ -0,0 +1,92 @@
+from datetime import datetime, timezone
+
+import pandas as pd
+import pool_spy
+import pytest
+from backfilling import BackfillCheckpoint, backfill_windows, run_backfill, to_timestamp
+from mock_server import MockNicehash
+from nicehash import ServerError, private_api
+from pipeline import ALGOS, TimeseriesCache
+from storage import STORAGES
+
+MONTH = datetime(2024, 3, 1, tzinfo=timezone.utc)
+# the window of each series failing in the first run
+HOLE = to_timestamp(datetime(2024, 3, 3, tzinfo=timezone.utc))
+
+
+class CountingApi:
+    # a private_api counting its rig stats requests and failing those starting at one of failing_timestamps
+
+    def __init__(self, api, failing_timestamps=()):
+        self.api = api
+        self.failing_timestamps = set(failing_timestamps)
+        self.requests = []
+
+    def __getattr__(self, name):
+        return getattr(self.api, name)
+
+    def get_rig_stats(self, rig_id, start_time, end_time, algorithm, parse=None):
+        self.requests.append((rig_id, algorithm, start_time, end_time))
+        if start_time in self.failing_timestamps:
+            raise ServerError(503, 'Service Unavailable')
+        return self.api.get_rig_stats(rig_id, start_time, end_time, algorithm, parse)
+
+
+@pytest.fixture
+def mock():
+    with MockNicehash(nb_rigs=2) as mock:
+        yield mock
+
+
+def backfill(mock, directory, monkeypatch, failing_timestamps=()):
+    directory.joinpath('data').mkdir(parents=True, exist_ok=True)
+    monkeypatch.chdir(directory)
+    args = pool_spy.build_parser().parse_args(['backfill', '-o', 'org', '-b', mock.url, '-k', 'k', '-s', 's',
+                                               '-f', '2024-03-01-00:00:00', '-t', '2024-03-06-00:00:00', '-w', '2'])
+    with private_api(mock.url, 'org', 'k', 's') as api:
+        api = CountingApi(api, failing_timestamps)
+        failures = run_backfill(args, api)
+    return api.requests, failures
+
+
+def cached_series(directory, rig_ids):
+    cache = TimeseriesCache(str(directory / 'data'), MONTH, STORAGES['mmap']())
+    return {(rig_id, algo): cache.load('org', rig_id, algo) for rig_id in rig_ids for algo in ALGOS}
+
+
+def test_windows_do_not_span_months():
+    windows = list(backfill_windows(datetime(2024, 1, 31, 12, tzinfo=timezone.utc),
+                                    datetime(2024, 2, 2, tzinfo=timezone.utc), pd.Timedelta(hours=24)))
+    assert [(f'{month:%m}', f'{after:%d %H}', f'{before:%d %H}') for month, after, before in windows] == [
+        ('01', '31 12', '01 00'), ('02', '01 00', '02 00')]
+
+
+def test_failed_windows_are_fetched_again_with_the_windows_after_them(mock, tmp_path, monkeypatch):
+    requests, failures = backfill(mock, tmp_path / 'backfill', monkeypatch, [HOLE])
+    rig_ids = sorted({rig_id for rig_id, _, _, _ in requests})
+    assert sorted((rig_id, algo, after) for _, rig_id, algo, after, _ in failures) == \
+        sorted((rig_id, algo, HOLE) for rig_id in rig_ids for algo in ALGOS)
+    # neither the checkpoint nor the cache pass the hole
+    checkpoint = BackfillCheckpoint(str(tmp_path / 'backfill' / 'data' / 'backfill_org.txt'))
+    assert {int(key.split()[2]) for key in checkpoint.completed} == {HOLE - 2 * 86400000, HOLE - 86400000}
+    for df in cached_series(tmp_path / 'backfill', rig_ids).values():
+        assert df is None or len(df) == 0 or df.index[-1] <= HOLE
+    # the month is only rolled up once complete
+    assert not (tmp_path / 'backfill' / 'data' / 'rollup_org.json').exists()
+
+    requests, failures = backfill(mock, tmp_path / 'backfill', monkeypatch)
+    assert not failures
+    assert sorted({start_time for _, _, start_time, _ in requests}) == [HOLE, HOLE + 86400000, HOLE + 2 * 86400000]
+    assert (tmp_path / 'backfill' / 'data' / 'rollup_org.json').exists()
+    # a run without failures gives the same series
+    backfill(mock, tmp_path / 'reference', monkeypatch)
+    reference_series = cached_series(tmp_path / 'reference', rig_ids)
+    for key, df in cached_series(tmp_path / 'backfill', rig_ids).items():
+        # algorithms the rig never mined have no file
+        assert (df is None) == (reference_series[key] is None)
+        if df is not None:
+            pd.testing.assert_frame_equal(df, reference_series[key])
+
+    # then everything is checkpointed
+    requests, failures = backfill(mock, tmp_path / 'backfill', monkeypatch)
+    assert not requests and not failures
@@ -0,0 +1,29 @@
+import pool_spy
+import pytest
+from mock_server import MockNicehash
+from pipeline import run_batch
+from publishing import last_report_filepath
+
+
+@pytest.fixture
+def mock():
+    with MockNicehash(nb_rigs=3) as mock:
+        yield mock
+
+
+def test_invalid_entries_only_fail_their_organization(mock, tmp_path, monkeypatch):
+    monkeypatch.setenv('MPLBACKEND', 'Agg')
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    args = pool_spy.build_parser().parse_args(['batch', '-c', 'batch.json', '-b', mock.url, '-e', '2024-04-03-00:00:00',
+                                               '-d', '2', '-pp', '1'])
+    entries = [{'org': 'first', 'key': 'k', 'secret': 's'},
+               {'org': 'unknown', 'key': 'k', 'secret': 's', 'colour': 'red'},
+               {'org': 'missing', 'key': 'k'},
+               ['not', 'an', 'entry'],
+               {'org': 'last', 'key': 'k', 'secret': 's', 'label': 'Last'}]
+    failed_orgs = run_batch(args, entries)
+    assert list(failed_orgs) == ['unknown', 'missing', '#4']
+    assert all(isinstance(err, ValueError) for err in list(failed_orgs.values())[:2])
+    # the valid organizations around them are still reported
+    assert [org for org in ('first', 'last') if (tmp_path / last_report_filepath(org)).exists()] == ['first', 'last']
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+
+import pandas as pd
+import pytest
+from mock_server import MockNicehash
+from nicehash import private_api
+from pipeline import ALGOS, TimeseriesCache, fetch_stats, report_window
+from storage import STORAGES
+
+MONTH = datetime(2024, 4, 1, tzinfo=timezone.utc)
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+@pytest.fixture
+def api():
+    with MockNicehash(nb_rigs=3) as mock:
+        api = private_api(mock.url, 'org', 'k', 's')
+        yield api
+        api.session.close()
+
+
+def window(day):
+    _, _, _, start_timestamp, end_timestamp = report_window(datetime(2024, 4, day, tzinfo=timezone.utc), True, None)
+    return start_timestamp, end_timestamp
+
+
+def fetch(api, start_timestamp, end_timestamp, cache=None):
+    rig_ids = [rig['rigId'] for rig in api.iter_rigs()]
+    pool_stats, rig_frames, failed_rig_ids = fetch_stats(api, rig_ids, start_timestamp, end_timestamp, 2, cache)
+    assert not failed_rig_ids
+    return pool_stats, rig_frames
+
+
+def assert_same_stats(stats, expected_stats):
+    # the same samples as fetched without a cache
+    (pool_stats, rig_frames), (expected_pool_stats, expected_rig_frames) = stats, expected_stats
+    pd.testing.assert_frame_equal(pool_stats, expected_pool_stats, check_dtype=False, check_like=True)
+    assert list(rig_frames) == list(expected_rig_frames)
+    for rig_id, algo_frames in rig_frames.items():
+        assert list(algo_frames) == list(expected_rig_frames[rig_id])
+        for algo, df in algo_frames.items():
+            pd.testing.assert_frame_equal(df, expected_rig_frames[rig_id][algo], check_dtype=False, check_like=True)
+
+
+@pytest.mark.parametrize('storage', ['csv', 'mmap'])
+def test_only_samples_past_the_high_water_mark_are_requested(api, tmp_path, storage):
+    start_timestamp, end_timestamp = window(5)
+    fetch(api, start_timestamp, end_timestamp - DAY_MS, TimeseriesCache(str(tmp_path), MONTH, STORAGES[storage]()))
+    # a new cache reads the month back from disk
+    cache = TimeseriesCache(str(tmp_path), MONTH, STORAGES[storage]())
+    for rig_id in [None] + [rig['rigId'] for rig in api.iter_rigs()]:
+        for algo in ALGOS:
+            high_water_mark = cache.high_water_mark('org', rig_id, algo)
+            assert high_water_mark is None or end_timestamp - 2 * DAY_MS < high_water_mark <= end_timestamp - DAY_MS
+            assert cache.start_timestamp('org', rig_id, algo, start_timestamp, end_timestamp) == \
+                (start_timestamp if high_water_mark is None else high_water_mark)
+    assert_same_stats(fetch(api, start_timestamp, end_timestamp, cache), fetch(api, start_timestamp, end_timestamp))
+
+
+@pytest.mark.parametrize('storage', ['csv', 'mmap'])
+def test_cached_samples_past_the_window_are_left_out(api, tmp_path, storage):
+    # a month reported through Apr 12, then again with an earlier end
+    fetch(api, *window(12), TimeseriesCache(str(tmp_path), MONTH, STORAGES[storage]()))
+    start_timestamp, end_timestamp = window(5)
+    cache = TimeseriesCache(str(tmp_path), MONTH, STORAGES[storage]())
+    assert_same_stats(fetch(api, start_timestamp, end_timestamp, cache), fetch(api, start_timestamp, end_timestamp))
+    # the window is cached, the requests are left empty rather than inverted
+    assert {cache.start_timestamp(*key, start_timestamp, end_timestamp) for key in cache.frames
+            if cache.high_water_mark(*key) is not None} == {end_timestamp}
@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+import pool_spy
+import pytest
+from mock_server import MockNicehash
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('numpy', 'pandas', 'matplotlib', 'discord', 'pipeline', 'aiohttp')
+
+
+def imported_heavy_modules(*arguments):
+    # heavy modules imported by a fresh process running pool_spy with arguments
+    code = ('import sys, pool_spy\n'
+            'try:\n'
+            '    pool_spy.main(sys.argv[1:])\n'
+            'except SystemExit:\n'
+            '    pass\n'
+            f'print(" ".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))\n')
+    process = subprocess.run([sys.executable, '-c', code, *arguments], cwd=ROOT, capture_output=True, text=True,
+                             check=True)
+    return process.stdout.splitlines()[-1].split()
+
+
+@pytest.mark.parametrize('arguments', [['--help'], ['report', '--help'], ['batch', '--help']])
+def test_parsing_the_command_line_imports_no_heavy_module(arguments):
+    assert imported_heavy_modules(*arguments) == []
+
+
+def test_rigs_only_imports_the_client():
+    with MockNicehash(nb_rigs=2) as mock:
+        assert imported_heavy_modules('rigs', '-o', 'org', '-b', mock.url, '-k', 'k', '-s', 's') == []
+
+
+def test_command_lines_without_a_subcommand_run_the_report(monkeypatch):
+    reports = []
+    monkeypatch.setattr(pool_spy, 'report', reports.append)
+    pool_spy.main(['-o', 'org', '-k', 'k', '-s', 's', '-m'])
+    assert [(args.command, args.org, args.monthly) for args in reports] == [('report', 'org', True)]
@@ -0,0 +1,139 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+
+import pytest
+import requests
+from nicehash import RateLimitError, ServerError, TokenBucket, async_public_api, public_api
+
+PATH = '/main/api/v2/public/stats/global/current/'
+
+
+class ScriptedServer:
+    # answers each request with the next (status, headers, delay in seconds) of a script, 200 with a json body once
+    # it is exhausted
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.handle_request()
+
+            def do_POST(self):
+                self.handle_request()
+
+            def handle_request(self):
+                server.requests.append((self.command, monotonic()))
+                status, headers, delay = server.script.pop(0) if server.script else (200, {}, 0)
+                sleep(delay)
+                body = json.dumps({'ok': True}).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def test_concurrent_pauses_end_at_the_latest_deadline():
+    bucket = TokenBucket(rate=10)
+    for seconds in [1.0] * 7 + [1.5]:
+        bucket.pause(seconds)
+    assert 1.4 < bucket.reserve() <= 1.6
+    assert 1.4 < bucket.paused_for() <= 1.5
+
+
+def test_callers_that_already_reserved_wait_for_a_later_pause():
+    bucket = TokenBucket(rate=10)
+    assert bucket.reserve() == 0
+    bucket.pause(0.5)
+    assert 0.4 < bucket.paused_for() <= 0.5
+
+
+def test_rate_limited_request_is_retried_after_retry_after():
+    with ScriptedServer([(429, {'Retry-After': '0.3'}, 0)]) as server, public_api(server.url) as api:
+        events = []
+        api.hooks.append(events.append)
+        assert api.request('GET', PATH, '', None) == {'ok': True}
+    (_, first), (_, second) = server.requests
+    assert second - first >= 0.3
+    assert [(event.status_code, event.retried) for event in events] == [(429, True), (200, False)]
+
+
+def test_retry_after_pauses_the_bucket_once():
+    bucket = TokenBucket(rate=100)
+    with ScriptedServer([(429, {'Retry-After': '0.3'}, 0)]) as server, \
+            public_api(server.url, rate_limiter=bucket) as api:
+        start = monotonic()
+        api.request('GET', PATH, '', None)
+        # the retry waits for the paused bucket instead of also sleeping the Retry-After
+        assert 0.3 <= monotonic() - start < 0.55
+    assert len(server.requests) == 2
+
+
+def test_server_errors_are_only_retried_for_idempotent_methods():
+    with ScriptedServer([(503, {}, 0), (200, {}, 0), (503, {}, 0)]) as server, \
+            public_api(server.url, backoff_factor=0.01) as api:
+        assert api.request('GET', PATH, '', None) == {'ok': True}
+        with pytest.raises(ServerError):
+            api.request('POST', PATH, '', {'a': 1})
+    assert [method for method, _ in server.requests] == ['GET', 'GET', 'POST']
+
+
+def test_retries_give_up_after_max_retries():
+    with ScriptedServer([(429, {'Retry-After': '0'}, 0)] * 3) as server, public_api(server.url, max_retries=2) as api:
+        with pytest.raises(RateLimitError):
+            api.request('GET', PATH, '', None)
+    assert len(server.requests) == 3
+
+
+def test_hung_responses_time_out_and_are_retried():
+    with ScriptedServer([(200, {}, 1.0)]) as server, public_api(server.url, timeout=0.2) as api:
+        events = []
+        api.hooks.append(events.append)
+        assert api.request('GET', PATH, '', None) == {'ok': True}
+    assert isinstance(events[0].error, requests.Timeout) and events[0].retried
+    assert len(server.requests) == 2
+
+
+def test_timeouts_give_up_after_max_retries():
+    with ScriptedServer([(200, {}, 1.0)] * 2) as server, public_api(server.url, timeout=0.2, max_retries=1) as api:
+        with pytest.raises(requests.Timeout):
+            api.request('GET', PATH, '', None)
+
+
+def test_async_hung_responses_time_out_and_are_retried():
+    import asyncio
+
+    async def request(url):
+        async with async_public_api(url, timeout=0.2) as api:
+            events = []
+            api.hooks.append(events.append)
+            return await api.request('GET', PATH, '', None), events
+
+    with ScriptedServer([(200, {}, 1.0)]) as server:
+        response, events = asyncio.run(request(server.url))
+    assert response == {'ok': True}
+    assert isinstance(events[0].error, asyncio.TimeoutError) and events[0].retried
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from metrics import RESULT_COLUMNS, compute_metrics, to_fleet
+from nicehash import AlgorithmType
+
+START = 1711929600000  # 2024-04-01 00:00 UTC
+SAMPLE_MS = 5 * 60 * 1000
+NB_DAYS = 3
+
+
+def reference_metrics(rig_frames, rig_names, nb_days):
+    # the per-rig loop of pool_spy.py before the vectorized metrics, fed the same time series
+    df_results = pd.DataFrame(columns=RESULT_COLUMNS)
+    list_daily_hours = []
+    for rig_id, rig_name in rig_names.items():
+        df_ts = pd.concat(list(rig_frames[rig_id].values()), axis=0)
+        df_ts = df_ts.groupby(df_ts.index).agg('sum').sort_index()
+        df_ts = df_ts[['speed_accepted', 'profitability']]
+        speed_diff = df_ts.loc[:, 'speed_accepted'].diff().shift(-1)
+        start_times = df_ts.index.values[:-1]
+        end_times = df_ts.index.values[1:]
+        df_ts = df_ts.iloc[:-1].copy()
+        df_ts['speed_diff'] = speed_diff
+        df_ts['speed_diff'] = df_ts['speed_diff'].fillna(0)
+        df_ts['time_delta'] = end_times - start_times if any(end_times) else 0
+        df_ts.loc[df_ts['time_delta'] > 5 * 60 * 1000, 'speed_diff'] = 0
+        df_ts.index = pd.to_datetime(df_ts.index, unit='ms', utc=True)
+        df_ts = df_ts[df_ts['speed_diff'] != 0]
+        df_daily_hours = df_ts.groupby(df_ts.index.date).sum()['time_delta'] / 1000 / 60 / 60
+        df_daily_hours.name = rig_name
+        list_daily_hours.append(df_daily_hours)
+        total_mining_ms = df_ts['time_delta'].sum()
+        avg_hr_per_day = total_mining_ms / 1000 / 60 / 60 / nb_days
+        mh_per_sec = df_ts[['speed_accepted', 'time_delta']].prod(axis=1).sum() / 1000 / 60 / 60 / 24 / nb_days
+        profitability = df_ts[['profitability', 'time_delta']].prod(axis=1).sum() / 1000 / 60 / 60 / 24 / nb_days
+        df_results = pd.concat([df_results, pd.DataFrame([{'hours/day': avg_hr_per_day, 'MH/s': mh_per_sec,
+                                                           'μBTC/day': profitability * 10 ** 6}],
+                                                         columns=df_results.columns, index=[rig_name])])
+    df_daily_hours = pd.concat(list_daily_hours, axis=1, sort=True).fillna(0)
+    df_daily_hours = df_daily_hours.T.groupby(level=0, sort=True).sum().T
+    df_results.index.name = 'rig'
+    df_results = df_results.reset_index().groupby('rig', sort=True).sum()
+    return df_daily_hours, df_results.astype('float64')
+
+
+def synthetic_fleet(seed=0, nb_rigs=6):
+    # rigs mining one or two algorithms, with idle samples, repeated speeds and gaps over 5 minutes
+    rng = np.random.default_rng(seed)
+    rig_frames = {}
+    for index in range(nb_rigs):
+        times = START + np.arange(NB_DAYS * 24 * 12) * SAMPLE_MS + rng.integers(-1000, 1000)
+        times = times[rng.random(len(times)) > 0.05]
+        algo_frames = {}
+        for algo in (AlgorithmType.KAWPOW, AlgorithmType.DAGGERHASHIMOTO)[:1 + index % 2]:
+            speed = np.where(rng.random(len(times)) < 0.2, 0.0, rng.choice([30.0, 30.0, 42.5, 55.125], len(times)))
+            profitability = speed * rng.uniform(1e-9, 3e-7, len(times))
+            algo_frames[algo] = pd.DataFrame({'speed_accepted': speed, 'profitability': profitability},
+                                             index=pd.Index(times, name='time'))
+        rig_frames[f'rig-{index}'] = algo_frames
+    # two rig ids sharing a name are reported together
+    rig_names = {rig_id: f'rig{index % (nb_rigs - 1)}' for index, rig_id in enumerate(rig_frames)}
+    return rig_frames, rig_names
+
+
+# the reference grows its results with pd.concat from an empty frame, which pandas 2 warns about
+@pytest.mark.filterwarnings('ignore:The behavior of DataFrame concatenation:FutureWarning')
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_compute_metrics_matches_per_rig_loop(seed):
+    rig_frames, rig_names = synthetic_fleet(seed)
+    df_daily_hours, df_results = compute_metrics(to_fleet(rig_frames), rig_names, NB_DAYS)
+    reference_daily_hours, reference_results = reference_metrics(rig_frames, rig_names, NB_DAYS)
+    pd.testing.assert_frame_equal(df_results, reference_results, check_exact=False, rtol=1e-13, atol=0)
+    pd.testing.assert_frame_equal(df_daily_hours, reference_daily_hours, check_exact=False, rtol=1e-13, atol=0,
+                                  check_index_type=False, check_names=False)
+
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+import nicehash
+from nicehash import TimestampPages, next_page
+
+# trades newest first, three per microsecond timestamp, so that pages of 2, 4 or 5 end inside a timestamp
+TRADES = [{'id': f'trade-{index}', 'time': 1_000_000 - index // 3, 'price': '1', 'qty': '1'} for index in range(40)]
+
+
+def trades_before(limit, timestamp):
+    # like the exchange: the limit trades strictly older than timestamp, newest first
+    return [trade for trade in TRADES if timestamp is None or trade['time'] < timestamp][:limit]
+
+
+@pytest.fixture
+def public_api(monkeypatch):
+    api = nicehash.public_api('http://127.0.0.1:1')
+    requests = []
+
+    def get_exchange_trades(market, limit=None, timestamp=None):
+        requests.append(timestamp)
+        return trades_before(limit, timestamp)
+
+    monkeypatch.setattr(api, 'get_exchange_trades', get_exchange_trades)
+    api.requests = requests
+    return api
+
+
+@pytest.mark.parametrize('limit', [4, 5, 7, 40, 100])
+def test_trades_sharing_a_timestamp_across_pages_are_all_returned_once(public_api, limit):
+    trades = list(public_api.iter_exchange_trades('BTCUSDT', limit))
+    assert [trade['id'] for trade in trades] == [trade['id'] for trade in TRADES]
+
+
+def test_next_page_starts_at_the_last_timestamp_included():
+    pages = TimestampPages(4, 'time', int)
+    page = trades_before(4, None)
+    # the page ends with the first of the three trades at 999_999
+    assert [trade['time'] for trade in page] == [1_000_000, 1_000_000, 1_000_000, 999_999]
+    assert pages.next_cursor(page, None) == 1_000_000
+    assert [trade['id'] for trade in pages.items(page)] == ['trade-0', 'trade-1', 'trade-2', 'trade-3']
+    # the next page starts again with trade-3, dropped as already yielded
+    next_page_trades = trades_before(4, 1_000_000)
+    assert [trade['id'] for trade in next_page_trades] == ['trade-3', 'trade-4', 'trade-5', 'trade-6']
+    assert [trade['id'] for trade in pages.items(next_page_trades)] == ['trade-4', 'trade-5', 'trade-6']
+
+
+def test_a_page_sharing_one_timestamp_does_not_loop(public_api):
+    # pages of 2 cannot hold the 3 trades of a timestamp: the pages still move on to older trades
+    trades = list(public_api.iter_exchange_trades('BTCUSDT', 2))
+    assert len({trade['id'] for trade in trades}) == len(trades)
+    assert trades[-1]['time'] == TRADES[-1]['time']
+    assert len(public_api.requests) < len(TRADES)
+
+
+def test_short_page_is_the_last():
+    assert TimestampPages(10, 'time', int).next_cursor(trades_before(10, 999_990), 999_990) is None
+    assert next_page({'pagination': {'totalPageCount': 3}}, 1) == 2
+    assert next_page({'pagination': {'totalPageCount': 3}}, 2) is None
+
+
+def test_async_pages_match(monkeypatch):
+    async def run():
+        async with nicehash.async_public_api('http://127.0.0.1:1') as api:
+            async def get_exchange_trades(market, limit=None, timestamp=None):
+                return trades_before(limit, timestamp)
+
+            monkeypatch.setattr(api, 'get_exchange_trades', get_exchange_trades)
+            return [trade async for trade in api.iter_exchange_trades('BTCUSDT', 4)]
+
+    assert [trade['id'] for trade in asyncio.run(run())] == [trade['id'] for trade in TRADES]
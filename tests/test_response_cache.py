@@ -0,0 +1,84 @@
+import nicehash
+from nicehash import ResponseCache, public_api
+from test_client import ScriptedServer
+
+ALGORITHMS = '/main/api/v2/mining/algorithms/'
+CURRENCIES = '/main/api/v2/public/currencies/'
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(nicehash, 'time', lambda: now[0])
+    cache = ResponseCache()
+    cache.put('a', ALGORITHMS, {'value': 1}, 60)
+    now[0] += 59
+    assert cache.get('a') == (True, {'value': 1})
+    now[0] += 1
+    assert cache.get('a') == (False, None)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(maxsize=2)
+    cache.put('a', ALGORITHMS, 1, 60)
+    cache.put('b', ALGORITHMS, 2, 60)
+    cache.get('a')
+    cache.put('c', ALGORITHMS, 3, 60)
+    assert [key for key in cache.entries] == ['a', 'c']
+
+
+def test_responses_are_copied():
+    cache = ResponseCache()
+    response = {'list': [1]}
+    cache.put('a', ALGORITHMS, response, 60)
+    response['list'].append(2)
+    _, cached = cache.get('a')
+    cached['list'].append(3)
+    assert cache.get('a') == (True, {'list': [1]})
+
+
+def test_invalidate_by_path_and_scope():
+    cache = ResponseCache()
+    for key, path in (('org1|algorithms', ALGORITHMS), ('org1|currencies', CURRENCIES),
+                      ('org2|algorithms', ALGORITHMS)):
+        cache.put(key, path, key, 60)
+    cache.invalidate(ALGORITHMS, 'org1|')
+    assert list(cache.entries) == ['org1|currencies', 'org2|algorithms']
+    cache.invalidate(scope='org1|')
+    assert list(cache.entries) == ['org2|algorithms']
+    cache.invalidate()
+    assert not cache.entries
+
+
+def test_unexpired_entries_are_loaded_by_the_next_process(tmp_path, monkeypatch):
+    filepath = str(tmp_path / 'responses.json')
+    cache = ResponseCache(filepath=filepath)
+    cache.put('fresh', ALGORITHMS, {'value': 1}, 60)
+    cache.put('stale', ALGORITHMS, {'value': 2}, 1)
+    monkeypatch.setattr(nicehash, 'time', lambda: cache.entries['stale'][1])
+    assert list(ResponseCache(filepath=filepath).entries) == ['fresh']
+
+
+def test_clients_only_request_uncached_endpoints_once():
+    with ScriptedServer([]) as server, public_api(server.url, cache=ResponseCache()) as api:
+        for _ in range(3):
+            api.get_algorithms()
+            api.get_currencies()
+            # endpoints without a ttl are always requested
+            api.get_current_global_stats()
+        api.invalidate_cache(ALGORITHMS)
+        api.get_algorithms()
+    assert len(server.requests) == 2 + 3 + 1
+    assert api.cache.hits == 4
+
+
+def test_clients_of_other_scopes_do_not_share_entries():
+    cache = ResponseCache()
+    with ScriptedServer([]) as server:
+        with public_api(server.url, cache=cache) as api:
+            api.get_algorithms()
+        with public_api(server.url, cache=cache) as api:
+            api.get_algorithms()
+        with nicehash.private_api(server.url, 'org', 'k', 's', cache=cache) as api:
+            api.get_algorithms()
+    assert len(server.requests) == 2
@@ -0,0 +1,68 @@
+import json
+
+import pandas as pd
+import pytest
+
+from metrics import HOUR_MS, compute_metrics, daily_totals_from_hourly, hourly_totals, metrics_from_daily_totals, \
+    to_fleet
+from rollups import RollupStore
+from storage import STORAGES
+from test_metrics import NB_DAYS, START, synthetic_fleet
+
+END = START + NB_DAYS * 24 * HOUR_MS
+
+
+def until(rig_frames, timestamp):
+    return {rig_id: {algo: df[df.index <= timestamp] for algo, df in algo_frames.items()}
+            for rig_id, algo_frames in rig_frames.items()}
+
+
+@pytest.mark.parametrize('storage', ['csv', 'mmap'])
+def test_incremental_updates_match_one_update(tmp_path, storage):
+    rig_frames, _ = synthetic_fleet(4)
+    incremental = RollupStore(str(tmp_path / 'incremental'), STORAGES[storage]())
+    one_shot = RollupStore(str(tmp_path / 'one_shot'), STORAGES[storage]())
+    (tmp_path / 'incremental').mkdir()
+    (tmp_path / 'one_shot').mkdir()
+    # runs ending inside hours and right on them, each only recomputing the hours from its watermarks on
+    for end in (START + 5 * HOUR_MS + 17 * 60 * 1000, START + 26 * HOUR_MS, START + 40 * HOUR_MS + 1, END):
+        incremental.update('org', until(rig_frames, end), START, end)
+    one_shot.update('org', rig_frames, START, END)
+    # a new store reads the rollups back from disk
+    incremental = RollupStore(str(tmp_path / 'incremental'), STORAGES[storage]())
+    pd.testing.assert_frame_equal(incremental.hourly_totals('org', rig_frames),
+                                  one_shot.hourly_totals('org', rig_frames), check_exact=False, rtol=1e-12)
+
+
+def test_watermarks_are_the_last_samples(tmp_path):
+    rig_frames, _ = synthetic_fleet(5)
+    store = RollupStore(str(tmp_path), STORAGES['csv']())
+    end = START + 30 * HOUR_MS
+    store.update('org', until(rig_frames, end), START, end)
+    with open(tmp_path / 'rollup_org.json') as fp:
+        watermarks = json.load(fp)
+    assert watermarks == {rig_id: max(int(df.index[df.index <= end][-1]) for df in algo_frames.values())
+                          for rig_id, algo_frames in rig_frames.items()}
+    assert store.rig_ids('org') == list(rig_frames)
+
+
+def test_rollups_match_hourly_totals(tmp_path):
+    rig_frames, _ = synthetic_fleet(6)
+    store = RollupStore(str(tmp_path), STORAGES['mmap']())
+    store.update('org', rig_frames, START, END)
+    df_rollups = store.hourly_totals('org', rig_frames)
+    df_expected = hourly_totals(to_fleet(rig_frames, since=START))
+    # the rollups also hold the hours without mining
+    pd.testing.assert_frame_equal(df_rollups[df_rollups['mining_ms'] > 0], df_expected.astype('float64'),
+                                  check_exact=False, rtol=1e-12)
+    assert len(df_rollups) == len(rig_frames) * NB_DAYS * 24
+
+
+def test_metrics_from_hourly_rollups_match():
+    rig_frames, rig_names = synthetic_fleet(3)
+    df_fleet = to_fleet(rig_frames)
+    df_daily_hours, df_results = compute_metrics(df_fleet, rig_names, NB_DAYS)
+    rollup_daily_hours, rollup_results = metrics_from_daily_totals(daily_totals_from_hourly(hourly_totals(df_fleet)),
+                                                                   rig_names, NB_DAYS)
+    pd.testing.assert_frame_equal(rollup_results, df_results, check_exact=False, rtol=1e-13, atol=0)
+    pd.testing.assert_frame_equal(rollup_daily_hours, df_daily_hours, check_exact=False, rtol=1e-13, atol=0)
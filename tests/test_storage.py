@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from storage import MmapStorage, STORAGES, splice_timeseries
+
+# in the sorted order the storages keep
+COLUMNS = ['profitability', 'speed_accepted']
+
+
+def timeseries(times, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(0, 100, (len(times), len(COLUMNS)))
+    values[rng.random(len(times)) < 0.1, 1] = np.nan
+    return pd.DataFrame(values, index=pd.Index(np.asarray(times, dtype=np.int64), name='time'), columns=COLUMNS)
+
+
+def store(storage, path, df):
+    df_merged = splice_timeseries(storage.load(path), df)
+    storage.store(path, df, df_merged)
+    return df_merged
+
+
+def files(path):
+    return sorted(name for name in os.listdir(path) if name != 'meta.json')
+
+
+@pytest.mark.parametrize('storage', ['csv', 'mmap'])
+def test_loads_what_was_merged(tmp_path, storage):
+    storage = STORAGES[storage]()
+    path = str(tmp_path / f'series{storage.extension}')
+    df_full = timeseries(range(0, 3000, 10))
+    for chunk in (df_full.iloc[:100], df_full.iloc[90:200], df_full.iloc[200:]):
+        df_merged = store(storage, path, chunk)
+    pd.testing.assert_frame_equal(df_merged, df_full)
+    pd.testing.assert_frame_equal(storage.load(path), df_full)
+
+
+def test_mmap_appends_after_the_committed_rows(tmp_path):
+    storage = MmapStorage()
+    path = str(tmp_path / 'series.mmap')
+    df = timeseries(range(0, 1000, 10))
+    store(storage, path, df.iloc[:50])
+    # samples fetched again, the same as the committed ones, are skipped and the rest appended to the same files
+    store(storage, path, df.iloc[40:])
+    assert storage.read_meta(path) == {'columns': COLUMNS, 'length': 100, 'generation': 0}
+    assert files(path) == ['time.i8', 'values.f8']
+    pd.testing.assert_frame_equal(storage.load(path), df)
+
+
+def test_mmap_writes_a_new_generation_for_changed_rows(tmp_path):
+    storage = MmapStorage()
+    path = str(tmp_path / 'series.mmap')
+    df = timeseries(range(0, 1000, 10))
+    store(storage, path, df)
+    df_loaded = storage.load(path)
+    df_changed = timeseries(range(500, 1200, 10), seed=1)
+    store(storage, path, df_changed)
+    assert storage.read_meta(path)['generation'] == 1
+    assert files(path) == ['time.1.i8', 'values.1.f8']
+    pd.testing.assert_frame_equal(storage.load(path), pd.concat([df.iloc[:50], df_changed]))
+    # committed rows are never overwritten, a frame loaded before still reads them on platforms keeping removed
+    # files mapped
+    pd.testing.assert_frame_equal(df_loaded, df)
+
+
+def test_mmap_keeps_the_committed_rows_of_an_interrupted_store(tmp_path):
+    storage = MmapStorage()
+    path = str(tmp_path / 'series.mmap')
+    df = timeseries(range(0, 1000, 10))
+    store(storage, path, df.iloc[:60])
+    # rows written but never committed by the meta file, as after a crash, are not loaded
+    storage.write_rows(path, 0, 60, df.iloc[60:])
+    pd.testing.assert_frame_equal(storage.load(path), df.iloc[:60])
+    store(storage, path, df.iloc[60:])
+    pd.testing.assert_frame_equal(storage.load(path), df)
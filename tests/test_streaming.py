@@ -0,0 +1,54 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from pipeline import ts_dict_to_df
+from streaming import estimate_capacity, parse_stats
+
+COLUMNS = ['time', 'speed_accepted', 'speed_rejected_total', 'profitability']
+
+
+def payload(nb_rows, seed=0):
+    # rows out of order, with integer and null values like the stats endpoints return
+    rng = np.random.default_rng(seed)
+    times = 1711929600000 + rng.permutation(nb_rows) * 300000
+    data = [[int(time), float(rng.uniform(0, 100)), 0 if rng.random() < 0.5 else None,
+             float(rng.uniform(1e-9, 1e-5))] for time in times]
+    return {'columns': COLUMNS, 'data': data}
+
+
+@pytest.mark.parametrize('nb_rows, capacity', [(0, 1024), (1, 1), (100, 7), (300, 1024)])
+def test_parse_stats_matches_ts_dict_to_df(nb_rows, capacity):
+    response = payload(nb_rows)
+    df = parse_stats(io.BytesIO(json.dumps(response).encode()), capacity)
+    df_expected = ts_dict_to_df(response)
+    pd.testing.assert_frame_equal(df, df_expected, check_dtype=False, check_index_type=nb_rows > 0, check_exact=True)
+    assert (df.dtypes == np.float64).all() and df.index.dtype == np.int64
+
+
+def test_capacity_covers_the_window():
+    assert estimate_capacity(0, 24 * 60 * 60 * 1000) == 24 * 12 + 1
+    assert estimate_capacity(None, 0) == 1024
+
+
+def test_streamed_stats_match_against_the_mock():
+    from mock_server import MockNicehash
+    from nicehash import private_api
+    from pipeline import fetch_stats
+
+    with MockNicehash(nb_rigs=2) as mock, private_api(mock.url, 'org', 'k', 's') as api:
+        rig_ids = [rig['rigId'] for rig in api.iter_rigs()]
+        start_timestamp, end_timestamp = 1711929600000, 1711929600000 + 2 * 24 * 60 * 60 * 1000
+        pool_stats, rig_frames, _ = fetch_stats(api, rig_ids, start_timestamp, end_timestamp, 2)
+        streamed_pool_stats, streamed_rig_frames, _ = fetch_stats(api, rig_ids, start_timestamp, end_timestamp, 2,
+                                                                  stream=True)
+    pd.testing.assert_frame_equal(streamed_pool_stats, pool_stats, check_dtype=False,
+                                  check_index_type=len(pool_stats) > 0, check_exact=True)
+    for rig_id, algo_frames in rig_frames.items():
+        for algo, df in algo_frames.items():
+            # ts_dict_to_df leaves the index of an empty response untyped
+            pd.testing.assert_frame_equal(streamed_rig_frames[rig_id][algo], df, check_dtype=False,
+                                          check_index_type=len(df) > 0, check_exact=True)